@@ -1,4 +1,5 @@
 import codecs
+import os
 import sys
 
 import numpy as np
@@ -6,18 +7,28 @@ from scipy.sparse.coo import coo_matrix
 from scipy.io import mmwrite
 import six
 
-from tools.feature_extraction import apply_threshold, new_tensor_slice, \
-    create_vectorizer
+from tools.feature_extraction import apply_threshold, \
+    merge_tensor_slice_headers, append_headers, \
+    create_pretokenized_vectorizer, tokenize_documents, \
+    StreamingTfidfVectorizer, write_streaming_keyword_slice
 from tools.datasets import dataset_mails, dataset_small
+from tools.token_cache import TokenCache
 
 YES = {'y', 'yes', 't', 'true'}
 
+# The documents dir can also be a corpus pack file (see build_corpus_pack.py),
+# its document ids are used as document names.
 if len(sys.argv) < 2:
-    raise Exception('ARGS: <documents dir> <rescal dir>')
+    raise Exception('ARGS: <documents dir or corpus pack> <rescal dir> '
+                    '[<use small dataset> [<tokenization jobs> '
+                    '[<streaming chunk size>]]]')
 
 use_small_dataset = len(sys.argv) > 3 and sys.argv[3].lower() in YES
 doc_path = sys.argv[1]
 rescal_path = sys.argv[2]
+jobs = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+# 0 extracts the keywords of all documents at once in memory
+streaming_chunksize = int(sys.argv[5]) if len(sys.argv) > 5 else 0
 
 
 def get_document_names(path_prefix, file_paths):
@@ -39,22 +50,23 @@ print('Loading documents.')
 if use_small_dataset:
     docs, input_type, tokenizer = dataset_small()
     paths = docs
+elif os.path.isfile(doc_path):
+    paths, input_type, tokenizer = dataset_mails(doc_path)
+    docs = paths.ids
 else:
     unchecked_paths, input_type, tokenizer = dataset_mails(doc_path)
     docs, paths = get_document_names(doc_path, unchecked_paths)
 
 print('Loaded ', len(docs), ' files from path: ', doc_path, '.')
 
-print('Extracting features.')
-vectorizer = create_vectorizer(input_type, tokenizer=tokenizer,
-                               ngram_range=(1, 1))
-
-data = vectorizer.fit_transform(paths)
-features = vectorizer.get_feature_names()
-
-data = coo_matrix(data)
-
-data = apply_threshold(data, 0.1)  # Filter out everything, that is too weak.
+# The tokens of the documents are cached by content in the rescal dir, so
+# only new or changed documents are tokenized when the script runs again.
+# The namespace contains the tokenizer configuration, so changed tokenizers
+# don't use the old tokens.
+corpus = 'small' if use_small_dataset else \
+    'pack' if os.path.isfile(doc_path) else 'mails'
+cache = TokenCache(rescal_path + '/token_cache.sqlite',
+                   namespace=corpus + ' ' + tokenizer.config())
 
 print('Reading headers.')
 with codecs.open(rescal_path + '/headers.txt', 'r', encoding='utf8') as f:
@@ -63,17 +75,48 @@ with codecs.open(rescal_path + '/headers.txt', 'r', encoding='utf8') as f:
 DOCUMENT = 'Need: '
 FEATURE = 'Attr: '
 
-new_headers, offsets = new_tensor_slice(original_headers, [
+tokens = tokenize_documents(paths, tokenizer, input_type, n_jobs=jobs,
+                            cache=cache)
+
+if streaming_chunksize > 0:
+    # Out-of-core mode: hashed features and document frequencies are kept
+    # incrementally, the keyword slice is written chunk by chunk.
+    print('Extracting keywords in chunks of ', streaming_chunksize,
+          ' documents with ', jobs, ' tokenization jobs.')
+    vectorizer = StreamingTfidfVectorizer(ngram_range=(1, 1))
+    new_headers = write_streaming_keyword_slice(
+        tokens, docs, original_headers, rescal_path + '/keyword.mtx',
+        vectorizer, threshold=0.1, chunksize=streaming_chunksize,
+        document_prefix=DOCUMENT, feature_prefix=FEATURE)
+    print('Token cache: ', cache.statistics(), ', evicted ',
+          cache.evict_unused(), ' entries of removed documents.')
+    cache.close()
+
+    print('Writing headers.')
+    append_headers(rescal_path + '/headers.txt', original_headers, new_headers)
+    sys.exit(0)
+
+print('Extracting features with ', jobs, ' tokenization jobs.')
+vectorizer = create_pretokenized_vectorizer(ngram_range=(1, 1))
+
+data = vectorizer.fit_transform(tokens)
+print('Token cache: ', cache.statistics(), ', evicted ',
+      cache.evict_unused(), ' entries of removed documents.')
+cache.close()
+features = vectorizer.get_feature_names()
+
+data = coo_matrix(data)
+
+data = apply_threshold(data, 0.1)  # Filter out everything, that is too weak.
+
+new_headers, offsets = merge_tensor_slice_headers(original_headers, [
     (DOCUMENT, docs, data.row), (FEATURE, features, data.col)]
 )
 
-document_offsets = offsets[DOCUMENT]
-feature_offsets = offsets[FEATURE]
-
 print('Offsetting slice.')
 
-offset_row = np.array([document_offsets[docs[d]] - 1 for d in data.row])
-offset_col = np.array([feature_offsets[features[d]] - 1 for d in data.col])
+offset_row = np.take(offsets[DOCUMENT], data.row)
+offset_col = np.take(offsets[FEATURE], data.col)
 
 print('Contrasting slice.')
 contrasted_data = (data.data > 0).astype(float)
@@ -81,11 +124,7 @@ contrasted_data = (data.data > 0).astype(float)
 offset_matrix = coo_matrix((contrasted_data, (offset_row, offset_col)))
 
 print('Writing headers.')
-
-with codecs.open(rescal_path + '/headers.txt', 'w', encoding='utf8') as f:
-    f.write('\n'.join(new_headers))
+append_headers(rescal_path + '/headers.txt', original_headers, new_headers)
 
 print('Writing keywords.')
 mmwrite(rescal_path + '/keyword.mtx', offset_matrix)
-
-
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+import logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s %(levelname)-8s %(message)s',
+                    datefmt='%a, %d %b %Y %H:%M:%S')
+_log = logging.getLogger()
+
+import os
+import codecs
+import argparse
+
+from tools.datasets import dataset_mails, dataset_small
+from tools.token_cache import TokenCache
+from tools.feature_extraction import tokenize_documents, append_headers
+from tools.lda import BowCorpus, create_dictionary, load_or_fit_lda, document_topics, write_topic_slice
+
+# Create a topic slice (topic.mtx) for the tensor: an LDA topic model is trained over the streamed documents (mail
+# folder or corpus pack, see build_corpus_pack.py) and every need is connected to its most probable topics, which are
+# added as "Attr: topic_<n>" attributes to the headers. A few hundred topic attributes can replace the thousands of
+# keyword attributes of the keyword slice (add_keyword_slice.py), which keeps the tensor dimension small. The tokens
+# of the documents are cached in the same token cache as the keyword extraction, the model is cached in the tensor
+# folder and only trained again if the documents or parameters change.
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='create a need to LDA topic slice for the tensor')
+    parser.add_argument('-documents', action="store", dest="documents", required=True,
+                        help="folder with the .eml mail files or corpus pack file")
+    parser.add_argument('-tensorfolder', action="store", dest="tensorfolder", required=True,
+                        help="tensor folder with the headers.txt file, the topic.mtx slice is written to it")
+    parser.add_argument('-smalldataset', action="store_true", dest="smalldataset",
+                        help="use the small example dataset instead of the documents")
+    parser.add_argument('-topics', action="store", dest="topics", type=int, default=200,
+                        help="number of LDA topics")
+    parser.add_argument('-toptopics', action="store", dest="toptopics", type=int, default=3,
+                        help="maximum number of topics per need in the slice")
+    parser.add_argument('-minprobability', action="store", dest="minprobability", type=float, default=0.05,
+                        help="minimum probability of a topic of a need in the slice")
+    parser.add_argument('-passes', action="store", dest="passes", type=int, default=1,
+                        help="number of LDA training passes over the documents")
+    parser.add_argument('-chunksize', action="store", dest="chunksize", type=int, default=2000,
+                        help="number of documents per online LDA update and topic inference")
+    parser.add_argument('-workers', action="store", dest="workers", type=int, default=None,
+                        help="number of LDA worker processes (default: number of cpus - 1)")
+    parser.add_argument('-jobs', action="store", dest="jobs", type=int, default=1,
+                        help="number of tokenization worker processes")
+    parser.add_argument('-nobelow', action="store", dest="nobelow", type=int, default=3,
+                        help="minimum number of documents of a term")
+    parser.add_argument('-noabove', action="store", dest="noabove", type=float, default=0.5,
+                        help="maximum fraction of the documents of a term")
+    parser.add_argument('-maxterms', action="store", dest="maxterms", type=int, default=100000,
+                        help="maximum number of (the most frequent) terms")
+    parser.add_argument('-modelfile', action="store", dest="modelfile", default=None,
+                        help="file of the cached LDA model (default: <tensorfolder>/topic_lda.model)")
+    parser.add_argument('-seed', action="store", dest="seed", type=int, default=None,
+                        help="seed of the LDA model")
+    args = parser.parse_args()
+
+    _log.info("Load documents: " + args.documents)
+    if args.smalldataset:
+        paths, input_type, tokenizer = dataset_small()
+        docs = paths
+        namespace = 'small'
+    elif os.path.isfile(args.documents):
+        paths, input_type, tokenizer = dataset_mails(args.documents)
+        docs = paths.ids
+        namespace = 'pack'
+    else:
+        paths, input_type, tokenizer = dataset_mails(args.documents)
+        docs = [os.path.basename(path)[:-len('.eml')] for path in paths]
+        namespace = 'mails'
+    _log.info("Loaded %d documents" % len(docs))
+
+    # the token cache is shared with the keyword extraction (same namespace of corpus and tokenizer configuration), the
+    # passes over the documents after the first one only read the cached tokens
+    cache = TokenCache(args.tensorfolder + '/token_cache.sqlite', namespace=namespace + ' ' + tokenizer.config())
+
+    def token_lists():
+        return tokenize_documents(paths, tokenizer, input_type, n_jobs=args.jobs, cache=cache)
+
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+    _log.info("Create dictionary")
+    dictionary = create_dictionary(token_lists(), ENGLISH_STOP_WORDS, no_below=args.nobelow, no_above=args.noabove,
+                                   keep_n=args.maxterms)
+    _log.info("Dictionary of %d terms" % len(dictionary))
+    corpus = BowCorpus(token_lists, dictionary, ENGLISH_STOP_WORDS)
+
+    modelfile = args.modelfile or args.tensorfolder + '/topic_lda.model'
+    model, cached = load_or_fit_lda(modelfile, corpus, dictionary, n_topics=args.topics, passes=args.passes,
+                                    chunksize=args.chunksize, workers=args.workers, seed=args.seed)
+    _log.info(("Loaded cached LDA model: " if cached else "Trained LDA model: ") + modelfile)
+
+    _log.info("Infer the topics of the documents")
+    rows, cols, _ = document_topics(model, corpus, n_top=args.toptopics, min_probability=args.minprobability,
+                                    chunksize=args.chunksize)
+    _log.info("Token cache: %s" % cache.statistics())
+    cache.close()
+
+    headerfile = args.tensorfolder + '/headers.txt'
+    with codecs.open(headerfile, 'r', encoding='utf8') as f:
+        headers = f.read().splitlines()
+    _log.info("Write topic slice with %d entries (%d topics)" % (len(rows), len(set(cols))))
+    new_headers = write_topic_slice(headers, docs, rows, cols, args.topics, args.tensorfolder + '/topic.mtx')
+    append_headers(headerfile, headers, new_headers)
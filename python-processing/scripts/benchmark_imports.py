@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+import logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s %(levelname)-8s %(message)s',
+                    datefmt='%a, %d %b %Y %H:%M:%S')
+_log = logging.getLogger()
+
+import os
+import sys
+import json
+import codecs
+import argparse
+import subprocess
+
+from time import strftime
+
+# Import-time benchmark of the modules in tools/ and of the command line scripts (started with "-h"). Every entry
+# point is imported or started in a new python process, the time of the import (without the interpreter startup) is
+# measured and the heavy dependencies that were loaded by it are reported. The luigi workflow starts the scripts for
+# every experiment, so their startup latency should stay low.
+
+MODULES = ['tools.pair_index', 'tools.tensor_utils', 'tools.evaluation_utils', 'tools.graph_utils',
+           'tools.cosine_link_prediction', 'tools.instrumentation', 'tools.synthetic_tensor', 'tools.token_cache',
+           'tools.corpus_pack', 'tools.feature_extraction', 'tools.datasets', 'tools.lda']
+
+SCRIPTS = ['evaluate_link_prediction.py', 'extract_statistic_details.py', 'generate_synthetic_tensor.py',
+           'benchmark_tensor_utils.py', 'scaling_benchmark.py', 'benchmark_tokenization.py',
+           'build_corpus_pack.py', 'add_topic_slice.py']
+
+HEAVY_MODULES = ['sklearn', 'sklearn.metrics', 'nltk', 'rescal', 'gexf', 'scipy.spatial', 'gensim', 'luigi']
+
+# code executed in the new process: import the module or run the script and print the time and loaded heavy modules
+MEASURE_CODE = """
+import sys, time, json, runpy
+stdout = sys.stdout
+start = time.time()
+try:
+    %s
+except SystemExit:
+    pass
+duration = time.time() - start
+sys.stdout = stdout
+print(json.dumps({'time': duration, 'modules': [m for m in %r if m in sys.modules]}))
+"""
+
+
+# measure the import of a module or the start of a script (with "-h") in a new process, return the time and the
+# loaded heavy modules of the run (or an error message)
+def measure(python, statement, env):
+    code = MEASURE_CODE % (statement, HEAVY_MODULES)
+    process = subprocess.Popen([python, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    out, err = process.communicate()
+    lines = out.decode('utf8').strip().splitlines()
+    if process.returncode != 0 or len(lines) == 0:
+        return None, err.decode('utf8').strip().splitlines()[-1:] or ['exit code %d' % process.returncode]
+    return json.loads(lines[-1]), None
+
+# measure an entry point "repeat" times and return its result dict with the minimum time
+def benchmark(name, python, statement, env, repeat):
+    times = []
+    modules = []
+    for i in range(repeat):
+        result, error = measure(python, statement, env)
+        if result is None:
+            _log.warn("%s failed: %s" % (name, error[0]))
+            return {'entry_point': name, 'error': error[0]}
+        times.append(result['time'])
+        modules = result['modules']
+    _log.info("%-40s %8.3fs  heavy modules: %s" % (name, min(times), ", ".join(modules)))
+    return {'entry_point': name, 'times': times, 'min': min(times), 'heavy_modules': modules}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='benchmark the import time of the tools modules and scripts')
+    parser.add_argument('-python', action="store", dest="python", default=sys.executable,
+                        help="python interpreter to benchmark")
+    parser.add_argument('-repeat', action="store", dest="repeat", type=int, default=5,
+                        help="number of measurements of every entry point (the minimum is reported)")
+    parser.add_argument('-outputfile', action="store", dest="outputfile", default=None,
+                        help="JSON file to write the results to")
+    parser.add_argument('-compare', action="store", dest="compare", default=None,
+                        help="JSON results file of a previous run to compare the results with")
+    args = parser.parse_args()
+
+    scripts_folder = os.path.dirname(os.path.abspath(__file__))
+    root_folder = os.path.dirname(scripts_folder)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([root_folder, os.path.join(root_folder, 'tools')] +
+                                        ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+
+    results = []
+    for module in MODULES:
+        results.append(benchmark(module, args.python, 'import ' + module, env, args.repeat))
+    for script in SCRIPTS:
+        path = os.path.join(scripts_folder, script)
+        statement = "sys.argv = [%r, '-h']; sys.stdout = open(%r, 'w'); runpy.run_path(%r, run_name='__main__')" % \
+                    (path, os.devnull, path)
+        results.append(benchmark(script, args.python, statement, env, args.repeat))
+
+    if args.outputfile:
+        info = {'time': strftime("%Y-%m-%d_%H%M%S"), 'python': args.python, 'parameters': vars(args)}
+        file = codecs.open(args.outputfile, 'w', encoding='utf8')
+        json.dump({'info': info, 'results': results}, file, indent=2, sort_keys=True)
+        file.close()
+
+    if args.compare:
+        file = codecs.open(args.compare, 'r', encoding='utf8')
+        previous = dict((r['entry_point'], r['min']) for r in json.load(file)['results'] if 'min' in r)
+        file.close()
+        for result in results:
+            if 'min' in result and result['entry_point'] in previous:
+                _log.info("%-40s %8.3fs -> %8.3fs" % (result['entry_point'], previous[result['entry_point']],
+                                                      result['min']))
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+import logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s %(levelname)-8s %(message)s',
+                    datefmt='%a, %d %b %Y %H:%M:%S')
+_log = logging.getLogger()
+
+import os
+import sys
+import json
+import time
+import codecs
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+import scipy
+from time import strftime
+from tools.pair_index import PairIndex
+from tools.instrumentation import peak_rss_mb
+from tools.synthetic_tensor import create_synthetic_tensor, write_tensor_folder, SLICE_FILES
+from tools.cosine_link_prediction import cosinus_link_prediciton, cosine_distance_array
+from tools.tensor_utils import SparseTensor, TensorStatistics, read_input_tensor, connection_indices, \
+    mask_rows_and_columns, mask_symmetric_entries, subsample_symmetric_row_entries, execute_rescal, \
+    predict_rescal_connections_array, predict_rescal_connections_by_threshold, \
+    predict_rescal_connections_by_need_similarity
+
+# Micro-benchmark suite for the tensor utils and the link predictors on synthetic tensors (see synthetic_tensor.py).
+# For every scale (number of needs) a synthetic tensor folder is created and the following functions are timed:
+# read_input_tensor, the SparseTensor accessors, the masking helpers, execute_rescal, the three RESCAL predictors, the
+# cosine prediction and the gexf graph creation. The results are written as JSON file (together with the git revision
+# and the parameters) and can be compared with the results of another run, e.g. of a previous commit, with "-compare".
+
+
+# return the git revision of the repository of this script (or None if it is not available)
+def git_revision():
+    try:
+        folder = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=folder).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# run the function "repeat" times and return a result dict with the wall times of all runs
+def time_function(name, scale, function, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    _log.info("benchmark %s (%d needs): min %fs, mean %fs" % (name, scale, min(times), np.mean(times)))
+    return {'benchmark': name, 'scale': scale, 'times': times, 'min': min(times), 'mean': float(np.mean(times)),
+            'peak_rss_mb': peak_rss_mb()}
+
+# return a result dict for a benchmark that was skipped
+def skip_benchmark(name, scale, reason):
+    _log.info("skip benchmark %s (%d needs): %s" % (name, scale, reason))
+    return {'benchmark': name, 'scale': scale, 'skipped': reason}
+
+# return the benchmarks of a scale as list of (name, function, reason) tuples, if "reason" is not None the benchmark
+# is skipped. The tensor is read from the folder (created before) and the test needs, pairs and RESCAL factors are
+# prepared once, so that every benchmark only times its function.
+def create_benchmarks(folder, scale, args, random_state):
+    header_file = folder + "/headers.txt"
+    data_files = [folder + "/" + filename for slice, filename in SLICE_FILES]
+    slices = [slice for slice, filename in SLICE_FILES]
+    tensor = read_input_tensor(header_file, data_files, slices, True)
+    dense = tensor.shape[0] <= args.maxdense
+    dense_reason = None if dense else "tensor dimension %d > %d (-maxdense)" % (tensor.shape[0], args.maxdense)
+
+    needs = np.array(tensor.getNeedIndices())
+    offers = tensor.getOfferIndices()
+    wants = tensor.getWantIndices()
+    test_needs = np.sort(random_state.choice(needs, min(args.testneeds, len(needs)), replace=False))
+    pairs = PairIndex.fromProduct(test_needs, needs)
+    keep = np.ones(tensor.shape[0], dtype=bool)
+    keep[test_needs] = False
+    con = tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE)
+    test_connections = con[test_needs].tocoo()
+    A, R = execute_rescal(tensor, args.rank)
+
+    benchmarks = [
+        ('read_input_tensor', lambda: read_input_tensor(header_file, data_files, slices, True), None),
+        ('TensorStatistics', lambda: TensorStatistics(tensor), None),
+        ('getNeedIndices', lambda: (tensor.getNeedIndices(), tensor.getOfferIndices(), tensor.getWantIndices()),
+         None),
+        ('getSliceMatrixList', lambda: tensor.getSliceMatrixList(), None),
+        ('getArrayFromSliceMatrix', lambda: tensor.getArrayFromSliceMatrix(SparseTensor.CONNECTION_SLICE, pairs),
+         None),
+        ('getAttributesForNeed', lambda: [tensor.getAttributesForNeed(need, SparseTensor.ATTR_SUBJECT_SLICE)
+                                          for need in test_needs], None),
+        ('connection_indices', lambda: connection_indices(tensor), None),
+        ('mask_rows_and_columns', lambda: mask_rows_and_columns(con, keep), None),
+        ('mask_symmetric_entries', lambda: mask_symmetric_entries(con, test_needs[test_connections.row],
+                                                                   test_connections.col), None),
+        ('subsample_symmetric_row_entries', lambda: subsample_symmetric_row_entries(con, args.maxconnections), None),
+        ('execute_rescal', lambda: execute_rescal(tensor, args.rank), None),
+        ('predict_rescal_connections_array', lambda: predict_rescal_connections_array(A, R, pairs), None),
+        ('predict_rescal_connections_by_threshold', lambda: predict_rescal_connections_by_threshold(
+            A, R, args.threshold, offers, wants, test_needs), dense_reason),
+        ('predict_rescal_connections_by_need_similarity', lambda: predict_rescal_connections_by_need_similarity(
+            A, args.similarity, offers, wants, test_needs), dense_reason),
+        ('cosine_distance_array', lambda: cosine_distance_array(tensor, pairs), None),
+        ('cosinus_link_prediciton', lambda: cosinus_link_prediciton(
+            tensor, test_needs[:args.cosineneeds], args.cosine, 0.0, False), dense_reason),
+    ]
+
+    # the gexf graph creation needs the optional pygexf module
+    try:
+        from tools.graph_utils import create_gexf_graph, write_gexf_graph
+        gexf_file = folder + "/graph.gexf"
+        benchmarks.append(('create_gexf_graph', lambda: create_gexf_graph(tensor), None))
+        benchmarks.append(('write_gexf_graph', lambda: write_gexf_graph(tensor, gexf_file), None))
+    except ImportError as e:
+        benchmarks.append(('create_gexf_graph', None, "gexf module not available: %s" % e))
+        benchmarks.append(('write_gexf_graph', None, "gexf module not available: %s" % e))
+    return benchmarks
+
+# run all (selected) benchmarks of a scale and return the result dicts
+def run_scale(scale, args, random_state):
+    _log.info("------------------------------")
+    _log.info("Scale: %d needs" % scale)
+    _log.info("------------------------------")
+    folder = tempfile.mkdtemp(prefix="benchmark_tensor_") if args.datafolder is None else \
+        args.datafolder + "/needs%d" % scale
+    try:
+        start = time.time()
+        synthetic = create_synthetic_tensor(scale, int(scale * args.attributeratio),
+                                            seed=random_state.randint(2 ** 31))
+        write_tensor_folder(synthetic, folder)
+        results = [{'benchmark': 'create_synthetic_tensor', 'scale': scale, 'times': [time.time() - start],
+                    'entities': synthetic.shape[0],
+                    'nnz': dict((filename, synthetic.data[slice].nnz) for slice, filename in SLICE_FILES)}]
+        synthetic = None
+
+        for name, function, reason in create_benchmarks(folder, scale, args, random_state):
+            if args.benchmarks and name not in args.benchmarks:
+                continue
+            if reason is not None:
+                results.append(skip_benchmark(name, scale, reason))
+            else:
+                results.append(time_function(name, scale, function, args.repeat))
+        return results
+    finally:
+        if args.datafolder is None:
+            shutil.rmtree(folder)
+
+# log the change of the minimal times of the benchmarks compared to the results of a previous run
+def compare_results(results, filename):
+    file = codecs.open(filename, 'r', encoding='utf8')
+    previous = json.load(file)
+    file.close()
+    previous_times = dict(((r['benchmark'], r['scale']), r['min']) for r in previous['results'] if 'min' in r)
+    _log.info("Compare with results of revision %s: %s" % (previous['info'].get('revision'), filename))
+    for result in results:
+        key = (result['benchmark'], result['scale'])
+        if 'min' in result and key in previous_times and previous_times[key] > 0:
+            _log.info("%s (%d needs): %fs -> %fs (%.2fx)" % (key[0], key[1], previous_times[key], result['min'],
+                                                              previous_times[key] / max(result['min'], 1e-9)))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='benchmark the tensor utils and link predictors on synthetic tensors')
+    parser.add_argument('-outputfile', action="store", dest="outputfile", default=None,
+                        help="JSON file to write the results to (default: benchmark_<time>.json)")
+    parser.add_argument('-scales', action="store", dest="scales", type=int, nargs="+", default=[1000, 5000, 20000],
+                        help="numbers of needs of the synthetic tensors")
+    parser.add_argument('-attributeratio', action="store", dest="attributeratio", type=float, default=0.5,
+                        help="number of attributes per need of the synthetic tensors")
+    parser.add_argument('-repeat', action="store", dest="repeat", type=int, default=3,
+                        help="number of runs of every benchmark (the minimum and mean are reported)")
+    parser.add_argument('-benchmarks', action="store", dest="benchmarks", nargs="+", default=None,
+                        help="only run these benchmarks (function names)")
+    parser.add_argument('-testneeds', action="store", dest="testneeds", type=int, default=100,
+                        help="number of test needs for the accessor, masking and prediction benchmarks")
+    parser.add_argument('-cosineneeds', action="store", dest="cosineneeds", type=int, default=5,
+                        help="number of test needs for cosinus_link_prediciton")
+    parser.add_argument('-maxdense', action="store", dest="maxdense", type=int, default=15000,
+                        help="skip the benchmarks that use dense matrices of the size of the tensor for tensor "
+                             "dimensions above this value")
+    parser.add_argument('-rank', action="store", dest="rank", type=int, default=10,
+                        help="rank of the RESCAL factorization")
+    parser.add_argument('-threshold', action="store", dest="threshold", type=float, default=0.02,
+                        help="threshold of the RESCAL prediction")
+    parser.add_argument('-similarity', action="store", dest="similarity", type=float, default=0.6,
+                        help="threshold of the RESCAL need similarity prediction")
+    parser.add_argument('-cosine', action="store", dest="cosine", type=float, default=0.5,
+                        help="threshold of the cosine prediction")
+    parser.add_argument('-maxconnections', action="store", dest="maxconnections", type=int, default=5,
+                        help="number of connections per row that subsample_symmetric_row_entries keeps")
+    parser.add_argument('-datafolder', action="store", dest="datafolder", default=None,
+                        help="keep the synthetic tensor folders in this folder (default: temporary folders)")
+    parser.add_argument('-seed', action="store", dest="seed", type=int, default=1,
+                        help="seed of the synthetic tensors and test needs")
+    parser.add_argument('-compare', action="store", dest="compare", default=None,
+                        help="JSON results file of a previous run to compare the results with")
+    args = parser.parse_args()
+
+    start_time = strftime("%Y-%m-%d_%H%M%S")
+    outputfile = args.outputfile or "benchmark_" + start_time + ".json"
+    random_state = np.random.RandomState(args.seed)
+    results = []
+    for scale in args.scales:
+        results += run_scale(scale, args, random_state)
+
+    info = {'revision': git_revision(), 'time': start_time, 'python': sys.version, 'numpy': np.__version__,
+            'scipy': scipy.__version__, 'parameters': vars(args)}
+    _log.info("Write benchmark results: " + outputfile)
+    file = codecs.open(outputfile, 'w', encoding='utf8')
+    json.dump({'info': info, 'results': results}, file, indent=2, sort_keys=True)
+    file.close()
+
+    if args.compare:
+        compare_results(results, args.compare)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+import logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s %(levelname)-8s %(message)s',
+                    datefmt='%a, %d %b %Y %H:%M:%S')
+_log = logging.getLogger()
+
+import sys
+import copy
+import json
+import time
+import codecs
+import argparse
+import multiprocessing
+
+from time import strftime
+from tools.datasets import dataset_mails, dataset_small
+from tools.token_cache import TokenCache
+from tools.feature_extraction import tokenize_documents, create_pretokenized_vectorizer
+
+# Benchmark of the (parallel) tokenization of the keyword extraction (add_keyword_slice.py): the documents are
+# tokenized, POS-tagged and lemmatized with tokenize_documents() with different numbers of worker processes and the
+# documents per second are reported. Optionally the vectorization of the tokenized documents is included.
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='benchmark the parallel tokenization of the keyword extraction')
+    parser.add_argument('-documents', action="store", dest="documents", default=None,
+                        help="folder with the .eml mail files or corpus pack file (default: the small example dataset)")
+    parser.add_argument('-limit', action="store", dest="limit", type=int, default=0,
+                        help="only tokenize this number of documents (0 for all)")
+    parser.add_argument('-repeat', action="store", dest="repeat", type=int, default=1,
+                        help="number of times the small example dataset is repeated")
+    parser.add_argument('-jobs', action="store", dest="jobs", type=int, nargs="+", default=[1, 4, 16],
+                        help="numbers of tokenization worker processes")
+    parser.add_argument('-chunksize', action="store", dest="chunksize", type=int, default=64,
+                        help="number of documents passed to a worker at once")
+    parser.add_argument('-vectorize', action="store_true", dest="vectorize",
+                        help="also fit the vectorizer on the tokenized documents")
+    parser.add_argument('-cache', action="store", dest="cache", default=None,
+                        help="SQLite token cache file (the runs after the first one use the cached tokens)")
+    parser.add_argument('-outputfile', action="store", dest="outputfile", default=None,
+                        help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    if args.documents is None:
+        docs, input_type, tokenizer = dataset_small()
+        docs = docs * args.repeat
+    else:
+        docs, input_type, tokenizer = dataset_mails(args.documents)
+    if args.limit > 0:
+        docs = docs[:args.limit]
+    _log.info("Benchmark tokenization of %d documents (%d cpus)" % (len(docs), multiprocessing.cpu_count()))
+
+    # every jobs setting gets a copy of the unused tokenizer, so that it starts with empty lemma and tag caches (and
+    # without a loaded POS tagger) instead of the warm caches of the previous setting, which the workers would inherit
+    unused_tokenizer = copy.deepcopy(tokenizer)
+    results = []
+    for jobs in args.jobs:
+        tokenizer = copy.deepcopy(unused_tokenizer)
+        cache = TokenCache(args.cache, namespace=tokenizer.config()) if args.cache else None
+        start = time.time()
+        tokens = tokenize_documents(docs, tokenizer, input_type, n_jobs=jobs, chunksize=args.chunksize, cache=cache)
+        if args.vectorize:
+            vectorizer = create_pretokenized_vectorizer(ngram_range=(1, 1))
+            vectorizer.fit_transform(tokens)
+            num_tokens = None
+        else:
+            num_tokens = sum(len(doc_tokens) for doc_tokens in tokens)
+        duration = time.time() - start
+        _log.info("%d jobs: %fs, %f documents/s" % (jobs, duration, len(docs) / duration))
+        # the lemma and tag caches of the worker processes are not collected
+        cache_statistics = tokenizer.cache_statistics() if jobs <= 1 else None
+        if jobs <= 1:
+            _log.info("cache statistics: %s" % cache_statistics)
+        else:
+            _log.info("cache statistics of the %d worker processes are not collected" % jobs)
+        if cache is not None:
+            _log.info("token cache statistics: %s" % cache.statistics())
+            cache.close()
+        results.append({'jobs': jobs, 'time': duration, 'documents_per_second': len(docs) / duration,
+                        'tokens': num_tokens, 'cache_statistics': cache_statistics})
+
+    if args.outputfile:
+        info = {'time': strftime("%Y-%m-%d_%H%M%S"), 'python': sys.version, 'cpus': multiprocessing.cpu_count(),
+                'documents': len(docs), 'parameters': vars(args)}
+        file = codecs.open(args.outputfile, 'w', encoding='utf8')
+        json.dump({'info': info, 'results': results}, file, indent=2, sort_keys=True)
+        file.close()
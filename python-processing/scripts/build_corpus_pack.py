@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+import logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s %(levelname)-8s %(message)s',
+                    datefmt='%a, %d %b %Y %H:%M:%S')
+_log = logging.getLogger()
+
+import time
+import argparse
+
+from tools.corpus_pack import CorpusPack, build_corpus_pack
+
+# Create or update a corpus pack of the .eml mails of a folder: the preprocessed subject and content texts of all mails
+# in one file plus an index of the mail ids and text offsets. Only new and changed mails are read when the pack already
+# exists. The pack file can be used instead of the mail folder by the dataset loaders (see datasets.py) and the
+# keyword extraction (add_keyword_slice.py), which then don't open every mail file.
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='create or update the corpus pack of a mail folder')
+    parser.add_argument('-mailfolder', action="store", dest="mailfolder", required=True,
+                        help="folder with the .eml mail files")
+    parser.add_argument('-packfile', action="store", dest="packfile", required=True,
+                        help="corpus pack file to create or update (the index is written to <packfile>.index)")
+    args = parser.parse_args()
+
+    start = time.time()
+    _log.info("Update corpus pack %s from mail folder %s" % (args.packfile, args.mailfolder))
+    statistics = build_corpus_pack(args.mailfolder, args.packfile)
+    _log.info("%d mails added, %d updated, %d removed, %d unchanged (%fs)" % (
+        statistics['added'], statistics['updated'], statistics['removed'], statistics['unchanged'],
+        time.time() - start))
+    with CorpusPack(args.packfile) as pack:
+        _log.info("Corpus pack contains %d mails (%d bytes)" % (len(pack), pack.offsets[-1]))
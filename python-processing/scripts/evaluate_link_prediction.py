@@ -9,97 +9,182 @@ logging.basicConfig(level=logging.INFO,
 _log = logging.getLogger()
 
 import os
+import sys
 import codecs
+import shutil
+import cProfile
 import argparse
+import tempfile
+import multiprocessing
+
+BLAS_THREAD_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']
+
+# return the value of the "-jobs" option of the command line (1 if it is not given or invalid)
+def jobs_argument(argv):
+    for i, arg in enumerate(argv):
+        value = None
+        if arg == '-jobs' and i + 1 < len(argv):
+            value = argv[i + 1]
+        elif arg.startswith('-jobs='):
+            value = arg[len('-jobs='):]
+        if value is not None:
+            try:
+                return int(value)
+            except ValueError:
+                return 1
+    return 1
+
+# number of BLAS threads of the fold worker processes (see evaluate_folds_in_parallel). The BLAS library only reads the
+# thread environment variables when it is loaded (by the import of numpy), so they are set before numpy is imported.
+# The workers inherit the loaded library and can only change its threads with threadpoolctl (python 3).
+BLAS_THREADS = None
+if jobs_argument(sys.argv) > 1:
+    BLAS_THREADS = max(1, multiprocessing.cpu_count() // jobs_argument(sys.argv))
+    for var in BLAS_THREAD_VARIABLES:
+        os.environ[var] = str(BLAS_THREADS)
 
 import numpy as np
-from scipy.sparse import csr_matrix, lil_matrix
-import sklearn.metrics as m
+from scipy.sparse import csr_matrix
 from time import strftime
-from tools.graph_utils import create_gexf_graph
-from tools.evaluation_utils import NeedEvaluationDetailDict, NeedEvaluationDetails
-from tools.cosine_link_prediction import cosinus_link_prediciton
+from tools.graph_utils import write_gexf_graph, ego_subgraph_needs, sampled_subgraph_needs
+from tools.evaluation_utils import NeedEvaluationDetailDict, NeedEvaluationDetails, ScoreHistogram, ranking_metrics, \
+    output_statistic_details
+from tools.pair_index import PairIndex
+from tools.instrumentation import Instrumentation, tracemalloc_available
+from tools.cosine_link_prediction import cosinus_link_prediciton, cosine_distance_array
 from tools.tensor_utils import connection_indices, read_input_tensor, \
-    predict_rescal_connections_by_need_similarity, predict_rescal_connections_by_threshold, similarity_ranking, \
-    matrix_to_array, execute_rescal, predict_rescal_connections_array, SparseTensor, extend_next_hop_transitive_connections
-
-# for all test_needs return all indices (shuffeld) to all other needs in the connection slice
-def need_connection_indices(all_needs, test_needs):
-    allindices = ([],[])
-    for row in test_needs:
-        fromneeds = [row] * len(all_needs)
-        toneeds = all_needs
-        allindices[0].extend(fromneeds)
-        allindices[1].extend(toneeds)
-    indices = range(len(allindices[0]))
-    np.random.shuffle(indices)
-    ret0 = [allindices[0][i] for i in indices]
-    ret1 = [allindices[1][i] for i in indices]
-    return (ret0, ret1)
+    predict_rescal_connections_by_threshold, similarity_ranking, \
+    matrix_to_array, execute_rescal, predict_rescal_connections_array, SparseTensor, extend_next_hop_transitive_connections, \
+    mask_rows_and_columns, mask_symmetric_entries, subsample_symmetric_row_entries, TensorStatistics, \
+    save_tensor_arrays, load_tensor_arrays
+
+# for all test_needs return a pair index to all other needs in the connection slice (optionally in shuffled order)
+def need_connection_indices(all_needs, test_needs, shuffle=False):
+    if shuffle:
+        return PairIndex.fromShuffledProduct(test_needs, all_needs)
+    return PairIndex.fromProduct(test_needs, all_needs)
+
+# for all test_needs return a pair index to all needs of the opposite need type (OFFER => WANT, WANT => OFFER). Test
+# needs without a need type are left out. Return the index and the number of left out pairs compared to the index of
+# need_connection_indices() (which can never be predicted by the algorithms)
+def opposite_type_connection_indices(tensor, all_needs, test_needs):
+    stats = tensor.getStatistics()
+    test_needs = np.asarray(test_needs, dtype=int)
+    all_needs = np.asarray(all_needs, dtype=int)
+    test_types = stats.needType[test_needs]
+    all_types = stats.needType[all_needs]
+    offers = all_needs[all_types == TensorStatistics.OFFER]
+    wants = all_needs[all_types == TensorStatistics.WANT]
+    idx = PairIndex.concat([PairIndex.fromProduct(test_needs[test_types == TensorStatistics.OFFER], wants),
+                            PairIndex.fromProduct(test_needs[test_types == TensorStatistics.WANT], offers)])
+    return idx, len(test_needs) * len(all_needs) - len(idx)
+
+# return a boolean array that is True for the pairs of a pair index that connect an OFFER and a WANT (the only pairs
+# for which the RESCAL algorithms predict connections)
+def opposite_type_pairs(tensor, idx):
+    stats = tensor.getStatistics()
+    return idx.mapBlocks(lambda block: stats.isOppositeTypePair(*block.toArrays()), dtype=bool)
+
+# description of the pairs of a fold that are evaluated in the negative sampling mode: every pair has a weight (the
+# number of pairs of all pairs of the test needs it represents) and a group (the position of its test need in the
+# list of test needs). All pairs of the test needs that are not represented by the sample are not connected and are
+# never predicted.
+class NegativeSample:
+
+    def __init__(self, weights, groups, numGroups, numPairs):
+        self.weights = weights
+        self.groups = groups
+        self.numGroups = numGroups
+        self.numPairs = numPairs
+
+# for all test needs return a pair index to all their connections (in the ground truth) and "num_samples" random
+# needs of the opposite type (OFFER => WANT, WANT => OFFER) that are not connected to the test need (drawn with
+# replacement). Also returns the NegativeSample that describes the evaluated pairs: the sampled negatives of a test
+# need represent all not connected needs of the opposite type, all other pairs of test needs (e.g. with needs of the
+# same type) are not sampled since they are never predicted.
+def negative_sample_connection_indices(ground_truth, all_needs, test_needs, num_samples):
+    stats = ground_truth.getStatistics()
+    test_needs = np.asarray(test_needs, dtype=int)
+    all_needs = np.asarray(all_needs, dtype=int)
+    con = ground_truth.getSliceMatrix(SparseTensor.CONNECTION_SLICE).tocsr()
+    test_con = con[test_needs]
+    groups = [np.repeat(np.arange(len(test_needs)), np.diff(test_con.indptr))]
+    from_needs = [test_needs[groups[0]]]
+    to_needs = [test_con.indices]
+    weights = [np.ones(len(test_con.indices))]
+
+    for need_type, opposite_type in [(TensorStatistics.OFFER, TensorStatistics.WANT),
+                                     (TensorStatistics.WANT, TensorStatistics.OFFER)]:
+        type_groups = np.flatnonzero(stats.needType[test_needs] == need_type)
+        candidates = all_needs[stats.needType[all_needs] == opposite_type]
+        if len(type_groups) == 0 or len(candidates) == 0:
+            continue
+        draws = candidates[np.random.randint(0, len(candidates), size=(len(type_groups), num_samples))]
+        draw_from = np.repeat(test_needs[type_groups], num_samples)
+        negative = np.asarray(con[draw_from, draws.ravel()]).ravel() == 0
+
+        # the negatives of a test need represent all its not connected candidates
+        connected_candidates = np.bincount(groups[0][stats.needType[test_con.indices] == opposite_type],
+                                           minlength=len(test_needs))[type_groups]
+        num_negatives = negative.reshape(len(type_groups), num_samples).sum(axis=1)
+        weight = (len(candidates) - connected_candidates) / np.maximum(num_negatives, 1).astype(float)
+        draw_groups = np.repeat(type_groups, num_samples)
+        groups.append(draw_groups[negative])
+        from_needs.append(draw_from[negative])
+        to_needs.append(draws.ravel()[negative])
+        weights.append(np.repeat(weight, num_samples)[negative])
+
+    idx = PairIndex.fromPairs(np.concatenate(from_needs), np.concatenate(to_needs))
+    sample = NegativeSample(np.concatenate(weights), np.concatenate(groups), len(test_needs),
+                            len(test_needs) * len(all_needs))
+    return idx, sample
 
 # mask all connections at specified indices in the tensor
 def mask_idx_connections(tensor, indices):
-    conSlice = lil_matrix(tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE))
-    for idx in range(len(indices[0])):
-        conSlice[indices[0][idx],indices[1][idx]] = 0
-        conSlice[indices[1][idx],indices[0][idx]] = 0
+    from_needs, to_needs = indices.toArrays() if isinstance(indices, PairIndex) else indices
+    conSlice = mask_symmetric_entries(tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE), from_needs, to_needs)
     masked_tensor = tensor.copy()
     masked_tensor.addSliceMatrix(conSlice, SparseTensor.CONNECTION_SLICE)
     return masked_tensor
 
 # mask all connections of some needs to all other needs
 def mask_need_connections(tensor, needs):
-    conSlice = lil_matrix(tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE))
-    for need in needs:
-        conSlice[need,:] = lil_matrix(np.zeros(conSlice.shape[0]))
-        conSlice[:,need] = lil_matrix(np.zeros(conSlice.shape[0])).transpose()
+    keep = np.ones(tensor.shape[0], dtype=bool)
+    keep[list(needs)] = False
+    conSlice = mask_rows_and_columns(tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE), keep)
     masked_tensor = tensor.copy()
     masked_tensor.addSliceMatrix(conSlice, SparseTensor.CONNECTION_SLICE)
     return masked_tensor
 
 # mask all connections but a number of X for each need
 def mask_all_but_X_connections_per_need(tensor, keep_x):
-    conSlice = lil_matrix(tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE))
-    for row in set(conSlice.nonzero()[0]):
-        if conSlice[row,:].getnnz() > keep_x:
-            mask_idx = conSlice.nonzero()[1][np.where(conSlice.nonzero()[0]==row)]
-            np.random.shuffle(mask_idx)
-            for col in mask_idx[keep_x:]:
-                conSlice[row,col] = 0
-                conSlice[col,row] = 0
+    conSlice = subsample_symmetric_row_entries(tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE), keep_x)
     masked_tensor = tensor.copy()
     masked_tensor.addSliceMatrix(conSlice, SparseTensor.CONNECTION_SLICE)
     return masked_tensor
 
 # choose number of x needs to keep and remove all other needs that exceed this number
 def keep_x_random_needs(tensor, keep_x):
-    rand_needs = tensor.getNeedIndices()
-    np.random.shuffle(rand_needs)
+    rand_needs = np.random.permutation(np.flatnonzero(tensor.getStatistics().isNeed))
     remove_needs = rand_needs[keep_x:]
     return mask_needs(tensor, remove_needs)
 
 # mask all needs with have more than X connections
 def mask_needs_with_more_than_X_connections(tensor, x_connections):
-    remove_needs = []
-    for need in range(tensor.shape[0]):
-        if (tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE)[need,].sum() > x_connections):
-            remove_needs.append(need)
+    remove_needs = tensor.getStatistics().getNeedsWithMoreThanXConnections(x_connections)
     return mask_needs(tensor, remove_needs)
 
 # mask complete needs (including references to attributes, connections, etc)
 def mask_needs(tensor, needs):
     if (len(needs) == 0):
         return tensor
-    slices = [lil_matrix(slice) for slice in tensor.getSliceMatrixList()]
-    idx = 0
-    newHeaders = ["NULL" if i in needs else tensor.getHeaders()[i] for i in range(len(tensor.getHeaders()))]
+    keep = np.ones(tensor.shape[0], dtype=bool)
+    keep[list(needs)] = False
+    headers = tensor.getHeaders()
+    newHeaders = [headers[i] if keep[i] else "NULL" for i in range(len(headers))]
     masked_tensor = SparseTensor(newHeaders)
-    for slice in slices:
-        for need in needs:
-            slice[need,:] = lil_matrix(np.zeros(slice.shape[0]))
-            slice[:,need] = lil_matrix(np.zeros(slice.shape[0])).transpose()
-        masked_tensor.addSliceMatrix(slice, idx)
-        idx += 1
+    for idx, slice in enumerate(tensor.data):
+        masked_tensor.addSliceMatrix(mask_rows_and_columns(slice, keep), idx)
     return masked_tensor
 
 # predict connections by combining the execution of algorithms. First execute the cosine similarity
@@ -121,7 +206,7 @@ def predict_combine_cosine_rescal(input_tensor, test_needs, idx_test, rank,
     P_bin = predict_rescal_connections_by_threshold(A, R, rescal_threshold, offers, wants, test_needs)
 
     # return both predictions the earlier cosine and the combined rescal
-    binary_pred_cosine = binary_pred_cosine[idx_test]
+    binary_pred_cosine = matrix_to_array(binary_pred_cosine, idx_test)
     binary_pred_rescal = matrix_to_array(P_bin, idx_test)
     return binary_pred_cosine, binary_pred_rescal
 
@@ -141,9 +226,9 @@ def predict_intersect_cosine_rescal(input_tensor, test_needs, idx_test, rank,
     P_bin = predict_rescal_connections_by_threshold(A, R, rescal_threshold, offers, wants, test_needs)
 
     # return the intersection of the prediction of both algorithms
-    binary_pred_cosine = binary_pred_cosine[idx_test]
+    binary_pred_cosine = matrix_to_array(binary_pred_cosine, idx_test)
     binary_pred_rescal = matrix_to_array(P_bin, idx_test)
-    binary_pred = [min(binary_pred_cosine[i], binary_pred_rescal[i]) for i in range(len(binary_pred_cosine))]
+    binary_pred = np.minimum(binary_pred_cosine, binary_pred_rescal)
     return binary_pred, binary_pred_cosine, binary_pred_rescal
 
 # write precision/recall (and threshold) curve to file
@@ -176,55 +261,39 @@ def write_ROC_curve_file(folder, outfilename, TP, FP, threshold):
             prevline = line
     file.close()
 
-# helper function
-def create_file_from_sorted_list(dir, filename, list):
-    if not os.path.exists(dir):
-        os.makedirs(dir)
-    file = codecs.open(dir + "/" + filename,'w+',encoding='utf8')
-    list.sort()
-    for entry in list:
-        file.write(entry + "\n")
-    file.close()
-
-
-# in a specified folder create files which represent tested needs. For each of these files print the
-# binary classifiers: TP, FP, FN including the (connected/not connected) need names for manual detailed analysis of
-# the classification algorithm.
-def output_statistic_details(outputpath, headers, needEvaluationDetailDict, printThresholds=False):
-
-    if not os.path.exists(outputpath):
-        os.makedirs(outputpath)
-    summary_file = codecs.open(outputpath + "/_summary.txt",'a+',encoding='utf8')
-
-    for need in needEvaluationDetailDict.dict.keys():
-        # write need details file
-        needEval = needEvaluationDetailDict.dict[need]
-        if printThresholds:
-            needDetails = [ "TP (%f): " % needEval.TP_thresholds[i] + headers[needEval.TP_toNeeds[i]][6:]
-                            for i in range(len(needEval.TP_toNeeds))]
-            needDetails += [ "FN (%f): " % needEval.FN_thresholds[i] + headers[needEval.FN_toNeeds[i]][6:]
-                             for i in range(len(needEval.FN_toNeeds))]
-            needDetails += [ "FP (%f): " % needEval.FP_thresholds[i] + headers[needEval.FP_toNeeds[i]][6:]
-                             for i in range(len(needEval.FP_toNeeds))]
-        else:
-            needDetails = [ "TP: " + headers[toNeed][6:] for toNeed in needEval.TP_toNeeds]
-            needDetails += [ "FN: " + headers[toNeed][6:] for toNeed in needEval.FN_toNeeds]
-            needDetails += [ "FP: " + headers[toNeed][6:] for toNeed in needEval.FP_toNeeds]
-
-        create_file_from_sorted_list(outputpath, headers[need][6:] + ".txt", needDetails)
-
-        # write the summary file
-        summary_file.write(headers[need][6:])
-        summary_file.write(": TP: " + str(needEvaluationDetailDict.dict[need].TP))
-        summary_file.write(": TN: " + str(needEvaluationDetailDict.dict[need].TN))
-        summary_file.write(": FP: " + str(needEvaluationDetailDict.dict[need].FP))
-        summary_file.write(": FN: " + str(needEvaluationDetailDict.dict[need].FN))
-        summary_file.write(": Precision: " + str(needEvaluationDetailDict.dict[need].getPrecision()))
-        summary_file.write(": Recall: " + str(needEvaluationDetailDict.dict[need].getRecall()))
-        summary_file.write(": f%f-score : " % F_BETA + str(needEvaluationDetailDict.dict[need].getFScore(F_BETA)))
-        summary_file.write(": Accuracy: " + str(needEvaluationDetailDict.dict[need].getAccuracy()) + "\n")
-    summary_file.close()
-
+# write the precision-recall and ROC curves of the score histogram of all folds to files
+def write_pooled_curve_files(folder, histogram):
+    precision, recall, threshold = histogram.getPrecisionRecallCurve()
+    write_precision_recall_curve_file(folder, "precision_recall_curve_pooled.csv", precision, recall, threshold)
+    TP, FP, threshold = histogram.getROCCurve()
+    write_ROC_curve_file(folder, "ROC_curve_pooled.csv", TP, FP, threshold)
+
+# write the statistic details of an algorithm to a folder, either as text files (one per need and a summary file) or
+# as the summary file and one "statistics.npz" file that holds the details of all needs. The text files of the needs
+# can be extracted from the npz file with the script extract_statistic_details.py
+def write_statistic_details(folder, headers, needEvaluationDetailDict, format, printThresholds=False):
+    if format == 'npz':
+        output_statistic_details(folder, headers, needEvaluationDetailDict, F_BETA, printThresholds,
+                                 writeNeedFiles=False)
+        needEvaluationDetailDict.save(folder + "/statistics.npz", headers, F_BETA, printThresholds)
+    else:
+        output_statistic_details(folder, headers, needEvaluationDetailDict, F_BETA, printThresholds)
+
+# write the need graph of an algorithm to the file "graph.gexf" of a folder. Depending on the option "-graph" the graph
+# of all needs, the ego subgraphs ("-graphhops" connections) of the connected needs with the lowest f-score or a
+# degree-stratified sample of needs (with their ego subgraphs) is written
+def write_graph(folder, tensor, needEvaluationDetailDict, args):
+    needs = None
+    if args.graph == 'none':
+        return
+    elif args.graph == 'ego':
+        centers = needEvaluationDetailDict.getWorstFScoreNeeds(args.graphneeds, F_BETA)
+        needs = ego_subgraph_needs(tensor, centers, args.graphhops)
+    elif args.graph == 'sample':
+        needs = sampled_subgraph_needs(tensor, args.graphneeds, hops=args.graphhops)
+    if needs is not None:
+        _log.info('write need graph with %d needs' % len(needs))
+    write_gexf_graph(tensor, folder + "/graph.gexf", needEvaluationDetailDict, needs)
 
 # calculate the optimal threshold by maximizing the f-score measure
 def get_optimal_threshold(recall, precision, threshold, f_beta=1.0):
@@ -241,6 +310,66 @@ def get_optimal_threshold(recall, precision, threshold, f_beta=1.0):
                 optimal_threshold = threshold[i]
     return optimal_threshold
 
+# compute accuracy and precision, recall and f-beta score of the binary classes 1 and 0 from confusion counts,
+# averaged by the support of the classes (like sklearn.metrics with average='weighted')
+def weighted_scores(TP, FP, FN, TN, f_beta):
+
+    def div(a, b):
+        return a / float(b) if b > 0 else 0.0
+
+    def fscore(p, r):
+        return div((1 + f_beta * f_beta) * p * r, f_beta * f_beta * p + r)
+
+    p1, r1 = div(TP, TP + FP), div(TP, TP + FN)
+    p0, r0 = div(TN, TN + FN), div(TN, TN + FP)
+    s1, s0 = TP + FN, TN + FP
+    p = div(s1 * p1 + s0 * p0, s1 + s0)
+    r = div(s1 * r1 + s0 * r0, s1 + s0)
+    f = div(s1 * fscore(p1, r1) + s0 * fscore(p0, r0), s1 + s0)
+    a = div(TP + TN, TP + FP + FN + TN)
+    return p, r, f, a
+
+# compute the confusion counts (TP, FP, FN, TN) of the binary classification "score >= threshold" (or "score <
+# threshold" if "below" is True) for a list of thresholds in one pass: the scores of the positive and negative pairs
+# are sorted once and the number of predicted pairs for every threshold is looked up in the sorted scores. Pairs that
+# are not "eligible" (e.g. needs of the same type) and pairs with the score NaN are never predicted.
+def threshold_confusion_counts(y_true, scores, thresholds, eligible=None, below=False):
+    y_true = np.asarray(y_true).ravel() == 1
+    scores = np.asarray(scores, dtype=float).ravel()
+    candidates = ~np.isnan(scores)
+    if eligible is not None:
+        candidates &= np.asarray(eligible, dtype=bool).ravel()
+    positive_scores = np.sort(scores[candidates & y_true])
+    negative_scores = np.sort(scores[candidates & ~y_true])
+    num_positives = int(np.count_nonzero(y_true))
+    num_negatives = len(y_true) - num_positives
+    counts = []
+    for threshold in thresholds:
+        TP = int(np.searchsorted(positive_scores, threshold, side='left'))
+        FP = int(np.searchsorted(negative_scores, threshold, side='left'))
+        if not below:
+            TP = len(positive_scores) - TP
+            FP = len(negative_scores) - FP
+        counts.append((TP, FP, num_positives - TP, num_negatives - FP))
+    return counts
+
+# add the classification results of the scores for a list of thresholds to the reports (one for each threshold), see
+# threshold_confusion_counts() for the parameters. "label" is logged for every threshold (formatted with it). If the
+# pairs are a NegativeSample the measures are estimated per threshold, otherwise the excluded pairs are added.
+def add_threshold_evaluation_data(reports, label, y_true, scores, thresholds, eligible, below, excluded, sample):
+    if sample is None:
+        counts = threshold_confusion_counts(y_true, scores, thresholds, eligible, below)
+    with np.errstate(invalid='ignore'):
+        for i in range(len(thresholds)):
+            _log.info(label % thresholds[i])
+            if sample is None:
+                reports[i].add_confusion_counts(*(counts[i] + excluded))
+            else:
+                y_pred = (scores < thresholds[i]) if below else (scores >= thresholds[i])
+                if eligible is not None:
+                    y_pred &= eligible
+                reports[i].add_sampled_evaluation_data(y_true, y_pred, sample)
+
 # class to collect data during the runs of the test and print calculated measures for summary
 class EvaluationReport:
 
@@ -250,11 +379,31 @@ class EvaluationReport:
         self.recall = []
         self.accuracy = []
         self.fscore = []
-
-    def add_evaluation_data(self, y_true, y_pred):
-        p, r, f, _ =  m.precision_recall_fscore_support(y_true, y_pred, average='weighted', beta=self.f_beta)
-        a = m.accuracy_score(y_true, y_pred)
-        cm = m.confusion_matrix(y_true, y_pred, [1, 0])
+        self.rankingNames = []
+        self.ranking = dict()
+        self.confidence = dict()
+
+    # add the classification result of a fold. Pairs that were excluded from the evaluation (and thus never predicted)
+    # can be passed as "excluded_pairs" of which "excluded_connections" are connected in the ground truth, they are
+    # counted as negative predictions to get measures that are comparable to an evaluation over all pairs. If the
+    # pairs are a NegativeSample "sample" the measures are estimated (see add_sampled_evaluation_data())
+    def add_evaluation_data(self, y_true, y_pred, excluded_pairs=0, excluded_connections=0, sample=None):
+        if sample is not None:
+            self.add_sampled_evaluation_data(y_true, y_pred, sample)
+            return
+        y_true = np.asarray(y_true).ravel() == 1
+        y_pred = np.asarray(y_pred).ravel() == 1
+        TP = int(np.count_nonzero(y_true & y_pred))
+        FP = int(np.count_nonzero(~y_true & y_pred))
+        FN = int(np.count_nonzero(y_true & ~y_pred))
+        TN = len(y_true) - TP - FP - FN
+        self.add_confusion_counts(TP, FP, FN, TN, excluded_pairs, excluded_connections)
+
+    # add the confusion counts of a fold, the excluded pairs are handled like in add_evaluation_data()
+    def add_confusion_counts(self, TP, FP, FN, TN, excluded_pairs=0, excluded_connections=0):
+        FN += excluded_connections
+        TN += excluded_pairs - excluded_connections
+        p, r, f, a = weighted_scores(TP, FP, FN, TN, self.f_beta)
         self.precision.append(p)
         self.recall.append(r)
         self.fscore.append(f)
@@ -263,18 +412,536 @@ class EvaluationReport:
         _log.info('precision: %f' % p)
         _log.info('recall: %f' % r)
         _log.info('f%.01f-score: %f' % (self.f_beta, f))
-        _log.info('confusion matrix: ' + str(cm))
+        _log.info('confusion matrix: ' + str(np.array([[TP, FN], [FP, TN]])))
+
+    # add the classification result of the pairs of a NegativeSample of a fold. The confusion counts of all pairs of
+    # the test needs are estimated from the weighted counts of the sampled pairs, the 95% confidence intervals of the
+    # measures are computed by bootstrapping the test needs
+    def add_sampled_evaluation_data(self, y_true, y_pred, sample):
+        y_true = np.asarray(y_true).ravel() == 1
+        y_pred = np.asarray(y_pred).ravel() == 1
+
+        # weighted confusion counts per test need, all other pairs of a test need are true negatives
+        def group_counts(selection):
+            return np.bincount(sample.groups[selection], weights=sample.weights[selection],
+                               minlength=sample.numGroups)
+        TP = group_counts(y_true & y_pred)
+        FP = group_counts(~y_true & y_pred)
+        FN = group_counts(y_true & ~y_pred)
+        pairs_per_group = sample.numPairs / float(max(sample.numGroups, 1))
+
+        def scores(groups):
+            TP_sum, FP_sum, FN_sum = TP[groups].sum(), FP[groups].sum(), FN[groups].sum()
+            TN_sum = len(groups) * pairs_per_group - TP_sum - FP_sum - FN_sum
+            return weighted_scores(TP_sum, FP_sum, FN_sum, TN_sum, self.f_beta)
+
+        p, r, f, a = scores(np.arange(sample.numGroups))
+        bootstrap = np.array([scores(np.random.randint(0, sample.numGroups, sample.numGroups))
+                              for _ in range(BOOTSTRAP_SAMPLES)])
+        lower = np.percentile(bootstrap, 2.5, axis=0)
+        upper = np.percentile(bootstrap, 97.5, axis=0)
+        self.precision.append(p)
+        self.recall.append(r)
+        self.fscore.append(f)
+        self.accuracy.append(a)
+        for i, name in enumerate(['precision', 'recall', 'fscore', 'accuracy']):
+            self.confidence.setdefault(name, []).append((lower[i], upper[i]))
+        _log.info('accuracy (estimated): %f (95%% confidence interval %f - %f)' % (a, lower[3], upper[3]))
+        _log.info('precision (estimated): %f (95%% confidence interval %f - %f)' % (p, lower[0], upper[0]))
+        _log.info('recall (estimated): %f (95%% confidence interval %f - %f)' % (r, lower[1], upper[1]))
+        _log.info('f%.01f-score (estimated): %f (95%% confidence interval %f - %f)' % (self.f_beta, f, lower[2],
+                                                                                       upper[2]))
+
+    # add the ranking metrics of the needs of a fold (as returned by ranking_metrics()), the fold measure of each
+    # metric is the mean over the needs
+    def add_ranking_data(self, metrics):
+        for name in metrics.keys():
+            if name not in self.ranking:
+                self.rankingNames.append(name)
+                self.ranking[name] = []
+            value = metrics[name].mean() if len(metrics[name]) > 0 else 0.0
+            self.ranking[name].append(value)
+            _log.info('%s: %f' % ('MAP' if name == 'AP' else name, value))
+
+    # append the measures of another report (e.g. of another fold)
+    def merge(self, other):
+        self.precision.extend(other.precision)
+        self.recall.extend(other.recall)
+        self.accuracy.extend(other.accuracy)
+        self.fscore.extend(other.fscore)
+        for name in other.confidence.keys():
+            self.confidence.setdefault(name, []).extend(other.confidence[name])
+        for name in other.rankingNames:
+            if name not in self.ranking:
+                self.rankingNames.append(name)
+                self.ranking[name] = []
+            self.ranking[name].extend(other.ranking[name])
 
     def summary(self):
-        a = np.array(self.accuracy)
-        p = np.array(self.precision)
-        r = np.array(self.recall)
-        f = np.array(self.fscore)
-        _log.info('Accuracy Mean / Std: %f / %f' % (a.mean(), a.std()))
-        _log.info('Precision Mean / Std: %f / %f' % (p.mean(), p.std()))
-        _log.info('Recall Mean / Std: %f / %f' % (r.mean(), r.std()))
-        _log.info('F%.01f-Score Mean / Std: %f / %f' % (self.f_beta, f.mean(), f.std()))
+        if len(self.accuracy) > 0:
+            a = np.array(self.accuracy)
+            p = np.array(self.precision)
+            r = np.array(self.recall)
+            f = np.array(self.fscore)
+            _log.info('Accuracy Mean / Std: %f / %f' % (a.mean(), a.std()))
+            _log.info('Precision Mean / Std: %f / %f' % (p.mean(), p.std()))
+            _log.info('Recall Mean / Std: %f / %f' % (r.mean(), r.std()))
+            _log.info('F%.01f-Score Mean / Std: %f / %f' % (self.f_beta, f.mean(), f.std()))
+        for name, label in [('accuracy', 'Accuracy'), ('precision', 'Precision'), ('recall', 'Recall'),
+                            ('fscore', 'F%.01f-Score' % self.f_beta)]:
+            if name in self.confidence:
+                interval = np.array(self.confidence[name]).mean(axis=0)
+                _log.info('%s 95%% confidence interval (mean of folds): %f - %f' % (label, interval[0], interval[1]))
+        for name in self.rankingNames:
+            values = np.array(self.ranking[name])
+            _log.info('%s Mean / Std: %f / %f' % ('MAP' if name == 'AP' else name, values.mean(), values.std()))
+
+
+# number of bootstrap samples to compute the confidence intervals of estimated measures
+BOOTSTRAP_SAMPLES = 200
+
+# set the test parameters (global constants of the evaluation) from the command line arguments
+def set_test_parameters(args):
+    global FOLDS, MASK_ALL_CONNECTIONS_OF_TEST_NEED, F_BETA, MAX_CONNECTIONS_PER_NEED, RESCAL_RANK, \
+        RESCAL_SIMILARITY_RANK, RESCAL_THRESHOLDS, RESCAL_SIMILARITY_THRESHOLDS, COSINE_SIMILARITY_THRESHOLDS, \
+        COSINE_SIMILARITY_TRANSITIVE_THRESHOLD, COSINE_WEIGHTED_SIMILARITY_THRESHOLD, \
+        COSINE_WEIGHTED_SIMILARITY_TRANSITIVE_THRESHOLD, HISTOGRAM_BINS, TOP_ALLOCATIONS
 
+    # (10-)fold cross validation
+    FOLDS = args.folds
+
+    # True means: for testing mask all connections of random test needs (Test Case: Predict connections for new need
+    # without connections)
+    # False means: for testing mask random connections (Test Case: Predict connections for existing need which may
+    # already have connections)
+    MASK_ALL_CONNECTIONS_OF_TEST_NEED = not args.maskrandom
+
+    # the f-beta-measure is used to calculate the optimal threshold for the rescal algorithm. beta=1 is the
+    # F1-measure which weights precision and recall both same important. the higher the beta value,
+    # the more important is recall compared to precision
+    F_BETA = args.fbeta
+
+    # by changing this parameter the number of training connections per need can be set. Choose a high value (e.g.
+    # 100) to use all connection in the connections file. Choose a low number to restrict the number of training
+    # connections (e.g. to 1 or even 0). This way tests are possible that describe situation where initially not many
+    # connection are available to learn from.
+    MAX_CONNECTIONS_PER_NEED = args.maxconnections
+
+    # changing the rank parameter influences the amount of internal latent "clusters" of the algorithm and thus the
+    # quality of the matching as well as performance (memory and execution time)
+    RESCAL_RANK = (int(args.rescal[0]) if args.rescal else None)
+    RESCAL_SIMILARITY_RANK = (int(args.rescalsim[0]) if args.rescalsim else None)
+
+    # thresholds for RESCAL algorithm connection slice, higher threshold means higher precision. Every algorithm
+    # accepts a comma separated list of thresholds that are all evaluated on the same predictions, the detailed
+    # statistics are written for every threshold of the list (see statistics_folder())
+    RESCAL_THRESHOLDS = (parse_thresholds(args.rescal[1]) if args.rescal else [])
+
+    # thresholds for RESCAL algorithm need similarity, higher threshold means higher recall
+    RESCAL_SIMILARITY_THRESHOLDS = (parse_thresholds(args.rescalsim[1]) if args.rescalsim else [])
+
+    # thresholds for cosine similarity link prediction algorithm, higher threshold means higher recall.
+    # set transitive threshold < threshold to avoid transitive predictions
+    COSINE_SIMILARITY_THRESHOLDS = (parse_thresholds(args.cosine[0]) if args.cosine else [])
+    COSINE_SIMILARITY_TRANSITIVE_THRESHOLD = (float(args.cosine[1]) if args.cosine else None)
+    COSINE_WEIGHTED_SIMILARITY_THRESHOLD = (float(args.cosine_weigthed[0]) if args.cosine_weigthed else None)
+    COSINE_WEIGHTED_SIMILARITY_TRANSITIVE_THRESHOLD = (float(args.cosine_weigthed[1]) if args.cosine_weigthed else None)
+
+    # number of bins of the score histograms that are used to compute the precision-recall and ROC curves of the
+    # RESCAL algorithms, 0 means the exact curves are computed per fold from all scores
+    HISTOGRAM_BINS = args.histbins
+
+    # number of top memory allocations (traced with tracemalloc) that are recorded for every stage of the evaluation,
+    # 0 means the allocations are not traced
+    TOP_ALLOCATIONS = args.tracemalloc
+
+# parse a comma separated list of thresholds (e.g. "0.02,0.03,0.04")
+def parse_thresholds(value):
+    return [float(threshold) for threshold in value.split(',')]
+
+# create the evaluation reports of all algorithms. For every algorithm there is a list with one report for every
+# evaluated threshold (RESCAL, RESCAL similarity and cosine similarity support several thresholds)
+def create_evaluation_reports():
+    num_reports = [len(RESCAL_THRESHOLDS), len(RESCAL_SIMILARITY_THRESHOLDS), len(COSINE_SIMILARITY_THRESHOLDS)]
+    num_reports += [1] * 6
+    return [[EvaluationReport(F_BETA) for _ in range(n)] for n in num_reports]
+
+# create the need evaluation details (detailed statistics) of the algorithms RESCAL, RESCAL similarity, cosine
+# similarity and weighted cosine similarity, with one NeedEvaluationDetailDict for every evaluated threshold
+def create_need_evaluation_details():
+    num_details = [len(RESCAL_THRESHOLDS), len(RESCAL_SIMILARITY_THRESHOLDS), len(COSINE_SIMILARITY_THRESHOLDS), 1]
+    return [[NeedEvaluationDetailDict() for _ in range(n)] for n in num_details]
+
+# return the statistics folder of an algorithm. With several thresholds the detailed statistics of threshold i are
+# written to the sub folder "threshold_<threshold>", the files that don't depend on the threshold (e.g. the
+# precision-recall curves, thresholds=None) to the folder of the algorithm
+def statistics_folder(outfolder, algorithm, start_time, thresholds=None, i=0):
+    folder = outfolder + "/statistics/" + algorithm + "_" + start_time
+    if thresholds is not None and len(thresholds) > 1:
+        folder += "/threshold_" + str(thresholds[i])
+    return folder
+
+# write the detailed statistics (and the need graph) of every threshold of an algorithm
+def write_threshold_statistics(outfolder, algorithm, start_time, thresholds, tensor, headers, evalDetails, args,
+                               printThresholds=False):
+    for i in range(len(evalDetails)):
+        folder = statistics_folder(outfolder, algorithm, start_time, thresholds, i)
+        write_statistic_details(folder, headers, evalDetails[i], args.statsformat, printThresholds)
+        write_graph(folder, tensor, evalDetails[i], args)
+
+# create the score histograms of the RESCAL algorithm (adaptive bins over the connection scores) and the RESCAL
+# similarity algorithm (fixed bins over the similarities 1 - cosine distance in [-1, 1])
+def create_score_histograms():
+    return [ScoreHistogram(HISTOGRAM_BINS), ScoreHistogram(HISTOGRAM_BINS, -1.0, 1.0)]
+
+# compute the precision-recall curve of the scores, approximated by the score histogram if it is not None. If the
+# pairs are a NegativeSample "sample" the pairs are weighted by their sample weights. The scores are added to the
+# histogram block by block of the PairIndex "pairs" (if set), so its temporary arrays have the size of a block and
+# not of all pairs of the fold.
+def precision_recall_curve(y_true, scores, histogram=None, sample=None, pairs=None):
+    weights = sample.weights if sample is not None else None
+    if histogram is None:
+        import sklearn.metrics as m
+        return m.precision_recall_curve(y_true, scores, sample_weight=weights)
+    if pairs is None:
+        histogram.add(y_true, scores, weights)
+    else:
+        for block in pairs.getBlocks():
+            start, stop = block.offset, block.offset + len(block)
+            histogram.add(y_true[start:stop], scores[start:stop], weights[start:stop] if weights is not None else None)
+    return histogram.getPrecisionRecallCurve()
+
+# compute the ROC curve of the scores, approximated by the score histogram if it is not None (the scores have to be
+# added to the histogram before)
+def roc_curve(y_true, scores, histogram=None, sample=None):
+    if histogram is None:
+        import sklearn.metrics as m
+        return m.roc_curve(y_true, scores, sample_weight=sample.weights if sample is not None else None)
+    return histogram.getROCCurve()
+
+# results of the evaluation of one fold that are merged after all folds are evaluated
+class FoldResult:
+
+    def __init__(self, fold):
+        self.fold = fold
+        self.AUC_test = 0.0
+        self.report = create_evaluation_reports()
+        self.evalDetails = create_need_evaluation_details()
+        self.histograms = create_score_histograms() if HISTOGRAM_BINS > 0 else [None, None]
+        self.rankingReport = [EvaluationReport(F_BETA) for _ in range(3)]
+        self.instrumentation = Instrumentation(TOP_ALLOCATIONS)
+
+# compute the ranking metrics of the scores of the pairs of every test need and add them to the report and (if not
+# None) to the need details of every threshold. Higher scores are ranked first, pairs with the score NaN or -inf are
+# not ranked.
+def evaluate_ranking(report, evalDetails, y_true, scores, idx_test, ks):
+    needs, metrics = ranking_metrics(y_true, scores, idx_test, ks)
+    report.add_ranking_data(metrics)
+    if evalDetails is not None:
+        for details in evalDetails:
+            details.add_ranking_details(needs, metrics)
+
+# execute the evaluation of all chosen algorithms on fold "f" of the cross validation. "needs" (shuffled) and
+# "connections" define the test needs/connections of all folds. Returns the FoldResult of the fold. With the option
+# "-profile" the fold is executed with cProfile and the profile is written to the output folder.
+def evaluate_fold(f, args, input_tensor, ground_truth, needs, connections, outfolder, start_time):
+    if not args.profile:
+        return _evaluate_fold(f, args, input_tensor, ground_truth, needs, connections, outfolder, start_time)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return _evaluate_fold(f, args, input_tensor, ground_truth, needs, connections, outfolder, start_time)
+    finally:
+        profiler.disable()
+        profile_file = outfolder + "/profile_fold%d_%s.prof" % (f, start_time)
+        profiler.dump_stats(profile_file)
+        _log.info('write profile of fold %d: %s' % (f, profile_file))
+
+def _evaluate_fold(f, args, input_tensor, ground_truth, needs, connections, outfolder, start_time):
+
+    need_fold_size = int(len(needs) / FOLDS)
+    connection_fold_size = int(len(connections) / FOLDS)
+    result = FoldResult(f)
+    report = result.report
+    evalDetails = result.evalDetails
+    instrumentation = result.instrumentation
+
+    # fold local random state, so that the results only depend on the seed and the fold
+    if args.seed is not None:
+        np.random.seed(args.seed + f + 1)
+
+    _log.info('------------------------------')
+    excluded = (0, 0)
+    sample = None
+    # define test set of connections indices
+    with instrumentation.stage('masking', f):
+        if MASK_ALL_CONNECTIONS_OF_TEST_NEED:
+            # choose the test needs for the fold and mask all connections of them to other needs
+            _log.info('Fold %d, fold size %d needs (out of %d)' % (f, need_fold_size, len(needs)))
+            offset = f * need_fold_size
+            test_needs = needs[offset:offset+need_fold_size]
+            test_tensor = mask_need_connections(input_tensor, test_needs)
+            if args.negsamples > 0:
+                # evaluate all connections of the test needs and a sample of the other pairs, the measures of all pairs
+                # are estimated
+                idx_test, sample = negative_sample_connection_indices(ground_truth, input_tensor.getNeedIndices(),
+                                                                      test_needs, args.negsamples)
+                _log.info('Evaluate %d pairs of test needs: all connections and %d sampled negatives per test need' %
+                          (len(idx_test), args.negsamples))
+            elif args.oppositetype:
+                # only pairs with needs of the opposite type can be predicted, the left out pairs are counted as
+                # negative predictions in the reports
+                idx_test, excluded_pairs = opposite_type_connection_indices(input_tensor, input_tensor.getNeedIndices(),
+                                                                            test_needs)
+                idx_test.setTruthMatrix(ground_truth.getSliceMatrix(SparseTensor.CONNECTION_SLICE))
+                excluded_connections = int(ground_truth.getSliceMatrix(SparseTensor.CONNECTION_SLICE)[test_needs].sum()
+                                           - len(idx_test.getPositivePositions()))
+                excluded = (excluded_pairs, excluded_connections)
+                _log.info('Evaluate %d pairs of test needs with needs of the opposite type (%d pairs left out)' %
+                          (len(idx_test), excluded_pairs))
+            else:
+                idx_test = need_connection_indices(input_tensor.getNeedIndices(), test_needs)
+        else:
+            # choose test connections to mask independently of needs
+            _log.info('Fold %d, fold size %d connection indices (out of %d)' % (f, connection_fold_size,
+                                                                                len(connections)))
+            offset = f * connection_fold_size
+            idx_test = connections.getSlice(offset, offset+connection_fold_size)
+            test_tensor = mask_idx_connections(input_tensor, idx_test)
+            test_needs = needs
+
+        # the true values of the test pairs are looked up once per fold and shared by all algorithms
+        if idx_test.truth is None:
+            idx_test.setTruthMatrix(ground_truth.getSliceMatrix(SparseTensor.CONNECTION_SLICE))
+        y_true = idx_test.getTruth()
+    _log.info('------------------------------')
+
+    # evaluate the algorithms
+    if args.rescal:
+
+        with instrumentation.stage('execute_rescal', f, 'rescal'):
+            # set transitive connections before execution
+            if (args.rescal[3] == 'True'):
+                _log.info('extend connections transitively to the next need for RESCAL learning')
+                test_tensor = extend_next_hop_transitive_connections(test_tensor)
+
+            # execute the rescal algorithm
+            useNeedTypeSlice = (args.rescal[2] == 'True')
+            A, R = execute_rescal(test_tensor, RESCAL_RANK, useNeedTypeSlice, init=args.rescal[4],
+                                  conv=float(args.rescal[5]), lambda_A=float(args.rescal[6]),
+                                  lambda_R=float(args.rescal[7]), lambda_V=float(args.rescal[8]))
+
+        # evaluate the predictions
+        with instrumentation.stage('prediction', f, 'rescal'):
+            _log.info('start predict connections ...')
+            scores = predict_rescal_connections_array(A, R, idx_test)
+            prediction = np.round_(scores, decimals=5)
+            _log.info('stop predict connections')
+        with instrumentation.stage('metrics', f, 'rescal'):
+            precision, recall, threshold = precision_recall_curve(y_true, prediction, result.histograms[0], sample,
+                                                                  idx_test)
+            optimal_threshold = get_optimal_threshold(recall, precision, threshold, F_BETA)
+            _log.info('optimal RESCAL threshold would be ' + str(optimal_threshold) +
+                      ' (for maximum F' + str(F_BETA) + '-score)')
+
+            from sklearn.metrics import auc
+            result.AUC_test = auc(recall, precision)
+            _log.info('AUC test: ' + str(result.AUC_test))
+            if result.histograms[0] is not None:
+                _log.info('(approximated by a score histogram with maximum error %f)' %
+                          result.histograms[0].getPrecisionRecallAUCErrorBound())
+
+            # use fixed thresholds to compute several measures, connections are only predicted between OFFERS and WANTS
+            eligible = opposite_type_pairs(input_tensor, idx_test)
+            add_threshold_evaluation_data(report[0], 'For RESCAL prediction with threshold %f:', y_true, scores,
+                                          RESCAL_THRESHOLDS, eligible, False, excluded, sample)
+            if args.topk:
+                _log.info('Ranking of RESCAL predictions:')
+                evaluate_ranking(result.rankingReport[0], evalDetails[0] if args.statistics else None, y_true,
+                                 np.where(eligible, scores, -np.inf), idx_test, args.topk)
+        with instrumentation.stage('statistics', f, 'rescal'):
+            if args.statistics:
+                folder = statistics_folder(outfolder, 'rescal', start_time)
+                write_precision_recall_curve_file(folder, "precision_recall_curve_fold%d.csv" % f, precision, recall,
+                                                  threshold)
+                TP, FP, threshold = roc_curve(y_true, prediction, result.histograms[0], sample)
+                write_ROC_curve_file(folder, "ROC_curve_fold%d.csv" % f, TP, FP, threshold)
+                for i in range(len(RESCAL_THRESHOLDS)):
+                    binary_pred = (eligible & (scores >= RESCAL_THRESHOLDS[i])).astype(float)
+                    evalDetails[0][i].add_statistic_details_array(y_true, binary_pred, idx_test, prediction)
+
+    if args.rescalsim:
+        with instrumentation.stage('execute_rescal', f, 'rescalsim'):
+            # execute the rescal algorithm
+            useNeedTypeSlice = (args.rescalsim[2] == 'True')
+            useConnectionSlice = (args.rescalsim[3] == 'True')
+            A, R = execute_rescal(test_tensor, RESCAL_SIMILARITY_RANK, useNeedTypeSlice, useConnectionSlice)
+
+        with instrumentation.stage('prediction', f, 'rescalsim'):
+            # use the most similar needs per need to predict connections (need distance lower than the threshold)
+            S = similarity_ranking(A)
+            distances = matrix_to_array(S, idx_test)
+        with instrumentation.stage('metrics', f, 'rescalsim'):
+            eligible = opposite_type_pairs(input_tensor, idx_test)
+            add_threshold_evaluation_data(report[1],
+                                          'For RESCAL prediction based on need similarity with threshold: %f',
+                                          y_true, distances, RESCAL_SIMILARITY_THRESHOLDS, eligible, True, excluded,
+                                          sample)
+            if args.topk:
+                _log.info('Ranking of RESCAL predictions based on need similarity:')
+                evaluate_ranking(result.rankingReport[1], evalDetails[1] if args.statistics else None, y_true,
+                                 np.where(eligible, -distances, -np.inf), idx_test, args.topk)
+
+        with instrumentation.stage('statistics', f, 'rescalsim'):
+            if args.statistics:
+                y_prop = 1.0 - np.nan_to_num(distances)
+                precision, recall, threshold = precision_recall_curve(y_true, y_prop, result.histograms[1], sample,
+                                                                      idx_test)
+                folder = statistics_folder(outfolder, 'rescalsim', start_time)
+                write_precision_recall_curve_file(folder, "precision_recall_curve_fold%d.csv" % f, precision, recall,
+                                                  threshold)
+                TP, FP, threshold = roc_curve(y_true, y_prop, result.histograms[1], sample)
+                write_ROC_curve_file(folder, "ROC_curve_fold%d.csv" % f, TP, FP, threshold)
+                for i in range(len(RESCAL_SIMILARITY_THRESHOLDS)):
+                    binary_pred = (eligible & (distances < RESCAL_SIMILARITY_THRESHOLDS[i])).astype(float)
+                    evalDetails[1][i].add_statistic_details_array(y_true, binary_pred, idx_test)
+
+    if args.cosine:
+        label = 'For prediction of cosine similarity between needs with thresholds: %f, ' + \
+                ('%f:' % COSINE_SIMILARITY_TRANSITIVE_THRESHOLD)
+        with instrumentation.stage('prediction', f, 'cosine'):
+            if COSINE_SIMILARITY_TRANSITIVE_THRESHOLD <= 0.0:
+                # without transitive predictions all thresholds are evaluated on the cosine distances of the pairs
+                distances = cosine_distance_array(test_tensor, idx_test)
+            else:
+                # execute the cosine similarity link prediction algorithm for every threshold
+                y_preds = []
+                for i in range(len(COSINE_SIMILARITY_THRESHOLDS)):
+                    P_bin = cosinus_link_prediciton(test_tensor, test_needs, COSINE_SIMILARITY_THRESHOLDS[i],
+                                                    COSINE_SIMILARITY_TRANSITIVE_THRESHOLD, False)
+                    y_preds.append(matrix_to_array(P_bin, idx_test))
+        with instrumentation.stage('metrics', f, 'cosine'):
+            if COSINE_SIMILARITY_TRANSITIVE_THRESHOLD <= 0.0:
+                add_threshold_evaluation_data(report[2], label, y_true, distances, COSINE_SIMILARITY_THRESHOLDS, None,
+                                              True, excluded, sample)
+            else:
+                for i in range(len(COSINE_SIMILARITY_THRESHOLDS)):
+                    _log.info(label % COSINE_SIMILARITY_THRESHOLDS[i])
+                    report[2][i].add_evaluation_data(y_true, y_preds[i], *excluded, sample=sample)
+            if args.topk:
+                # rank by the cosine distances (pairs that are already connected first)
+                if COSINE_SIMILARITY_TRANSITIVE_THRESHOLD > 0.0:
+                    distances = cosine_distance_array(test_tensor, idx_test)
+                _log.info('Ranking of cosine similarity predictions:')
+                evaluate_ranking(result.rankingReport[2], evalDetails[2] if args.statistics else None, y_true,
+                                 -distances, idx_test, args.topk)
+        with instrumentation.stage('statistics', f, 'cosine'):
+            if args.statistics:
+                for i in range(len(COSINE_SIMILARITY_THRESHOLDS)):
+                    if COSINE_SIMILARITY_TRANSITIVE_THRESHOLD <= 0.0:
+                        binary_pred = (distances < COSINE_SIMILARITY_THRESHOLDS[i]).astype(float)
+                    else:
+                        binary_pred = y_preds[i]
+                    evalDetails[2][i].add_statistic_details_array(y_true, binary_pred, idx_test)
+
+    if args.cosine_weigthed:
+        # execute the weighted cosine similarity link prediction algorithm
+        _log.info('For prediction of weigthed cosine similarity between needs with thresholds %f, %f:' %
+                  (COSINE_WEIGHTED_SIMILARITY_THRESHOLD, COSINE_WEIGHTED_SIMILARITY_TRANSITIVE_THRESHOLD))
+        with instrumentation.stage('prediction', f, 'wcosine'):
+            binary_pred = cosinus_link_prediciton(test_tensor, test_needs, COSINE_WEIGHTED_SIMILARITY_THRESHOLD,
+                                                  COSINE_WEIGHTED_SIMILARITY_TRANSITIVE_THRESHOLD, True)
+            y_pred = matrix_to_array(binary_pred, idx_test)
+        with instrumentation.stage('metrics', f, 'wcosine'):
+            report[3][0].add_evaluation_data(y_true, y_pred, *excluded, sample=sample)
+        with instrumentation.stage('statistics', f, 'wcosine'):
+            if args.statistics:
+                evalDetails[3][0].add_statistic_details_array(y_true, y_pred, idx_test)
+
+    if args.cosine_rescal:
+        with instrumentation.stage('prediction', f, 'cosine_rescal'):
+            cosine_pred, rescal_pred = predict_combine_cosine_rescal(test_tensor, test_needs, idx_test,
+                                                                     int(args.cosine_rescal[0]),
+                                                                     float(args.cosine_rescal[1]),
+                                                                     float(args.cosine_rescal[2]),
+                                                                     bool(args.cosine_rescal[3]))
+        with instrumentation.stage('metrics', f, 'cosine_rescal'):
+            _log.info('First step for prediction of cosine similarity with threshold: %f:' %
+                      float(args.cosine_rescal[2]))
+            report[4][0].add_evaluation_data(y_true, cosine_pred, *excluded, sample=sample)
+            _log.info('And second step for combined RESCAL prediction with parameters: %d, %f:'
+                      % (int(args.cosine_rescal[0]), float(args.cosine_rescal[1])))
+            report[5][0].add_evaluation_data(y_true, rescal_pred, *excluded, sample=sample)
+
+    if args.intersection:
+        with instrumentation.stage('prediction', f, 'intersection'):
+            inter_pred, cosine_pred, rescal_pred = predict_intersect_cosine_rescal(test_tensor, test_needs, idx_test,
+                                                                                   int(args.intersection[0]),
+                                                                                   float(args.intersection[1]),
+                                                                                   float(args.intersection[2]),
+                                                                                   bool(args.intersection[3]))
+        with instrumentation.stage('metrics', f, 'intersection'):
+            _log.info('Intersection of predictions of cosine similarity and rescal algorithms: ')
+            report[8][0].add_evaluation_data(y_true, inter_pred, *excluded, sample=sample)
+
+            _log.info('For RESCAL prediction with threshold %f:' % float(args.intersection[1]))
+            report[7][0].add_evaluation_data(y_true, rescal_pred, *excluded, sample=sample)
+
+            _log.info('For prediction of cosine similarity between needs with thresholds: %f:' %
+                      float(args.intersection[2]))
+            report[6][0].add_evaluation_data(y_true, cosine_pred, *excluded, sample=sample)
+
+    return result
+
+# limit the number of threads of the BLAS library (used by numpy and RESCAL) so that parallel worker processes don't
+# oversubscribe the cores. Use threadpoolctl if it is installed, otherwise the workers keep the thread count that was
+# set before numpy was imported (BLAS_THREADS) and a warning is logged if it is not the requested one
+def limit_blas_threads(num_threads):
+    for var in BLAS_THREAD_VARIABLES:
+        os.environ[var] = str(num_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(num_threads)
+    except ImportError:
+        if BLAS_THREADS != num_threads:
+            _log.warn('Could not limit the BLAS threads to %d: threadpoolctl is not installed and the BLAS library was '
+                      'loaded before the thread environment variables were set' % num_threads)
+
+# data of the cross validation in a worker process of the parallel fold evaluation (set by _init_fold_worker)
+_fold_worker_data = None
+
+def _init_fold_worker(tensor_folder, blas_threads, args, needs, connections, outfolder, start_time):
+    global _fold_worker_data
+    limit_blas_threads(blas_threads)
+    set_test_parameters(args)
+    input_tensor = load_tensor_arrays(tensor_folder + "/input")
+    ground_truth = load_tensor_arrays(tensor_folder + "/truth")
+    _fold_worker_data = (args, input_tensor, ground_truth, needs, connections, outfolder, start_time)
+
+def _evaluate_fold_job(f):
+    args, input_tensor, ground_truth, needs, connections, outfolder, start_time = _fold_worker_data
+    return evaluate_fold(f, args, input_tensor, ground_truth, needs, connections, outfolder, start_time)
+
+# evaluate the folds of the cross validation in a pool of "args.jobs" worker processes. The tensors are written to
+# memory-mapped array files that all workers share read-only. The results are returned in the order of the folds.
+def evaluate_folds_in_parallel(args, input_tensor, ground_truth, needs, connections, outfolder, start_time):
+    tensor_folder = tempfile.mkdtemp(prefix="eval_tensor_", dir=outfolder)
+    try:
+        save_tensor_arrays(input_tensor, tensor_folder + "/input")
+        save_tensor_arrays(ground_truth, tensor_folder + "/truth", [SparseTensor.CONNECTION_SLICE])
+        blas_threads = max(1, multiprocessing.cpu_count() // args.jobs)
+        _log.info('Evaluate %d folds in %d worker processes (%d BLAS threads each)' %
+                  (FOLDS, args.jobs, blas_threads))
+        pool = multiprocessing.Pool(args.jobs, _init_fold_worker,
+                                    (tensor_folder, blas_threads, args, needs, connections, outfolder, start_time))
+        try:
+            results = pool.map(_evaluate_fold_job, range(FOLDS), chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        shutil.rmtree(tensor_folder, ignore_errors=True)
+    return results
 
 # This program executes a N-fold cross validation on rescal tensor data.
 # For each fold test needs are randomly chosen and all their connections to
@@ -324,20 +991,56 @@ if __name__ == '__main__':
                         type=int, help="number of needs used for the evaluation")
     parser.add_argument('-statistics', action="store_true", dest="statistics",
                         help="write detailed statistics for the evaluation")
+    parser.add_argument('-statsformat', action="store", dest="statsformat", default="text", choices=["text", "npz"],
+                        help="format of the detailed statistics of the needs: one text file per need or one npz file "
+                             "per algorithm (use extract_statistic_details.py to create the text files from it)")
+    parser.add_argument('-graph', action="store", dest="graph", default="full",
+                        choices=["full", "ego", "sample", "none"],
+                        help="need graph written with the statistics: all needs, the ego subgraphs of the needs with "
+                             "the lowest f-score, a degree-stratified sample of needs or no graph")
+    parser.add_argument('-graphneeds', action="store", dest="graphneeds", default=100, type=int,
+                        help="number of needs with the lowest f-score (-graph ego) or sampled needs (-graph sample)")
+    parser.add_argument('-graphhops', action="store", dest="graphhops", default=1, type=int,
+                        help="number of connections the ego subgraphs reach from their needs")
     parser.add_argument('-maxhubsize', action="store", dest="maxhubsize", default=10000,
                         type=int, help="use only needs for the evaluation that do not exceed a number X of connections")
+    parser.add_argument('-oppositetype', action="store_true", dest="oppositetype",
+                        help="evaluate only pairs of test needs with needs of the opposite need type (OFFER/WANT)")
+    parser.add_argument('-jobs', action="store", dest="jobs", default=1,
+                        type=int, help="number of worker processes to evaluate the folds in parallel")
+    parser.add_argument('-seed', action="store", dest="seed", default=None,
+                        type=int, help="seed of the random number generator to get reproducible results")
+    parser.add_argument('-negsamples', action="store", dest="negsamples", default=0,
+                        type=int, help="evaluate only the connections of the test needs and this number of sampled "
+                                       "negative pairs (with needs of the opposite type) per test need and estimate "
+                                       "the measures of all pairs, 0 means all pairs are evaluated")
+    parser.add_argument('-topk', action="store", dest="topk", nargs="+", type=int, default=None,
+                        metavar='k', help="compute the ranking metrics precision@k, recall@k, NDCG@k (for every k) "
+                                          "and MAP of the predictions of each test need")
+    parser.add_argument('-histbins', action="store", dest="histbins", default=0,
+                        type=int, help="approximate the precision-recall and ROC curves with score histograms of this "
+                                       "number of bins (constant memory, curves of all folds are merged), 0 means "
+                                       "exact curves per fold")
+    parser.add_argument('-tracemalloc', action="store", dest="tracemalloc", default=0,
+                        type=int, help="trace the python memory allocations and record the peak traced memory and "
+                                       "this number of top allocations of every stage (slow, requires python 3), 0 "
+                                       "means no tracing")
+    parser.add_argument('-profile', action="store_true", dest="profile",
+                        help="profile every fold with cProfile and write the profiles to the output folder")
 
     # algorithm parameters
     parser.add_argument('-rescal', action="store", dest="rescal", nargs=9,
                         metavar=('rank', 'threshold', 'useNeedTypeSlice', 'transitiveConnections', 'init', 'conv',
                                  'lambda_A', 'lambda_R', 'lambda_V'),
-                        help="evaluate RESCAL algorithm")
+                        help="evaluate RESCAL algorithm (threshold can be a comma separated list of thresholds)")
     parser.add_argument('-rescalsim', action="store", dest="rescalsim", nargs=4,
                         metavar=('rank', 'threshold', 'useNeedTypeSlice', 'useConnectionSlice'),
-                        help="evaluate RESCAL similarity algorithm")
+                        help="evaluate RESCAL similarity algorithm (threshold can be a comma separated list of "
+                             "thresholds)")
     parser.add_argument('-cosine', action="store", dest="cosine", nargs=2,
                         metavar=('threshold', 'transitive_threshold'),
-                        help="evaluate cosine similarity algorithm" )
+                        help="evaluate cosine similarity algorithm (threshold can be a comma separated list of "
+                             "thresholds)")
     parser.add_argument('-cosine_weighted', action="store", dest="cosine_weigthed",
                         nargs=2, metavar=('threshold', 'transitive_threshold'),
                         help="evaluate weighted cosine similarity algorithm")
@@ -349,6 +1052,8 @@ if __name__ == '__main__':
                         help="compute the prediction intersection of algorithms cosine similarity and rescal")
 
     args = parser.parse_args()
+    if args.tracemalloc > 0 and not tracemalloc_available():
+        parser.error("-tracemalloc requires the tracemalloc module (python 3)")
     folder = args.inputfolder
 
     start_time = strftime("%Y-%m-%d_%H%M%S")
@@ -360,310 +1065,178 @@ if __name__ == '__main__':
         os.makedirs(outfolder)
     hdlr = logging.FileHandler(outfolder + "/eval_result_" + start_time + ".log")
     _log.addHandler(hdlr)
+    instrumentation = Instrumentation(args.tracemalloc)
 
-    # load the tensor input data
-    data_input = [folder + "/" + args.connection_slice,
-                  folder + "/" + args.needtype_slice]
-    for slice in args.additional_slices:
-        data_input.append(folder + "/" + slice)
-    header_input = folder + "/" + args.headers
-    slices = SparseTensor.defaultSlices + [SparseTensor.ATTR_CONTENT_SLICE, SparseTensor.CATEGORY_SLICE]
-    input_tensor = read_input_tensor(header_input, data_input, slices, True)
-
-
-    # TEST-PARAMETERS:
-    # ===================
-
-    # (10-)fold cross validation
-    FOLDS = args.folds
-
-    # True means: for testing mask all connections of random test needs (Test Case: Predict connections for new need
-    # without connections)
-    # False means: for testing mask random connections (Test Case: Predict connections for existing need which may
-    # already have connections)
-    MASK_ALL_CONNECTIONS_OF_TEST_NEED = not args.maskrandom
-
-    # the f-beta-measure is used to calculate the optimal threshold for the rescal algorithm. beta=1 is the
-    # F1-measure which weights precision and recall both same important. the higher the beta value,
-    # the more important is recall compared to precision
-    F_BETA = args.fbeta
-
-    # by changing this parameter the number of training connections per need can be set. Choose a high value (e.g.
-    # 100) to use all connection in the connections file. Choose a low number to restrict the number of training
-    # connections (e.g. to 1 or even 0). This way tests are possible that describe situation where initially not many
-    # connection are available to learn from.
-    MAX_CONNECTIONS_PER_NEED = args.maxconnections
-
-    # changing the rank parameter influences the amount of internal latent "clusters" of the algorithm and thus the
-    # quality of the matching as well as performance (memory and execution time)
-    RESCAL_RANK = (int(args.rescal[0]) if args.rescal else None)
-    RESCAL_SIMILARITY_RANK = (int(args.rescalsim[0]) if args.rescalsim else None)
-
-    # threshold for RESCAL algorithm connection slice, higher threshold means higher precision
-    RESCAL_THRESHOLD = (float(args.rescal[1]) if args.rescal else None)
+    with instrumentation.stage('load_tensor'):
+        # load the tensor input data
+        data_input = [folder + "/" + args.connection_slice,
+                      folder + "/" + args.needtype_slice]
+        for slice in args.additional_slices:
+            data_input.append(folder + "/" + slice)
+        header_input = folder + "/" + args.headers
+        slices = SparseTensor.defaultSlices + [SparseTensor.ATTR_CONTENT_SLICE, SparseTensor.CATEGORY_SLICE]
+        input_tensor = read_input_tensor(header_input, data_input, slices, True)
 
-    # threshold for RESCAL algorithm need similarity, higher threshold means higher recall
-    RESCAL_SIMILARITY_THRESHOLD = (float(args.rescalsim[1]) if args.rescalsim else None)
 
-    # thresholds for cosine similarity link prediction algorithm, higher threshold means higher recall.
-    # set transitive threshold < threshold to avoid transitive predictions
-    COSINE_SIMILARITY_THRESHOLD = (float(args.cosine[0]) if args.cosine else None)
-    COSINE_SIMILARITY_TRANSITIVE_THRESHOLD = (float(args.cosine[1]) if args.cosine else None)
-    COSINE_WEIGHTED_SIMILARITY_THRESHOLD = (float(args.cosine_weigthed[0]) if args.cosine_weigthed else None)
-    COSINE_WEIGHTED_SIMILARITY_TRANSITIVE_THRESHOLD = (float(args.cosine_weigthed[1]) if args.cosine_weigthed else None)
+    set_test_parameters(args)
+    if args.seed is not None:
+        np.random.seed(args.seed)
 
     _log.info('------------------------------')
     _log.info('Test Setup:')
     _log.info('------------------------------')
 
 
-    if (args.numneeds < len(input_tensor.getNeedIndices())):
-        input_tensor = keep_x_random_needs(input_tensor, args.numneeds)
-
-    input_tensor = mask_needs_with_more_than_X_connections(input_tensor, args.maxhubsize)
-    _log.info('Use only needs that do not have more than %d connections' % args.maxhubsize)
+    with instrumentation.stage('masking'):
+        if (args.numneeds < len(input_tensor.getNeedIndices())):
+            input_tensor = keep_x_random_needs(input_tensor, args.numneeds)
 
-    GROUND_TRUTH = input_tensor.copy()
-    needs = input_tensor.getNeedIndices()
-    np.random.shuffle(needs)
-    connections = need_connection_indices(input_tensor.getNeedIndices(), needs)
+        input_tensor = mask_needs_with_more_than_X_connections(input_tensor, args.maxhubsize)
+        _log.info('Use only needs that do not have more than %d connections' % args.maxhubsize)
 
-    if MASK_ALL_CONNECTIONS_OF_TEST_NEED:
-        _log.info('Mask all connections of random test needs (Test Case: Predict connections for new need '
-                  'without connections)')
-    else:
-        _log.info('Mask random connections (Test Case: Predict connections for existing need which may '
-                  'already have connections)')
+        GROUND_TRUTH = input_tensor.copy()
+        needs = input_tensor.getNeedIndices()
+        np.random.shuffle(needs)
+        connections = need_connection_indices(input_tensor.getNeedIndices(), needs, shuffle=True)
 
-    _log.info('Use a maximum number of %d connections per need' % MAX_CONNECTIONS_PER_NEED)
-    input_tensor = mask_all_but_X_connections_per_need(input_tensor, MAX_CONNECTIONS_PER_NEED)
+        if MASK_ALL_CONNECTIONS_OF_TEST_NEED:
+            _log.info('Mask all connections of random test needs (Test Case: Predict connections for new need '
+                      'without connections)')
+        else:
+            _log.info('Mask random connections (Test Case: Predict connections for existing need which may '
+                      'already have connections)')
+
+        if args.oppositetype and not MASK_ALL_CONNECTIONS_OF_TEST_NEED:
+            _log.warn('Option -oppositetype is only used when all connections of test needs are masked')
+        if args.negsamples > 0 and not MASK_ALL_CONNECTIONS_OF_TEST_NEED:
+            _log.warn('Option -negsamples is only used when all connections of test needs are masked')
+        if args.negsamples > 0 and args.topk:
+            _log.warn('With option -negsamples the ranking metrics only rank the sampled pairs of each test need')
+
+        _log.info('Use a maximum number of %d connections per need' % MAX_CONNECTIONS_PER_NEED)
+        input_tensor = mask_all_but_X_connections_per_need(input_tensor, MAX_CONNECTIONS_PER_NEED)
     offers = input_tensor.getOfferIndices()
     wants = input_tensor.getWantIndices()
-    need_fold_size = int(len(needs) / FOLDS)
-    connection_fold_size = int(len(connections[0]) / FOLDS)
-    AUC_test = np.zeros(FOLDS)
-    report = [EvaluationReport(F_BETA) for _ in range(9)]
-    evalDetails = [NeedEvaluationDetailDict() for _ in range(4)]
 
     _log.info('Number of test needs: %d (OFFERS: %d, WANTS: %d)' %
               (len(needs), len(set(needs) & set(offers)), len(set(needs) & set(wants))))
     _log.info('Number of total needs: %d (OFFERS: %d, WANTS: %d)' %
               (len(input_tensor.getNeedIndices()), len(offers), len(wants)))
-    _log.info('Number of test and train connections: %d' % len(connection_indices(input_tensor)[0]))
-    _log.info('Number of total connections (for evaluation): %d' % len(connection_indices(GROUND_TRUTH)[0]))
+    _log.info('Number of test and train connections: %d' % len(connection_indices(input_tensor)))
+    _log.info('Number of total connections (for evaluation): %d' % len(connection_indices(GROUND_TRUTH)))
     _log.info('Number of attributes: %d' % len(input_tensor.getAttributeIndices()))
 
     _log.info('Starting %d-fold cross validation' % FOLDS)
 
-    # start the cross validation
-    offset = 0
-    for f in range(FOLDS):
-
-        _log.info('------------------------------')
-        # define test set of connections indices
-        if MASK_ALL_CONNECTIONS_OF_TEST_NEED:
-            # choose the test needs for the fold and mask all connections of them to other needs
-            _log.info('Fold %d, fold size %d needs (out of %d)' % (f, need_fold_size, len(needs)))
-            test_needs = needs[offset:offset+need_fold_size]
-            test_tensor = mask_need_connections(input_tensor, test_needs)
-            idx_test = need_connection_indices(input_tensor.getNeedIndices(), test_needs)
-            offset += need_fold_size
+    # start the cross validation, optionally with the folds in parallel worker processes
+    with instrumentation.stage('cross_validation'):
+        if args.jobs > 1:
+            results = evaluate_folds_in_parallel(args, input_tensor, GROUND_TRUTH, needs, connections, outfolder,
+                                                 start_time)
         else:
-            # choose test connections to mask independently of needs
-            _log.info('Fold %d, fold size %d connection indices (out of %d)' % (f, connection_fold_size,
-                                                                                len(connections[0])))
-            idx_test = (connections[0][offset:offset+connection_fold_size],
-                        connections[1][offset:offset+connection_fold_size])
-            test_tensor = mask_idx_connections(input_tensor, idx_test)
-
-            offset += connection_fold_size
-            test_needs = needs
-        _log.info('------------------------------')
+            results = [evaluate_fold(f, args, input_tensor, GROUND_TRUTH, needs, connections, outfolder, start_time)
+                       for f in range(FOLDS)]
+
+    # merge the results of all folds
+    with instrumentation.stage('merge'):
+        AUC_test = np.zeros(FOLDS)
+        report = create_evaluation_reports()
+        evalDetails = create_need_evaluation_details()
+        histograms = create_score_histograms() if HISTOGRAM_BINS > 0 else [None, None]
+        rankingReport = [EvaluationReport(F_BETA) for _ in range(3)]
+        for result in results:
+            AUC_test[result.fold] = result.AUC_test
+            for i in range(len(report)):
+                for j in range(len(report[i])):
+                    report[i][j].merge(result.report[i][j])
+            for i in range(len(evalDetails)):
+                for j in range(len(evalDetails[i])):
+                    evalDetails[i][j].merge(result.evalDetails[i][j])
+            for i in range(len(histograms)):
+                if histograms[i] is not None:
+                    histograms[i].merge(result.histograms[i])
+            for i in range(len(rankingReport)):
+                rankingReport[i].merge(result.rankingReport[i])
 
-        # evaluate the algorithms
-        if args.rescal:
-
-            # set transitive connections before execution
-            if (args.rescal[3] == 'True'):
-                _log.info('extend connections transitively to the next need for RESCAL learning')
-                test_tensor = extend_next_hop_transitive_connections(test_tensor)
-
-            # execute the rescal algorithm
-            useNeedTypeSlice = (args.rescal[2] == 'True')
-            A, R = execute_rescal(test_tensor, RESCAL_RANK, useNeedTypeSlice, init=args.rescal[4],
-                                  conv=float(args.rescal[5]), lambda_A=float(args.rescal[6]),
-                                  lambda_R=float(args.rescal[7]), lambda_V=float(args.rescal[8]))
-
-            # evaluate the predictions
-            _log.info('start predict connections ...')
-            prediction = np.round_(predict_rescal_connections_array(A, R, idx_test), decimals=5)
-            _log.info('stop predict connections')
-            precision, recall, threshold = m.precision_recall_curve(
-                GROUND_TRUTH.getArrayFromSliceMatrix(SparseTensor.CONNECTION_SLICE, idx_test), prediction)
-            optimal_threshold = get_optimal_threshold(recall, precision, threshold, F_BETA)
-            _log.info('optimal RESCAL threshold would be ' + str(optimal_threshold) +
-                      ' (for maximum F' + str(F_BETA) + '-score)')
-
-            AUC_test[f] = m.auc(recall, precision)
-            _log.info('AUC test: ' + str(AUC_test[f]))
-
-            # use a fixed threshold to compute several measures
-            _log.info('For RESCAL prediction with threshold %f:' % RESCAL_THRESHOLD)
-            P_bin = predict_rescal_connections_by_threshold(A, R, RESCAL_THRESHOLD, offers, wants, test_needs)
-            binary_pred = matrix_to_array(P_bin, idx_test)
-            report[0].add_evaluation_data(GROUND_TRUTH.getArrayFromSliceMatrix(SparseTensor.CONNECTION_SLICE,
-                                                                              idx_test), binary_pred)
-            if args.statistics:
-                write_precision_recall_curve_file(outfolder + "/statistics/rescal_" + start_time,
-                                                  "precision_recall_curve_fold%d.csv" % f, precision, recall, threshold)
-                TP, FP, threshold = m.roc_curve(GROUND_TRUTH.getArrayFromSliceMatrix(SparseTensor.CONNECTION_SLICE, idx_test), prediction)
-                write_ROC_curve_file(outfolder + "/statistics/rescal_" + start_time, "ROC_curve_fold%d.csv" % f, TP, FP, threshold)
-                evalDetails[0].add_statistic_details(GROUND_TRUTH.getSliceMatrix(SparseTensor.CONNECTION_SLICE),
-                                                     P_bin, idx_test, prediction)
-
-        if args.rescalsim:
-            # execute the rescal algorithm
-            useNeedTypeSlice = (args.rescalsim[2] == 'True')
-            useConnectionSlice = (args.rescalsim[3] == 'True')
-            A, R = execute_rescal(test_tensor, RESCAL_SIMILARITY_RANK, useNeedTypeSlice, useConnectionSlice)
-
-            # use the most similar needs per need to predict connections
-            _log.info('For RESCAL prediction based on need similarity with threshold: %f' % RESCAL_SIMILARITY_THRESHOLD)
-            P_bin = predict_rescal_connections_by_need_similarity(A, RESCAL_SIMILARITY_THRESHOLD, offers, wants, test_needs)
-            binary_pred = matrix_to_array(P_bin, idx_test)
-            report[1].add_evaluation_data(GROUND_TRUTH.getArrayFromSliceMatrix(SparseTensor.CONNECTION_SLICE,
-                                                                              idx_test), binary_pred)
-
-            if args.statistics:
-                S = similarity_ranking(A)
-                y_prop = [1.0 - i for i in np.nan_to_num(S[idx_test])]
-                precision, recall, threshold = m.precision_recall_curve(GROUND_TRUTH.getArrayFromSliceMatrix(SparseTensor.CONNECTION_SLICE, idx_test), y_prop)
-                write_precision_recall_curve_file(outfolder + "/statistics/rescalsim_" + start_time, "precision_recall_curve_fold%d.csv" % f, precision, recall, threshold)
-                TP, FP, threshold = m.roc_curve(GROUND_TRUTH.getArrayFromSliceMatrix(SparseTensor.CONNECTION_SLICE, idx_test), y_prop)
-                write_ROC_curve_file(outfolder + "/statistics/rescalsim_" + start_time, "ROC_curve_fold%d.csv" % f, TP, FP, threshold)
-                evalDetails[1].add_statistic_details(GROUND_TRUTH.getSliceMatrix(SparseTensor.CONNECTION_SLICE),
-                                                     P_bin, idx_test)
-
-        if args.cosine:
-            # execute the cosine similarity link prediction algorithm
-            _log.info('For prediction of cosine similarity between needs with thresholds: %f, %f'
-                      ':' % (COSINE_SIMILARITY_THRESHOLD, COSINE_SIMILARITY_TRANSITIVE_THRESHOLD))
-            binary_pred = cosinus_link_prediciton(test_tensor, test_needs, COSINE_SIMILARITY_THRESHOLD,
-                                                  COSINE_SIMILARITY_TRANSITIVE_THRESHOLD, False)
-            report[2].add_evaluation_data(GROUND_TRUTH.getArrayFromSliceMatrix(SparseTensor.CONNECTION_SLICE,idx_test),
-                                          matrix_to_array(binary_pred, idx_test))
-            if args.statistics:
-                evalDetails[2].add_statistic_details(GROUND_TRUTH.getSliceMatrix(SparseTensor.CONNECTION_SLICE),
-                                                     binary_pred, idx_test)
-
-        if args.cosine_weigthed:
-            # execute the weighted cosine similarity link prediction algorithm
-            _log.info('For prediction of weigthed cosine similarity between needs with thresholds %f, %f:' %
-                      (COSINE_WEIGHTED_SIMILARITY_THRESHOLD, COSINE_WEIGHTED_SIMILARITY_TRANSITIVE_THRESHOLD))
-            binary_pred = cosinus_link_prediciton(test_tensor, test_needs, COSINE_WEIGHTED_SIMILARITY_THRESHOLD,
-                                                  COSINE_WEIGHTED_SIMILARITY_TRANSITIVE_THRESHOLD, True)
-            report[3].add_evaluation_data(GROUND_TRUTH.getArrayFromSliceMatrix(SparseTensor.CONNECTION_SLICE, idx_test),
-                                          matrix_to_array(binary_pred, idx_test))
-            if args.statistics:
-                evalDetails[3].add_statistic_details(GROUND_TRUTH.getSliceMatrix(SparseTensor.CONNECTION_SLICE),
-                                                     binary_pred, idx_test)
-
-        if args.cosine_rescal:
-            cosine_pred, rescal_pred = predict_combine_cosine_rescal(test_tensor, test_needs, idx_test,
-                                                                     int(args.cosine_rescal[0]),
-                                                                     float(args.cosine_rescal[1]),
-                                                                     float(args.cosine_rescal[2]),
-                                                                     bool(args.cosine_rescal[3]))
-            _log.info('First step for prediction of cosine similarity with threshold: %f:' % float(args.cosine_rescal[2]))
-            report[4].add_evaluation_data(GROUND_TRUTH.getArrayFromSliceMatrix(SparseTensor.CONNECTION_SLICE,
-                                                                              idx_test), cosine_pred)
-            _log.info('And second step for combined RESCAL prediction with parameters: %d, %f:'
-                      % (int(args.cosine_rescal[0]), float(args.cosine_rescal[1])))
-            report[5].add_evaluation_data(GROUND_TRUTH.getArrayFromSliceMatrix(SparseTensor.CONNECTION_SLICE,
-                                                                              idx_test), rescal_pred)
-
-        if args.intersection:
-            inter_pred, cosine_pred, rescal_pred = predict_intersect_cosine_rescal(test_tensor, test_needs, idx_test,
-                                                                                   int(args.intersection[0]), float(args.intersection[1]),
-                                                                                   float(args.intersection[2]), bool(args.intersection[3]))
-            _log.info('Intersection of predictions of cosine similarity and rescal algorithms: ')
-            report[8].add_evaluation_data(GROUND_TRUTH.getArrayFromSliceMatrix(SparseTensor.CONNECTION_SLICE,
-                                                                              idx_test), inter_pred)
-
-            _log.info('For RESCAL prediction with threshold %f:' % float(args.intersection[1]))
-            report[7].add_evaluation_data(GROUND_TRUTH.getArrayFromSliceMatrix(SparseTensor.CONNECTION_SLICE,
-                                                                             idx_test), rescal_pred)
-
-            _log.info('For prediction of cosine similarity between needs with thresholds: %f:' %
-                      float(args.intersection[2]))
-            report[6].add_evaluation_data(GROUND_TRUTH.getArrayFromSliceMatrix(SparseTensor.CONNECTION_SLICE,
-                                                                             idx_test), cosine_pred)
-
-        # end of fold loop
 
     _log.info('====================================================')
     if args.rescal:
         _log.info('AUC-PR Test Mean / Std: %f / %f' % (AUC_test.mean(), AUC_test.std()))
+        if histograms[0] is not None:
+            _log.info('AUC-PR Test of all folds: %f (maximum error %f)' %
+                      (histograms[0].getPrecisionRecallAUC(), histograms[0].getPrecisionRecallAUCErrorBound()))
+            _log.info('AUC-ROC Test of all folds: %f (maximum error %f)' %
+                      (histograms[0].getROCAUC(), histograms[0].getROCAUCErrorBound()))
         _log.info('----------------------------------------------------')
-        _log.info('For RESCAL prediction with threshold %f:' % RESCAL_THRESHOLD)
-        report[0].summary()
+        for i in range(len(RESCAL_THRESHOLDS)):
+            _log.info('For RESCAL prediction with threshold %f:' % RESCAL_THRESHOLDS[i])
+            report[0][i].summary()
+        if args.topk:
+            _log.info('Ranking of RESCAL predictions:')
+            rankingReport[0].summary()
         if args.statistics:
-            output_statistic_details(outfolder + "/statistics/rescal_" + start_time, GROUND_TRUTH.getHeaders(),
-                                     evalDetails[0], True)
-            gexf = create_gexf_graph(input_tensor, evalDetails[0])
-            output_file = open(outfolder + "/statistics/rescal_" + start_time + "/graph.gexf", "w")
-            gexf.write(output_file)
-            output_file.close()
+            with instrumentation.stage('statistics_output', algorithm='rescal'):
+                write_threshold_statistics(outfolder, 'rescal', start_time, RESCAL_THRESHOLDS, input_tensor,
+                                           GROUND_TRUTH.getHeaders(), evalDetails[0], args, True)
+                if histograms[0] is not None:
+                    write_pooled_curve_files(statistics_folder(outfolder, 'rescal', start_time), histograms[0])
         _log.info('----------------------------------------------------')
     if args.rescalsim:
-        _log.info('For RESCAL prediction based on need similarity with threshold: %f' % RESCAL_SIMILARITY_THRESHOLD)
-        report[1].summary()
+        for i in range(len(RESCAL_SIMILARITY_THRESHOLDS)):
+            _log.info('For RESCAL prediction based on need similarity with threshold: %f' %
+                      RESCAL_SIMILARITY_THRESHOLDS[i])
+            report[1][i].summary()
+        if args.topk:
+            _log.info('Ranking of RESCAL predictions based on need similarity:')
+            rankingReport[1].summary()
         if args.statistics:
-            output_statistic_details(outfolder + "/statistics/rescalsim_" + start_time, GROUND_TRUTH.getHeaders(),
-                                     evalDetails[1])
-            gexf = create_gexf_graph(input_tensor, evalDetails[1])
-            output_file = open(outfolder + "/statistics/rescalsim_" + start_time + "/graph.gexf", "w")
-            gexf.write(output_file)
-            output_file.close()
+            with instrumentation.stage('statistics_output', algorithm='rescalsim'):
+                write_threshold_statistics(outfolder, 'rescalsim', start_time, RESCAL_SIMILARITY_THRESHOLDS,
+                                           input_tensor, GROUND_TRUTH.getHeaders(), evalDetails[1], args)
+                if histograms[1] is not None:
+                    write_pooled_curve_files(statistics_folder(outfolder, 'rescalsim', start_time), histograms[1])
         _log.info('----------------------------------------------------')
     if args.cosine:
-        _log.info('For prediction of cosine similarity between needs with thresholds: %f, %f'
-                  ':' % (COSINE_SIMILARITY_THRESHOLD, COSINE_SIMILARITY_TRANSITIVE_THRESHOLD))
-        report[2].summary()
+        for i in range(len(COSINE_SIMILARITY_THRESHOLDS)):
+            _log.info('For prediction of cosine similarity between needs with thresholds: %f, %f'
+                      ':' % (COSINE_SIMILARITY_THRESHOLDS[i], COSINE_SIMILARITY_TRANSITIVE_THRESHOLD))
+            report[2][i].summary()
+        if args.topk:
+            _log.info('Ranking of cosine similarity predictions:')
+            rankingReport[2].summary()
         if args.statistics:
-            output_statistic_details(outfolder + "/statistics/cosine_" + start_time, GROUND_TRUTH.getHeaders(),
-                                     evalDetails[2])
-            gexf = create_gexf_graph(input_tensor, evalDetails[2])
-            output_file = open(outfolder + "/statistics/cosine_" + start_time + "/graph.gexf", "w")
-            gexf.write(output_file)
-            output_file.close()
+            with instrumentation.stage('statistics_output', algorithm='cosine'):
+                write_threshold_statistics(outfolder, 'cosine', start_time, COSINE_SIMILARITY_THRESHOLDS,
+                                           input_tensor, GROUND_TRUTH.getHeaders(), evalDetails[2], args)
         _log.info('----------------------------------------------------')
     if args.cosine_weigthed:
         _log.info('For prediction of weighted cosine similarity between needs with thresholds: %f, %f'
-                  ':' % (COSINE_SIMILARITY_THRESHOLD, COSINE_SIMILARITY_TRANSITIVE_THRESHOLD))
-        report[3].summary()
+                  ':' % (COSINE_WEIGHTED_SIMILARITY_THRESHOLD, COSINE_WEIGHTED_SIMILARITY_TRANSITIVE_THRESHOLD))
+        report[3][0].summary()
         if args.statistics:
-            output_statistic_details(outfolder + "/statistics/wcosine_" + start_time, GROUND_TRUTH.getHeaders(),
-                                     evalDetails[3])
-            gexf = create_gexf_graph(input_tensor, evalDetails[3])
-            output_file = open(outfolder + "/statistics/wcosine_" + start_time + "/graph.gexf", "w")
-            gexf.write(output_file)
-            output_file.close()
+            with instrumentation.stage('statistics_output', algorithm='wcosine'):
+                write_threshold_statistics(outfolder, 'wcosine', start_time, None, input_tensor,
+                                           GROUND_TRUTH.getHeaders(), evalDetails[3], args)
     if args.cosine_rescal:
         _log.info('First step for prediction of cosine similarity with threshold: %f:' % float(args.cosine_rescal[2]))
-        report[4].summary()
+        report[4][0].summary()
         _log.info('And second step for combined RESCAL prediction with threshold: %f:' % float(args.cosine_rescal[1]))
-        report[5].summary()
+        report[5][0].summary()
     if args.intersection:
         _log.info('Intersection of predictions of cosine similarity and rescal algorithms: ')
-        report[8].summary()
+        report[8][0].summary()
         _log.info('For RESCAL prediction with threshold %f:' % float(args.intersection[1]))
-        report[7].summary()
+        report[7][0].summary()
         _log.info('For prediction of cosine similarity between needs with thresholds: %f:' %
                   float(args.intersection[2]))
-        report[6].summary()
-
-
-
-
-
+        report[6][0].summary()
+
+    # write the time and memory of all stages of the evaluation (including the stages of all folds)
+    for result in results:
+        instrumentation.merge(result.instrumentation)
+    stages_file = outfolder + "/eval_stages_" + start_time + ".json"
+    instrumentation.save(stages_file, vars(args))
+    _log.info('Cross validation wall time: %fs (RESCAL execution: %fs, statistics output: %fs)' %
+              (instrumentation.getWallTime('cross_validation'), instrumentation.getWallTime('execute_rescal'),
+               instrumentation.getWallTime('statistics_output')))
+    _log.info('write time and memory of the evaluation stages: ' + stages_file)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+import logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s %(levelname)-8s %(message)s',
+                    datefmt='%a, %d %b %Y %H:%M:%S')
+_log = logging.getLogger()
+
+import os
+import argparse
+
+from tools.evaluation_utils import NeedEvaluationDetailDict, output_statistic_details
+
+# Create the text files of the needs (TP, FN, FP needs of each need) from a "statistics.npz" file that was written by
+# evaluate_link_prediction.py with the option "-statsformat npz". The files are the same as the ones written with the
+# option "-statsformat text", optionally only the files of some needs are created.
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='extract the per need statistic text files from a statistics.npz '
+                                                 'file of the link prediction evaluation')
+    parser.add_argument('-statistics', action="store", dest="statistics", required=True,
+                        help="statistics.npz file of an algorithm of the evaluation")
+    parser.add_argument('-outputfolder', action="store", dest="outputfolder", default=None,
+                        help="folder to write the text files to (default: the folder of the statistics file)")
+    parser.add_argument('-needs', action="store", dest="needs", nargs="+", default=None,
+                        help="only extract the files of these needs (need names as in the file names or tensor "
+                             "indices)")
+    parser.add_argument('-summary', action="store_true", dest="summary",
+                        help="also write the summary file of the extracted needs")
+    args = parser.parse_args()
+
+    outputfolder = args.outputfolder
+    if outputfolder is None:
+        outputfolder = os.path.dirname(os.path.abspath(args.statistics))
+
+    _log.info('Read statistics file: ' + args.statistics)
+    detailDict, headers, f_beta, printThresholds = NeedEvaluationDetailDict.load(args.statistics)
+
+    needs = None
+    if args.needs:
+        needIndices = dict((headers[i][6:], i) for i in range(len(headers)))
+        needs = []
+        for need in args.needs:
+            if need in needIndices:
+                needs.append(needIndices[need])
+            elif need.isdigit() and int(need) < len(headers):
+                needs.append(int(need))
+            else:
+                _log.warn('Need not found: ' + need)
+
+    _log.info('Write statistic detail files to folder: ' + outputfolder)
+    output_statistic_details(outputfolder, headers, detailDict, f_beta, printThresholds, needs,
+                             writeSummary=args.summary)
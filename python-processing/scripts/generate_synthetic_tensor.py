@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+import logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s %(levelname)-8s %(message)s',
+                    datefmt='%a, %d %b %Y %H:%M:%S')
+_log = logging.getLogger()
+
+import argparse
+
+from tools.tensor_utils import SparseTensor
+from tools.synthetic_tensor import create_synthetic_tensor, write_tensor_folder
+
+# Create a synthetic WON tensor folder (headers.txt, connection.mtx, needtype.mtx, subject.mtx, content.mtx and
+# category.mtx) with a configurable number of needs and attributes. It can be used as input folder of
+# evaluate_link_prediction.py to test and benchmark the evaluation without the private mail corpus.
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='create a synthetic tensor folder for the link prediction evaluation')
+    parser.add_argument('-outputfolder', action="store", dest="outputfolder", required=True,
+                        help="folder to write the tensor files to")
+    parser.add_argument('-needs', action="store", dest="needs", type=int, default=1000,
+                        help="number of needs")
+    parser.add_argument('-attributes', action="store", dest="attributes", type=int, default=500,
+                        help="number of subject/content attribute terms")
+    parser.add_argument('-categories', action="store", dest="categories", type=int, default=20,
+                        help="number of categories (0 for an empty category slice)")
+    parser.add_argument('-offerratio', action="store", dest="offerratio", type=float, default=0.5,
+                        help="fraction of the needs that are OFFERS (the others are WANTS)")
+    parser.add_argument('-connections', action="store", dest="connections", type=float, default=2.0,
+                        help="mean number of connections per need")
+    parser.add_argument('-degreeexponent', action="store", dest="degreeexponent", type=float, default=2.5,
+                        help="exponent (> 1) of the power law connection degree distribution, smaller values "
+                             "create more and bigger hubs")
+    parser.add_argument('-subjectattributes', action="store", dest="subjectattributes", type=float, default=3.0,
+                        help="mean number of subject attributes per need")
+    parser.add_argument('-contentattributes', action="store", dest="contentattributes", type=float, default=15.0,
+                        help="mean number of content attributes per need")
+    parser.add_argument('-zipfexponent', action="store", dest="zipfexponent", type=float, default=1.1,
+                        help="exponent of the Zipf distribution of the attribute frequencies")
+    parser.add_argument('-seed', action="store", dest="seed", type=int, default=None,
+                        help="seed of the random number generator to create the same tensor again")
+    args = parser.parse_args()
+
+    _log.info("Create synthetic tensor with %d needs, %d attributes and %d categories" %
+              (args.needs, args.attributes, args.categories))
+    tensor = create_synthetic_tensor(args.needs, args.attributes, num_categories=args.categories,
+                                     offer_ratio=args.offerratio, mean_connections=args.connections,
+                                     degree_exponent=args.degreeexponent, subject_attributes=args.subjectattributes,
+                                     content_attributes=args.contentattributes, zipf_exponent=args.zipfexponent,
+                                     seed=args.seed)
+    statistics = tensor.getStatistics()
+    _log.info("%d offers, %d wants, %d connections, maximum connection degree %d" %
+              (len(tensor.getOfferIndices()), len(tensor.getWantIndices()),
+               tensor.data[SparseTensor.CONNECTION_SLICE].nnz // 2, statistics.connectionDegree.max()))
+
+    _log.info("Write tensor folder: " + args.outputfolder)
+    write_tensor_folder(tensor, args.outputfolder)
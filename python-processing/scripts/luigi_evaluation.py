@@ -18,6 +18,10 @@ RESCAL2_DEFAULT_PARAMS = ['--rank2',  '500', '--threshold2', '0.06']
 COSINE_DEFAULT_PARAMS = ['--costhreshold', '0.5', '--costransthreshold', '0.0', '--wcosthreshold', '0.6',
                          '--wcostransthreshold', '0.0']
 
+# all thresholds of a list are evaluated in one run (e.g. "0.02,0.03,0.04")
+def thresholds_param(thresholds):
+    return ','.join(str(threshold) for threshold in thresholds)
+
 def output_folder_config():
     return args.testdataset + '/evaluation'
 
@@ -61,12 +65,11 @@ def rank_eval():
                       (2000,[0.02, 0.025, 0.03])]
     for tuple in rank_threshold:
         rank = tuple[0]
-        for threshold in tuple[1]:
-            params = ['RESCALEvaluation'] + base_config() + \
-                     ['--outputfolder', output_folder_config() + '/results/rank'] + \
-                     ['--rank', str(rank), '--threshold', str(threshold)]  + \
-                     ['--tensorfolder', output_folder_config() + '/tensor']
-            luigi.run(params)
+        params = ['RESCALEvaluation'] + base_config() + \
+                 ['--outputfolder', output_folder_config() + '/results/rank'] + \
+                 ['--rank', str(rank), '--threshold', thresholds_param(tuple[1])]  + \
+                 ['--tensorfolder', output_folder_config() + '/tensor']
+        luigi.run(params)
 
 # evaluate the influence of stopwords on the algorithms. This test executes the preprocessing without filtering out
 #  any stopwords (here in this case the effect might not be that big since only the subject line of emails is used as
@@ -100,17 +103,14 @@ def content_slice_eval():
     params = ['RESCALEvaluation'] + base_config() + ['--content', '--additionalslices', 'subject.mtx content.mtx'] + \
              ['--outputfolder', output_folder_config() + '/results/content'] + \
              ['--tensorfolder', output_folder_config() + '/tensor_content']
-    luigi.run(params + RESCAL_DEFAULT_PARAMS)
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.03'])
+    luigi.run(params + ['--rank',  '500', '--threshold', thresholds_param([0.02, 0.03])])
 
 # evaluate the effect of adding the category slice to the RESCAL evaluation
 def category_slice_eval():
     params = ['CategoryEvaluation'] + base_config() + ['--allneeds', args.testdataset + '/allneeds.txt'] + \
              ['--outputfolder', output_folder_config() + '/results/category'] + \
              ['--tensorfolder', output_folder_config() + '/tensor_category']
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.02'])
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.03'])
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.04'])
+    luigi.run(params + ['--rank',  '500', '--threshold', thresholds_param([0.02, 0.03, 0.04])])
 
     params = ['CategoryCosineEvaluation'] + base_config() + ['--allneeds', args.testdataset + '/allneeds.txt'] + \
              ['--outputfolder', output_folder_config() + '/results/category'] + \
@@ -126,9 +126,15 @@ def keyword_slice_eval():
     params = ['KeywordEvaluation'] + base_config() + \
              ['--outputfolder', output_folder_config() + '/results/keyword'] + \
              ['--tensorfolder', output_folder_config() + '/tensor_keyword']
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.02'])
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.03'])
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.04'])
+    luigi.run(params + ['--rank',  '500', '--threshold', thresholds_param([0.02, 0.03, 0.04])])
+
+# evaluate the effect of replacing the keyword slice by a slice of the LDA topics of the needs
+def topic_slice_eval():
+    params = ['TopicEvaluation'] + base_config() + \
+             ['--outputfolder', output_folder_config() + '/results/topic'] + \
+             ['--tensorfolder', output_folder_config() + '/tensor_topic']
+    luigi.run(params + ['--rank',  '500', '--threshold', thresholds_param([0.02, 0.03, 0.04])] +
+              ['--topics', '200', '--toptopics', '3'])
 
 # evaluate the effect of adding the needtype slice to the RESCAL evaluation
 def needtype_slice_eval():
@@ -140,16 +146,13 @@ def needtype_slice_eval():
 def maskrandom_eval():
     params = ['RESCALEvaluation'] + base_config() + ['--outputfolder', output_folder_config() + '/results/maskrandom'] + \
              ['--maskrandom'] + ['--tensorfolder', output_folder_config() + '/tensor']
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.1'])
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.2'])
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.3'])
+    luigi.run(params + ['--rank',  '500', '--threshold', thresholds_param([0.1, 0.2, 0.3])])
 
 # evaluate the effect of adding transitive connections to needs only one edge away (connects needs of the same type)
 def transitive_eval():
     params = ['RESCALEvaluation'] + base_config() + ['--outputfolder', output_folder_config() + '/results/transitive'] + \
              ['--tensorfolder', output_folder_config() + '/tensor', ]  + ['--transitive'] + ['--maxhubsize', '10']
-    luigi.run(params + RESCAL_DEFAULT_PARAMS)
-    luigi.run(params + ['--rank',  '500', '--threshold', '0.03'])
+    luigi.run(params + ['--rank',  '500', '--threshold', thresholds_param([0.02, 0.03])])
 
 # evaluate the influence of the number of input connections (chosen randomly) to learn from on the RESCAL algorithm
 def connection_rescalsim_eval():
@@ -167,22 +170,20 @@ def connections_rescal_eval():
                             (5,[0.02, 0.03]),
                             (10,[0.02, 0.03])]
     for tuple in connection_threshold:
-        for threshold in tuple[1]:
-            con = tuple[0]
-            params = ['RESCALEvaluation'] + base_config() + ['--rank',  '500', '--threshold', str(threshold)] + \
-                     ['--maxconnections', str(con)] + ['--outputfolder', output_folder_config() + '/results/connections'] + \
-                     ['--tensorfolder', output_folder_config() + '/tensor']
-    luigi.run(params)
+        con = tuple[0]
+        params = ['RESCALEvaluation'] + base_config() + ['--rank',  '500', '--threshold', thresholds_param(tuple[1])] + \
+                 ['--maxconnections', str(con)] + ['--outputfolder', output_folder_config() + '/results/connections'] + \
+                 ['--tensorfolder', output_folder_config() + '/tensor']
+        luigi.run(params)
     connection_threshold = [(10,[0.015, 0.02]),
                             (20,[0.015, 0.02]),
                             (50,[0.015, 0.02])]
     for tuple in connection_threshold:
-        for threshold in tuple[1]:
-            con = tuple[0]
-            params = ['RESCALEvaluation'] + base_config() + ['--rank',  '500', '--threshold', str(threshold)] + \
-                     ['--maxconnections', str(con)] + ['--outputfolder', output_folder_config() + '/results/connections'] + \
-                     ['--tensorfolder', output_folder_config() + '/tensor'] + ['--lambdaA', '5.0', '--lambdaR', '5.0', '--lambdaV', '5.0']
-            luigi.run(params)
+        con = tuple[0]
+        params = ['RESCALEvaluation'] + base_config() + ['--rank',  '500', '--threshold', thresholds_param(tuple[1])] + \
+                 ['--maxconnections', str(con)] + ['--outputfolder', output_folder_config() + '/results/connections'] + \
+                 ['--tensorfolder', output_folder_config() + '/tensor'] + ['--lambdaA', '5.0', '--lambdaR', '5.0', '--lambdaV', '5.0']
+        luigi.run(params)
 
 def num_needs_eval():
     params = ['AllEvaluation'] + base_config() + \
@@ -311,6 +312,7 @@ if __name__ == '__main__':
     transitive_eval()
     nohubneeds_eval()
     keyword_slice_eval()
+    topic_slice_eval()
     no_stopwords()
     stemming_eval()
     needtype_slice_eval()
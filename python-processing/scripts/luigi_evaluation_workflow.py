@@ -117,6 +117,32 @@ class CreateKeywordSlice(CreateTensor):
                    self.tensorfolder)
 
 
+class CreateTopicSlice(CreateTensor):
+    """Optional task to create a slice of the LDA topics of the needs"""
+
+    topics = luigi.IntParameter(default=200)
+    toptopics = luigi.IntParameter(default=3)
+    passes = luigi.IntParameter(default=1)
+
+    def requires(self):
+        return [CreateTensor(self.gatehome, self.jarfile,
+                             self.inputfolder, self.tensorfolder,
+                             self.connections, self.gateapp,
+                             self.stemming, self.content,
+                             self.java, self.python)]
+
+    def output(self):
+        return luigi.LocalTarget(self.tensorfolder + '/topic.mtx')
+
+    def run(self):
+        run_python(self.python, 'add_topic_slice.py',
+                   '-documents', self.tensorfolder + '/preprocessed',
+                   '-tensorfolder', self.tensorfolder,
+                   '-topics', str(self.topics),
+                   '-toptopics', str(self.toptopics),
+                   '-passes', str(self.passes))
+
+
 # Use this task as a base class for different evaluation task variants
 class BaseEvaluation(CreateTensor):
 
@@ -127,7 +153,19 @@ class BaseEvaluation(CreateTensor):
     fbeta = luigi.FloatParameter(default=0.5)
     numneeds = luigi.IntParameter(default=10000)
     statistics = luigi.BooleanParameter(default=True)
+    statsformat = luigi.Parameter(default='text')
+    graph = luigi.Parameter(default='full')
+    graphneeds = luigi.IntParameter(default=100)
+    graphhops = luigi.IntParameter(default=1)
     maxhubsize = luigi.IntParameter(default=10000)
+    oppositetype = luigi.BooleanParameter(default=False)
+    jobs = luigi.IntParameter(default=1)
+    seed = luigi.Parameter(default=None)
+    histbins = luigi.IntParameter(default=0)
+    topk = luigi.Parameter(default=None)
+    negsamples = luigi.IntParameter(default=0)
+    tracemalloc = luigi.IntParameter(default=0)
+    profile = luigi.BooleanParameter(default=False)
 
     def requires(self):
         return [CreateTensor(self.gatehome, self.jarfile,
@@ -149,10 +187,24 @@ class BaseEvaluation(CreateTensor):
         params += " -fbeta " + str(self.fbeta)
         params += " -numneeds " + str(self.numneeds)
         params += " -maxhubsize " + str(self.maxhubsize)
+        params += " -jobs " + str(self.jobs)
+        params += " -histbins " + str(self.histbins)
+        params += " -negsamples " + str(self.negsamples)
+        params += " -tracemalloc " + str(self.tracemalloc)
+        if (self.topk):
+            params += " -topk " + self.topk
+        if (self.seed is not None):
+            params += " -seed " + str(self.seed)
         if (self.maskrandom):
             params += " -maskrandom "
         if (self.statistics):
-            params += " -statistics "
+            params += " -statistics -statsformat " + self.statsformat
+            params += " -graph " + self.graph + " -graphneeds " + str(self.graphneeds)
+            params += " -graphhops " + str(self.graphhops)
+        if (self.oppositetype):
+            params += " -oppositetype "
+        if (self.profile):
+            params += " -profile "
         if (self.outputfolder):
             params += " -outputfolder " + self.outputfolder
         return params
@@ -161,11 +213,12 @@ class BaseEvaluation(CreateTensor):
         os.system("" + self.python + " evaluate_link_prediction.py " + self.getParams())
 
 
-# Execute the evaluation for the RESCAL (optionally including RESCAL similarity) algorithm
+# Execute the evaluation for the RESCAL (optionally including RESCAL similarity) algorithm. The thresholds can be
+# comma separated lists (e.g. "0.02,0.03,0.04") to evaluate several thresholds in one run
 class RESCALEvaluation(BaseEvaluation):
 
     rank = luigi.IntParameter(default=0)
-    threshold = luigi.FloatParameter(default=0.0)
+    threshold = luigi.Parameter(default='0.0')
     needtypeslice = luigi.BooleanParameter(default=False)
     transitive = luigi.BooleanParameter(default=False)
     init = luigi.Parameter(default='nvecs')
@@ -174,7 +227,7 @@ class RESCALEvaluation(BaseEvaluation):
     lambdaR = luigi.FloatParameter(default=0.0)
     lambdaV = luigi.FloatParameter(default=0.0)
     rank2 = luigi.IntParameter(default=0)
-    threshold2 = luigi.FloatParameter(default=0.0)
+    threshold2 = luigi.Parameter(default='0.0')
     connectionslice2 = luigi.BooleanParameter(default=False)
 
     def getParams(self):
@@ -193,8 +246,8 @@ class RESCALEvaluation(BaseEvaluation):
 class AllEvaluation(RESCALEvaluation):
 
     rank2 = luigi.IntParameter()
-    threshold2 = luigi.FloatParameter()
-    costhreshold = luigi.FloatParameter()
+    threshold2 = luigi.Parameter()
+    costhreshold = luigi.Parameter()
     costransthreshold = luigi.FloatParameter()
     wcosthreshold = luigi.FloatParameter()
     wcostransthreshold = luigi.FloatParameter()
@@ -208,7 +261,7 @@ class AllEvaluation(RESCALEvaluation):
 # Execute the evaluation for the cosine algorithm
 class CosineEvaluation(BaseEvaluation):
 
-    costhreshold = luigi.FloatParameter()
+    costhreshold = luigi.Parameter()
     costransthreshold = luigi.FloatParameter()
     wcosthreshold = luigi.FloatParameter()
     wcostransthreshold = luigi.FloatParameter()
@@ -315,3 +368,29 @@ class KeywordEvaluation(RESCALEvaluation):
                                self.java, self.python)
         ]
 
+
+class TopicEvaluation(RESCALEvaluation):
+
+    topics = luigi.IntParameter(default=200)
+    toptopics = luigi.IntParameter(default=3)
+    passes = luigi.IntParameter(default=1)
+
+    def getParams(self):
+        self.additionalslices = "topic.mtx"
+        params = super(TopicEvaluation, self).getParams()
+        return params
+
+    def requires(self):
+        return [
+            CreateTensor(self.gatehome, self.jarfile,
+                         self.inputfolder, self.tensorfolder,
+                         self.connections, self.gateapp,
+                         self.stemming, self.content,
+                         self.java, self.python),
+            CreateTopicSlice(self.gatehome, self.jarfile,
+                             self.inputfolder, self.tensorfolder,
+                             self.connections, self.gateapp,
+                             self.stemming, self.content,
+                             self.java, self.python,
+                             self.topics, self.toptopics, self.passes)
+        ]
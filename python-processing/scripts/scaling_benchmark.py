@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+import logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s %(levelname)-8s %(message)s',
+                    datefmt='%a, %d %b %Y %H:%M:%S')
+_log = logging.getLogger()
+
+import os
+import sys
+import glob
+import json
+import time
+import shlex
+import codecs
+import shutil
+import argparse
+import subprocess
+
+import numpy as np
+from time import strftime
+from tools.synthetic_tensor import create_synthetic_tensor, write_tensor_folder
+
+# End-to-end scaling benchmark of the link prediction evaluation: for every scale (number of needs) a synthetic tensor
+# is created (see synthetic_tensor.py) and evaluate_link_prediction.py is executed once per algorithm on it. The wall
+# time, the peak RSS and the per stage wall times (from the eval_stages JSON file of the evaluation) of every run are
+# recorded in a state file in the work folder after each run, so an interrupted benchmark continues with the missing
+# runs when it is started again with the same work folder. From the recorded runs the empirical complexity exponent
+# of every stage is fitted (time ~ needs^exponent) and a report is written that flags the stages that scale
+# super-linearly.
+
+ALGORITHMS = [('rescal', ['-rescal', '10', '0.02', 'False', 'False', 'nvecs', '1e-4', '0', '0', '0']),
+              ('rescalsim', ['-rescalsim', '10', '0.6', 'False', 'True']),
+              ('cosine', ['-cosine', '0.5', '0.0']),
+              ('cosine_weighted', ['-cosine_weighted', '0.5', '0.0']),
+              ('cosine_rescal', ['-cosine_rescal', '10', '0.02', '0.5', 'False']),
+              ('intersection', ['-intersection', '10', '0.02', '0.5', 'False'])]
+
+STATE_FILE = "scaling_state.json"
+
+
+# read the state (the records of the finished runs) from the work folder
+def read_state(workfolder):
+    filename = workfolder + "/" + STATE_FILE
+    if not os.path.exists(filename):
+        return {'runs': {}}
+    file = codecs.open(filename, 'r', encoding='utf8')
+    state = json.load(file)
+    file.close()
+    return state
+
+# write the state to the work folder, the file is replaced at once so that an interruption never leaves a broken file
+def write_state(workfolder, state):
+    filename = workfolder + "/" + STATE_FILE
+    file = codecs.open(filename + ".tmp", 'w', encoding='utf8')
+    json.dump(state, file, indent=2, sort_keys=True)
+    file.close()
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(filename + ".tmp", filename)
+
+# create the synthetic tensor folder of a scale (if it does not exist yet) and return its path
+def tensor_folder(workfolder, scale, args):
+    folder = workfolder + "/tensors/needs%d" % scale
+    if not os.path.exists(folder + "/headers.txt"):
+        _log.info("Create synthetic tensor with %d needs: %s" % (scale, folder))
+        tensor = create_synthetic_tensor(scale, int(scale * args.attributeratio), seed=args.seed)
+        write_tensor_folder(tensor, folder + ".tmp")
+        os.rename(folder + ".tmp", folder)
+    return folder
+
+# execute a command, kill it if it runs longer than "timeout" seconds (if > 0) and return the exit code (None on
+# timeout), the wall time and the peak RSS of the process in MB (or None if it is not available)
+def run_process(command, logfile, timeout, memorylimit):
+    def limit_memory():
+        import resource
+        limit = memorylimit * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    log = open(logfile, 'w')
+    start = time.time()
+    process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT,
+                               preexec_fn=limit_memory if memorylimit > 0 else None)
+    peak_rss = None
+    returncode = None
+    while True:
+        # without timeout wait until the process exits, otherwise poll it
+        pid, status, usage = os.wait4(process.pid, os.WNOHANG if timeout > 0 else 0)
+        if pid != 0:
+            returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+            peak_rss = usage.ru_maxrss / (1024.0 * 1024.0) if sys.platform == 'darwin' else usage.ru_maxrss / 1024.0
+            break
+        if 0 < timeout < time.time() - start:
+            _log.warn("Kill evaluation after timeout of %ds" % timeout)
+            process.kill()
+            os.waitpid(process.pid, 0)
+            break
+        time.sleep(0.1)
+    process.returncode = returncode if returncode is not None else -1
+    log.close()
+    return returncode, time.time() - start, peak_rss
+
+# return the summed wall time of every stage of the eval_stages JSON file of an evaluation run, the stages of the
+# folds are prefixed with "fold.", and the peak RSS of the process over all stages
+def read_stage_times(runfolder):
+    files = glob.glob(runfolder + "/eval_stages_*.json")
+    if len(files) == 0:
+        return {}, None
+    file = codecs.open(sorted(files)[-1], 'r', encoding='utf8')
+    records = json.load(file)['stages']
+    file.close()
+    stages = {}
+    for record in records:
+        name = record['stage'] if record['fold'] is None else "fold." + record['stage']
+        stages[name] = stages.get(name, 0.0) + record['wall_time']
+    peaks = [record.get('process_peak_rss_mb', record['peak_rss_mb']) for record in records
+             if record.get('process_peak_rss_mb', record.get('peak_rss_mb')) is not None]
+    return stages, max(peaks) if len(peaks) > 0 else None
+
+# run the evaluation of an algorithm on the tensor of a scale and return the record of the run
+def run_evaluation(workfolder, scale, algorithm, flags, args):
+    runfolder = workfolder + "/runs/needs%d_%s" % (scale, algorithm)
+    if os.path.exists(runfolder):
+        shutil.rmtree(runfolder)
+    os.makedirs(runfolder)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "evaluate_link_prediction.py")
+    command = [args.python, script, '-inputfolder', tensor_folder(workfolder, scale, args),
+               '-outputfolder', runfolder, '-additional_slices', 'subject.mtx', 'content.mtx', 'category.mtx',
+               '-numneeds', str(scale), '-folds', str(args.folds), '-seed', str(args.seed)] + flags + \
+              shlex.split(args.evalargs)
+    _log.info("Run evaluation of %s with %d needs: %s" % (algorithm, scale, " ".join(command)))
+    returncode, wall_time, peak_rss = run_process(command, runfolder + "/evaluation.log", args.timeout,
+                                                  args.memorylimit)
+    stages, stages_peak_rss = read_stage_times(runfolder)
+    # the per stage peak RSS measurement resets the peak of the evaluation process on linux, which also lowers the
+    # peak reported by wait4(), the stage records hold the peak of the process before the resets
+    peaks = [peak for peak in [peak_rss, stages_peak_rss] if peak is not None]
+    record = {'scale': scale, 'algorithm': algorithm, 'returncode': returncode, 'wall_time': wall_time,
+              'peak_rss_mb': max(peaks) if len(peaks) > 0 else None, 'stages': stages,
+              'finished': strftime("%Y-%m-%d_%H%M%S")}
+    if returncode == 0:
+        _log.info("Evaluation of %s with %d needs took %fs, peak RSS %s MB" %
+                  (algorithm, scale, wall_time, record['peak_rss_mb']))
+    else:
+        _log.warn("Evaluation of %s with %d needs failed (exit code %s) after %fs, see %s/evaluation.log" %
+                  (algorithm, scale, returncode, wall_time, runfolder))
+    return record
+
+# fit the exponent b of values ~ a * scales^b with least squares in log-log space. Return None if there are less
+# than two scales with a value of at least "min_value".
+def fit_exponent(scales, values, min_value):
+    points = [(s, v) for s, v in zip(scales, values) if v is not None and v >= min_value]
+    if len(set(s for s, v in points)) < 2:
+        return None
+    x = np.log([float(s) for s, v in points])
+    y = np.log([float(v) for s, v in points])
+    return float(np.polyfit(x, y, 1)[0])
+
+# create the report of the recorded runs: for every algorithm the wall time, peak RSS and stage times per scale and
+# the fitted complexity exponents. Return the report as text lines and as dict.
+def create_report(state, args):
+    lines = []
+    report = {}
+    for algorithm, flags in ALGORITHMS:
+        runs = sorted([r for r in state['runs'].values() if r['algorithm'] == algorithm], key=lambda r: r['scale'])
+        if len(runs) == 0:
+            continue
+        finished = [r for r in runs if r['returncode'] == 0]
+        scales = [r['scale'] for r in finished]
+        series = [('wall_time', [r['wall_time'] for r in finished], args.mintime),
+                  ('peak_rss_mb', [r['peak_rss_mb'] for r in finished], 0.0)]
+        stage_names = sorted(set(name for r in finished for name in r['stages']))
+        series += [(name, [r['stages'].get(name) for r in finished], args.mintime) for name in stage_names]
+
+        lines.append("Algorithm: %s" % algorithm)
+        lines.append("  needs:         " + " ".join("%12d" % s for s in scales))
+        report[algorithm] = {'scales': scales, 'failed': [r['scale'] for r in runs if r['returncode'] != 0],
+                             'exponents': {}, 'superlinear': []}
+        for name, values, min_value in series:
+            exponent = fit_exponent(scales, values, min_value)
+            report[algorithm]['exponents'][name] = exponent
+            flag = ""
+            if exponent is not None and exponent > args.superlinear:
+                flag = "  SUPER-LINEAR"
+                report[algorithm]['superlinear'].append(name)
+            lines.append("  %-40s %s  exponent: %s%s" % (
+                name, " ".join("%12s" % ("-" if v is None else "%.3f" % v) for v in values),
+                "-" if exponent is None else "%.2f" % exponent, flag))
+        for r in runs:
+            if r['returncode'] != 0:
+                lines.append("  FAILED with %d needs (exit code %s) after %.1fs" %
+                             (r['scale'], r['returncode'], r['wall_time']))
+        lines.append("")
+    return lines, report
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='end-to-end scaling benchmark of the link prediction evaluation on '
+                                                 'synthetic tensors')
+    parser.add_argument('-workfolder', action="store", dest="workfolder", required=True,
+                        help="folder for the tensors, the evaluation outputs, the state and the report, start the "
+                             "benchmark again with the same folder to continue it")
+    parser.add_argument('-scales', action="store", dest="scales", type=int, nargs="+",
+                        default=[1000, 2000, 5000, 10000, 20000, 50000, 100000],
+                        help="numbers of needs of the synthetic tensors")
+    parser.add_argument('-algorithms', action="store", dest="algorithms", nargs="+",
+                        default=[name for name, flags in ALGORITHMS], choices=[name for name, flags in ALGORITHMS],
+                        help="algorithms to evaluate")
+    parser.add_argument('-attributeratio', action="store", dest="attributeratio", type=float, default=0.5,
+                        help="number of attributes per need of the synthetic tensors")
+    parser.add_argument('-folds', action="store", dest="folds", type=int, default=3,
+                        help="number of cross validation folds of the evaluations")
+    parser.add_argument('-seed', action="store", dest="seed", type=int, default=1,
+                        help="seed of the synthetic tensors and the evaluations")
+    parser.add_argument('-evalargs', action="store", dest="evalargs", default="",
+                        help="additional arguments of the evaluations (e.g. \"-statistics -statsformat npz\")")
+    parser.add_argument('-python', action="store", dest="python", default=sys.executable,
+                        help="python interpreter to execute the evaluations with")
+    parser.add_argument('-timeout', action="store", dest="timeout", type=int, default=0,
+                        help="kill an evaluation after this number of seconds (0 for no timeout)")
+    parser.add_argument('-memorylimit', action="store", dest="memorylimit", type=int, default=0,
+                        help="limit the address space of an evaluation to this number of MB (0 for no limit)")
+    parser.add_argument('-retryfailed', action="store_true", dest="retryfailed",
+                        help="run the failed evaluations of a previous start again")
+    parser.add_argument('-reportonly', action="store_true", dest="reportonly",
+                        help="only write the report of the recorded runs")
+    parser.add_argument('-superlinear', action="store", dest="superlinear", type=float, default=1.15,
+                        help="flag stages with a fitted complexity exponent above this value")
+    parser.add_argument('-mintime', action="store", dest="mintime", type=float, default=0.05,
+                        help="ignore stage times below this number of seconds when fitting the exponents")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.workfolder):
+        os.makedirs(args.workfolder)
+    state = read_state(args.workfolder)
+
+    if not args.reportonly:
+        for algorithm, flags in ALGORITHMS:
+            if algorithm not in args.algorithms:
+                continue
+            for scale in sorted(args.scales):
+                key = "needs%d_%s" % (scale, algorithm)
+                record = state['runs'].get(key)
+                if record is not None and (record['returncode'] == 0 or not args.retryfailed):
+                    _log.info("Skip evaluation of %s with %d needs, it was already run" % (algorithm, scale))
+                    if record['returncode'] != 0:
+                        break
+                    continue
+                record = run_evaluation(args.workfolder, scale, algorithm, flags, args)
+                state['runs'][key] = record
+                write_state(args.workfolder, state)
+                # larger tensors of a failed algorithm are not evaluated
+                if record['returncode'] != 0:
+                    break
+
+    lines, report = create_report(state, args)
+    for line in lines:
+        _log.info(line)
+    file = codecs.open(args.workfolder + "/scaling_report.txt", 'w', encoding='utf8')
+    file.write("\n".join(lines) + "\n")
+    file.close()
+    file = codecs.open(args.workfolder + "/scaling_report.json", 'w', encoding='utf8')
+    json.dump(report, file, indent=2, sort_keys=True)
+    file.close()
+    _log.info("Write scaling report: " + args.workfolder + "/scaling_report.txt")
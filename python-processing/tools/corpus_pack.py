@@ -0,0 +1,221 @@
+import os
+import json
+import mmap
+import codecs
+import shutil
+from collections import OrderedDict
+
+import numpy as np
+
+from tools.mails import mail_preprocessor
+
+
+def _index_filename(filename):
+    return filename + '.index'
+
+
+class CorpusPack:
+    """
+    Read-only corpus of preprocessed documents packed into a single file.
+    The UTF-8 encoded texts are concatenated in the pack file, the index
+    file next to it holds the document ids and the offsets of the texts.
+    The pack file is memory mapped, so loading a corpus does not open or
+    read every document and only the accessed texts are paged in.
+    """
+
+    VERSION = 1
+
+    def __init__(self, filename):
+        """
+        :param filename: Pack file created by build_corpus_pack(), the index
+        is read from "<filename>.index".
+        """
+        with codecs.open(_index_filename(filename), 'r', encoding='utf8') as f:
+            index = json.load(f)
+        if index.get('version') != self.VERSION:
+            raise ValueError('Unsupported corpus pack version %s: %s' %
+                             (index.get('version'), filename))
+        self.filename = filename
+        self.ids = index['ids']
+        self.offsets = np.array(index['offsets'], dtype=np.int64)
+        self.sources = index['sources']
+        self._file = open(filename, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size != self.offsets[-1]:
+            self._file.close()
+            raise ValueError('Corpus pack does not match its index: %s' %
+                             filename)
+        # an empty file can not be memory mapped
+        self._data = None
+        self._bytes = np.zeros(0, dtype=np.uint8)
+        if size > 0:
+            self._data = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+            self._bytes = np.frombuffer(self._data, dtype=np.uint8)
+        self._positions = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def raw(self, i):
+        """
+        Return the encoded text of document i as uint8 array, a view of the
+        memory mapped pack file (no copy).
+        """
+        return self._bytes[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, i):
+        """
+        Return the text of document i (or a list of the texts of a slice).
+        """
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self.raw(i).tobytes().decode('utf8')
+
+    def __iter__(self):
+        for i in range(len(self.ids)):
+            yield self[i]
+
+    def position(self, document_id):
+        """
+        Return the position of a document in the pack by its id.
+        """
+        if self._positions is None:
+            self._positions = dict((document_id, i)
+                                   for i, document_id in enumerate(self.ids))
+        return self._positions[document_id]
+
+    def close(self):
+        # the arrays of the mapped data have to be released before the map
+        self._bytes = None
+        if self._data is not None:
+            try:
+                self._data.close()
+            except BufferError:
+                # arrays returned by raw() are still in use, the file is
+                # unmapped when they are released
+                pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_mail(filename, encoding='utf-8', decode_error='replace'):
+    """
+    Read a mail file and preprocess it like the keyword extraction does
+    (decode, convert to lower case and keep the subject and content).
+    """
+    with open(filename, 'rb') as f:
+        doc = f.read().decode(encoding, decode_error)
+    return mail_preprocessor(doc.lower())
+
+
+def _write_index(filename, ids, offsets, sources):
+    temp_filename = _index_filename(filename) + '.tmp'
+    with codecs.open(temp_filename, 'w', encoding='utf8') as f:
+        json.dump({'version': CorpusPack.VERSION, 'ids': ids,
+                   'offsets': [int(offset) for offset in offsets],
+                   'sources': sources}, f)
+    shutil.move(temp_filename, _index_filename(filename))
+
+
+def _open_pack(filename):
+    # return the existing pack or None if there is none (or it can not be
+    # used, e.g. of another version or not matching its index)
+    if not os.path.exists(filename) or \
+            not os.path.exists(_index_filename(filename)):
+        return None
+    try:
+        return CorpusPack(filename)
+    except ValueError:
+        return None
+
+
+def build_corpus_pack(folder, filename, read=read_mail, extension='.eml'):
+    """
+    Create or update a corpus pack from the documents of a folder. The
+    documents are identified by their file name without extension, only the
+    documents that are new or whose size or modification time changed are
+    read. If documents were only added they are appended to the pack,
+    otherwise a new pack is written with the texts of the unchanged
+    documents copied from the old one.
+
+    :param folder: Folder with the documents.
+    :param filename: Pack file, the index is written to "<filename>.index".
+    :param read: Function that returns the (preprocessed) text of a document
+    file.
+    :param extension: Extension of the document files.
+    :return: Dict with the numbers of added, updated, removed and unchanged
+    documents.
+    """
+    sources = OrderedDict()
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if name.endswith(extension) and os.path.isfile(path):
+            stat = os.stat(path)
+            sources[name[:-len(extension)]] = [stat.st_size, stat.st_mtime]
+
+    old = _open_pack(filename)
+    try:
+        old_ids = old.ids if old is not None else []
+        old_sources = old.sources if old is not None else []
+        unchanged = set(document_id for document_id, source
+                        in zip(old_ids, old_sources)
+                        if sources.get(document_id) == source)
+        new_ids = [document_id for document_id in sources
+                   if document_id not in unchanged]
+        statistics = {
+            'unchanged': len(unchanged),
+            'updated': sum(1 for document_id in old_ids
+                           if document_id in sources and
+                           document_id not in unchanged),
+            'removed': sum(1 for document_id in old_ids
+                           if document_id not in sources)}
+        statistics['added'] = len(new_ids) - statistics['updated']
+
+        if old is not None and len(unchanged) == len(old_ids):
+            # documents were only added, append them to the pack
+            target = filename
+            ids, offsets = list(old_ids), [int(o) for o in old.offsets]
+            pack_sources = list(old_sources)
+            old.close()
+            old = None
+        else:
+            # copy the unchanged documents to a new pack
+            target = filename + '.tmp'
+            ids, offsets, pack_sources = [], [0], []
+            with open(target, 'wb') as out:
+                for i, document_id in enumerate(old_ids):
+                    if document_id in unchanged:
+                        out.write(old.raw(i).tobytes())
+                        ids.append(document_id)
+                        offsets.append(offsets[-1] + int(
+                            old.offsets[i + 1] - old.offsets[i]))
+                        pack_sources.append(old_sources[i])
+
+        with open(target, 'ab') as out:
+            for document_id in new_ids:
+                data = read(os.path.join(folder, document_id + extension))
+                data = data.encode('utf8')
+                out.write(data)
+                ids.append(document_id)
+                offsets.append(offsets[-1] + len(data))
+                pack_sources.append(sources[document_id])
+        _write_index(target, ids, offsets, pack_sources)
+
+        if target != filename:
+            if old is not None:
+                old.close()
+                old = None
+            # a crash between the moves leaves a pack that does not match
+            # its index, which is rebuilt by the next build
+            shutil.move(target, filename)
+            shutil.move(_index_filename(target), _index_filename(filename))
+        return statistics
+    finally:
+        if old is not None:
+            old.close()
@@ -3,15 +3,17 @@ __author__ = 'bivanschitz'
 
 from math import log10
 
-from scipy.spatial.distance import cosine
+import numpy as np
 from scipy.sparse import csr_matrix
-from tools.tensor_utils import SparseTensor
+from tools.tensor_utils import SparseTensor, TensorStatistics
+from tools.pair_index import PairIndex
 
 
 #FUNCTIONS
 
 #get the most commen elements using the cosinus distance (alternative distance measure available)
 def most_common_elements(needindex ,mat, newelement):
+    from scipy.spatial.distance import cosine
     most_common = {}
     for item in needindex:
          if (mat[item].sum() > 0.0 and mat[newelement].sum() > 0.0):
@@ -110,4 +112,43 @@ def cosinus_link_prediciton(tensor, new_elements, threshold, transitive_threshol
         candidates = get_candidates(most_common_elements_weighted, threshold)
         newconnectionmat = add_transitv_connections(candidates, connectionmat, new_element, checkset, transitive_threshold)
 
-    return csr_matrix(newconnectionmat)
\ No newline at end of file
+    return csr_matrix(newconnectionmat)
+
+
+# compute the cosine distances between the attributes of the needs of the pairs of a PairIndex (the values that
+# cosinus_link_prediciton() compares with its threshold, without transitive predictions and term weighting). Pairs
+# that can never be predicted by the algorithm get the distance NaN: pairs of needs without attributes and pairs whose
+# need is not of the type that is predicted for the need they start from. Pairs that are already connected in the
+# tensor are always predicted and get the distance -inf. A connection for a pair is predicted if its distance is
+# lower than the threshold, so the distances can be used to evaluate many thresholds at once.
+def cosine_distance_array(tensor, indices):
+
+    # same attributes as in cosinus_link_prediciton(), normalized to unit length
+    attributemat = csr_matrix(tensor.getSliceMatrix(SparseTensor.ATTR_SUBJECT_SLICE) +
+                              tensor.getSliceMatrix(SparseTensor.CATEGORY_SLICE), dtype=float)
+    norms = np.sqrt(np.asarray(attributemat.multiply(attributemat).sum(axis=1)).ravel())
+    inv_norms = np.zeros(len(norms))
+    inv_norms[norms > 0] = 1.0 / norms[norms > 0]
+    normalized = csr_matrix(attributemat.multiply(inv_norms[:, np.newaxis]))
+    connectionmat = tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE)
+    needType = tensor.getStatistics().needType
+
+    def distance_block(block):
+        from_needs, to_needs = block.toArrays()
+        if block.product:
+            similarity = (normalized[block.rows] * normalized[block.cols].T).toarray().ravel()
+        else:
+            similarity = np.asarray(normalized[from_needs].multiply(normalized[to_needs]).sum(axis=1)).ravel()
+        distance = 1.0 - similarity
+
+        # OFFERS are checked against WANTS, all other needs against OFFERS
+        checkType = np.where(needType[from_needs] == TensorStatistics.OFFER, TensorStatistics.WANT,
+                             TensorStatistics.OFFER)
+        candidates = (norms[from_needs] > 0) & (norms[to_needs] > 0) & (needType[to_needs] == checkType)
+        distance[~candidates] = np.nan
+        distance[block.getArrayFromMatrix(connectionmat) != 0] = -np.inf
+        return distance
+
+    if not isinstance(indices, PairIndex):
+        indices = PairIndex.fromPairs(indices[0], indices[1])
+    return indices.mapBlocks(distance_block)
@@ -1,41 +1,61 @@
 from os import listdir
 from os.path import join, isfile
 
-from nltk import WordNetLemmatizer
 import numpy as np
-from sklearn.datasets import fetch_20newsgroups
 
 from tools.feature_extraction import ScikitNltkTokenizerAdapter, \
     default_pos_tagger
 from tools.mails import mail_preprocessor
+from tools.corpus_pack import CorpusPack
+
+
+# nltk and scikit-learn are imported by the dataset functions, so that
+# importing this module stays fast
+def _lemmatizer():
+    from nltk import WordNetLemmatizer
+    return WordNetLemmatizer()
 
 
 def dataset_newsgroups(categories=None):
+    from sklearn.datasets import fetch_20newsgroups
     random = np.random.RandomState()
     data = fetch_20newsgroups(
         categories=categories, subset='train', shuffle=True,
         random_state=random, remove=('headers', 'footers', 'quotes'))
     # pos_tagger=default_pos_tagger
     tokenize = ScikitNltkTokenizerAdapter(
-        lemmatizer=WordNetLemmatizer(), pos_tagger=default_pos_tagger)
+        lemmatizer=_lemmatizer(), pos_tagger=default_pos_tagger)
     return data.data, 'content', tokenize
 
 
 def dataset_mails(path):
+    if isfile(path):
+        return dataset_corpus_pack(path)
     filenames = [join(path, f) for f in listdir(path) if
                  isfile(join(path, f)) and f.endswith('.eml')]
     filenames = np.array(filenames)
     np.random.shuffle(filenames)
     tokenize = ScikitNltkTokenizerAdapter(preprocessor=mail_preprocessor,
-                                          lemmatizer=WordNetLemmatizer(),
+                                          lemmatizer=_lemmatizer(),
                                           pos_tagger=default_pos_tagger)
     return filenames, 'filename', tokenize
 
 
+def dataset_corpus_pack(filename):
+    """
+    Load the mails of a corpus pack (see build_corpus_pack()). The documents
+    are the CorpusPack itself, its texts are already preprocessed.
+    """
+    pack = CorpusPack(filename)
+    tokenize = ScikitNltkTokenizerAdapter(lemmatizer=_lemmatizer(),
+                                          pos_tagger=default_pos_tagger)
+    return pack, 'content', tokenize
+
+
 def dataset_small():
     content = ["This is the first sentence. Here is another sentence! And here's a third sentence.",
                "This is the second paragraph.",
                "Tokenization is currently fairly simple, so the period in Mr. gets tokenized."]
     np.random.shuffle(content)
     return content, 'content', ScikitNltkTokenizerAdapter(
-        lemmatizer=WordNetLemmatizer(), pos_tagger=default_pos_tagger)
\ No newline at end of file
+        lemmatizer=_lemmatizer(), pos_tagger=default_pos_tagger)
\ No newline at end of file
@@ -1,7 +1,11 @@
 __author__ = 'hfriedrich'
 
+import os
+import codecs
 import numpy as np
-from tensor_utils import matrix_to_array
+from collections import OrderedDict
+from tools.tensor_utils import matrix_to_array
+from tools.pair_index import PairIndex, DEFAULT_BLOCK_SIZE
 
 # class to store statistical detail data for a need, data like number true positives, true negatives,
 # false positives, false negatives can be used to calculate precision, recall, accuracy, fscore.
@@ -21,31 +25,52 @@ class NeedEvaluationDetails:
         self.TP_thresholds = []
         self.FN_thresholds = []
         self.FP_thresholds = []
+        self.rankingNames = []
+        self.ranking = dict()
+
+    # add the value of a ranking metric (e.g. "P@10") of the need, values of several folds are averaged
+    def addRankingData(self, name, value):
+        if name not in self.ranking:
+            self.rankingNames.append(name)
+            self.ranking[name] = []
+        self.ranking[name].append(value)
+
+    def getRankingMetric(self, name):
+        return float(np.mean(self.ranking[name]))
 
     def addClassificationData(self, y_true, y_pred, toNeeds=None, thresholds=None):
-        for i in range(len(y_true)):
-            if y_true[i] == y_pred[i]:
-                if y_true[i] == 1.0:
-                    self.TP += 1
-                    if toNeeds != None:
-                        self.TP_toNeeds.append(toNeeds[i])
-                        if thresholds != None:
-                            self.TP_thresholds.append(thresholds[i])
-                else:
-                    self.TN += 1
-            else:
-                if y_true[i] == 1.0:
-                    self.FN += 1
-                    if toNeeds != None:
-                        self.FN_toNeeds.append(toNeeds[i])
-                        if thresholds != None:
-                            self.FN_thresholds.append(thresholds[i])
-                else:
-                    self.FP += 1
-                    if toNeeds != None:
-                        self.FP_toNeeds.append(toNeeds[i])
-                        if thresholds != None:
-                            self.FP_thresholds.append(thresholds[i])
+        positive = np.asarray(y_true).ravel() == 1.0
+        correct = np.asarray(y_true).ravel() == np.asarray(y_pred).ravel()
+        self.TP += int(np.count_nonzero(positive & correct))
+        self.TN += int(np.count_nonzero(~positive & correct))
+        self.FN += int(np.count_nonzero(positive & ~correct))
+        self.FP += int(np.count_nonzero(~positive & ~correct))
+        if toNeeds is not None:
+            toNeeds = np.asarray(toNeeds).ravel()
+            self.TP_toNeeds.extend(toNeeds[positive & correct].tolist())
+            self.FN_toNeeds.extend(toNeeds[positive & ~correct].tolist())
+            self.FP_toNeeds.extend(toNeeds[~positive & ~correct].tolist())
+            if thresholds is not None:
+                thresholds = np.asarray(thresholds).ravel()
+                self.TP_thresholds.extend(thresholds[positive & correct].tolist())
+                self.FN_thresholds.extend(thresholds[positive & ~correct].tolist())
+                self.FP_thresholds.extend(thresholds[~positive & ~correct].tolist())
+
+    # add the classification data of another details object of the same need (e.g. from another fold)
+    def merge(self, other):
+        self.TP += other.TP
+        self.TN += other.TN
+        self.FP += other.FP
+        self.FN += other.FN
+        self.TP_toNeeds.extend(other.TP_toNeeds)
+        self.FN_toNeeds.extend(other.FN_toNeeds)
+        self.FP_toNeeds.extend(other.FP_toNeeds)
+        self.TP_thresholds.extend(other.TP_thresholds)
+        self.FN_thresholds.extend(other.FN_thresholds)
+        self.FP_thresholds.extend(other.FP_thresholds)
+        for name in other.rankingNames:
+            for value in other.ranking[name]:
+                self.addRankingData(name, value)
 
     def getPrecision(self):
         sum = self.TP + self.FP
@@ -66,36 +91,578 @@ class NeedEvaluationDetails:
             f_score = (1 + f_beta * f_beta) * (self.getPrecision() * self.getRecall()) / div
         return f_score
 
-# this class is basically a dictionary of statistical need detail data for each need. Use this to store all data per
-# need for the whole evaluation
+# statistical need detail data for all needs of the whole evaluation. The data is stored in columns: the TP/TN/FP/FN
+# counts of every need are kept in an array indexed by the need (computed with np.bincount) and the pairs that are not
+# true negatives are kept as arrays of (from need, to need, truth, prediction, score). The NeedEvaluationDetails
+# objects of the needs (with their lists of TP/FN/FP needs) are only created by getNeedDetails(), e.g. when the
+# statistics are written.
 class NeedEvaluationDetailDict:
 
+    # column indices of the counts
+    TP, TN, FP, FN = range(4)
+
     def __init__(self):
-        self.dict = dict()
+        self.counts = np.zeros((0, 4), dtype=np.int64)
+        self.evaluated = np.zeros(0, dtype=bool)
+        self.columns = []
+        self.rankingNames = []
+        self.ranking = []
+        self.details = None
+
+    # resize the per need arrays so that they can be indexed by all needs up to "size" - 1
+    def _grow(self, size):
+        if size > len(self.evaluated):
+            counts = np.zeros((size, 4), dtype=np.int64)
+            counts[:len(self.counts)] = self.counts
+            evaluated = np.zeros(size, dtype=bool)
+            evaluated[:len(self.evaluated)] = self.evaluated
+            self.counts = counts
+            self.evaluated = evaluated
+
+    # return the needs with statistic or ranking details
+    def getNeeds(self):
+        needs = np.flatnonzero(self.evaluated)
+        for name_needs, _ in self.ranking:
+            needs = np.union1d(needs, name_needs)
+        return needs
+
+    # return the TP/TN/FP/FN counts of a need
+    def getCounts(self, need):
+        if need < len(self.counts):
+            return self.counts[need]
+        return np.zeros(4, dtype=np.int64)
 
+    # return a NeedEvaluationDetails object of a need that only holds the counts (without the lists of TP/FN/FP needs
+    # and the ranking metrics), it is created without building the details of all needs
+    def getCountDetails(self, need):
+        needDetails = NeedEvaluationDetails(need)
+        needDetails.TP, needDetails.TN, needDetails.FP, needDetails.FN = [int(count) for count in self.getCounts(need)]
+        return needDetails
+
+    # return the "num" evaluated needs with connections (TP + FN > 0) with the lowest f-score (lowest first), computed
+    # from the counts of all needs at once like NeedEvaluationDetails.getFScore()
+    def getWorstFScoreNeeds(self, num, f_beta):
+        needs = np.flatnonzero(self.evaluated & (self.counts[:, self.TP] + self.counts[:, self.FN] > 0))
+        TP, TN, FP, FN = [self.counts[needs, i].astype(float) for i in range(4)]
+        precision = np.where(TP + FP > 0, TP / np.maximum(TP + FP, 1), 1.0)
+        recall = np.where(TP + FN > 0, TP / np.maximum(TP + FN, 1), 1.0)
+        div = f_beta * f_beta * precision + recall
+        f_score = np.where(div != 0, (1 + f_beta * f_beta) * precision * recall / np.where(div != 0, div, 1), 0.0)
+        return needs[np.argsort(f_score, kind='mergesort')[:num]]
+
+    # return a dict of NeedEvaluationDetails objects for all needs with details, it is created on first access after
+    # the details changed
+    def getNeedDetails(self):
+        if self.details is not None:
+            return self.details
+        details = dict()
+        for need in self.getNeeds().tolist():
+            details[need] = self.getCountDetails(need)
+
+        # the lists of TP/FN/FP needs of each need
+        if len(self.columns) > 0:
+            from_needs, to_needs, truth, pred, scores = [np.concatenate(column) for column in zip(*self.columns)]
+            order = np.argsort(from_needs, kind='mergesort')
+            from_needs = from_needs[order]
+            bounds = np.concatenate(([0], np.flatnonzero(np.diff(from_needs)) + 1, [len(from_needs)]))
+            for from_idx, to_idx in zip(bounds[:-1], bounds[1:]):
+                group = order[from_idx:to_idx]
+                needDetails = details[int(from_needs[from_idx])]
+                for toNeeds, thresholds, selected in [
+                    (needDetails.TP_toNeeds, needDetails.TP_thresholds, truth[group] & pred[group]),
+                    (needDetails.FN_toNeeds, needDetails.FN_thresholds, truth[group] & ~pred[group]),
+                    (needDetails.FP_toNeeds, needDetails.FP_thresholds, ~truth[group] & pred[group])]:
+                    toNeeds.extend(to_needs[group][selected].tolist())
+                    thresholds.extend(scores[group][selected].tolist())
+
+        # the ranking metrics of the needs averaged over all folds
+        for name in self.rankingNames:
+            chunks = [(needs, metrics[name]) for needs, metrics in self.ranking if name in metrics]
+            needs = np.concatenate([needs for needs, _ in chunks]).astype(int)
+            values = np.concatenate([values for _, values in chunks])
+            sums = np.bincount(needs, weights=values)
+            numbers = np.bincount(needs)
+            for need in np.unique(needs).tolist():
+                details[need].addRankingData(name, sums[need] / numbers[need])
+        self.details = details
+        return details
+
+    # return the details of a need (with all counts zero if the need was not evaluated)
     def retrieveNeedDetails(self, need):
-        if (need not in self.dict):
-            self.dict[need] = NeedEvaluationDetails(need)
-        return self.dict[need]
+        details = self.getNeedDetails()
+        if need in details:
+            return details[need]
+        return NeedEvaluationDetails(need)
+
+    # add the need details of another dictionary (e.g. from another fold)
+    def merge(self, other):
+        self._grow(len(other.evaluated))
+        self.counts[:len(other.counts)] += other.counts
+        self.evaluated[:len(other.evaluated)] |= other.evaluated
+        self.columns.extend(other.columns)
+        for name in other.rankingNames:
+            if name not in self.rankingNames:
+                self.rankingNames.append(name)
+        self.ranking.extend(other.ranking)
+        self.details = None
+
+    # save all details in one numpy .npz file: the needs with their TP/TN/FP/FN counts and ranking metrics, the
+    # TP/FN/FP pairs with their scores and (for the extraction of the text files) the tensor headers, the f-beta value
+    # of the summary and whether the scores are printed. Use load() and output_statistic_details() to write the text
+    # files of the needs on demand.
+    def save(self, filename, headers, f_beta, printThresholds=False):
+        needs = self.getNeeds().astype(np.int32)
+        size = int(needs.max()) + 1 if len(needs) > 0 else 0
+        self._grow(size)
+        counts = self.counts[needs]
+        evaluated = self.evaluated[needs]
+
+        # the ranking metrics of the needs averaged over all folds (like getNeedDetails()), NaN if a need has none
+        ranking = np.full((len(needs), len(self.rankingNames)), np.nan)
+        for j, name in enumerate(self.rankingNames):
+            chunks = [(name_needs, metrics[name]) for name_needs, metrics in self.ranking if name in metrics]
+            name_needs = np.concatenate([chunk_needs for chunk_needs, _ in chunks]).astype(int)
+            values = np.concatenate([chunk_values for _, chunk_values in chunks])
+            sums = np.bincount(name_needs, weights=values, minlength=size)[needs]
+            numbers = np.bincount(name_needs, minlength=size)[needs]
+            ranked = numbers > 0
+            ranking[ranked, j] = sums[ranked] / numbers[ranked]
+        if len(self.columns) > 0:
+            from_needs, to_needs, truth, pred, scores = [np.concatenate(column) for column in zip(*self.columns)]
+        else:
+            from_needs, to_needs = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+            truth, pred, scores = np.zeros(0, dtype=bool), np.zeros(0, dtype=bool), np.zeros(0)
+        np.savez(filename, needs=needs, counts=counts, evaluated=evaluated,
+                 ranking_names=np.array(self.rankingNames, dtype=np.unicode_), ranking=ranking,
+                 from_needs=from_needs, to_needs=to_needs, truth=truth, pred=pred, scores=scores,
+                 headers=np.array(headers, dtype=np.unicode_), f_beta=f_beta, print_thresholds=printThresholds)
+
+    # load details saved with save(). Returns the details dict, the headers, the f-beta value and whether the scores
+    # are printed
+    @staticmethod
+    def load(filename):
+        data = np.load(filename)
+        detailDict = NeedEvaluationDetailDict()
+        needs = data['needs']
+        if len(needs) > 0:
+            detailDict._grow(int(needs.max()) + 1)
+            detailDict.counts[needs] = data['counts']
+            detailDict.evaluated[needs] = data['evaluated']
+        detailDict.columns.append((data['from_needs'], data['to_needs'], data['truth'], data['pred'], data['scores']))
+        ranking = data['ranking']
+        for j, name in enumerate(data['ranking_names'].tolist()):
+            ranked = ~np.isnan(ranking[:, j])
+            detailDict.add_ranking_details(needs[ranked], OrderedDict([(name, ranking[ranked, j])]))
+        return detailDict, data['headers'].tolist(), float(data['f_beta']), bool(data['print_thresholds'])
+
+    # add the ranking metrics of the needs (as returned by ranking_metrics())
+    def add_ranking_details(self, needs, metrics):
+        for name in metrics.keys():
+            if name not in self.rankingNames:
+                self.rankingNames.append(name)
+        self.ranking.append((np.asarray(needs, dtype=int), metrics))
+        self.details = None
 
     def add_statistic_details(self, con_slice_true, con_slice_pred, idx_test, thresholds=None):
-        sorted_idx = np.argsort(idx_test[0])
-        i1 = [idx_test[0][i] for i in sorted_idx]
-        i2 = [idx_test[1][i] for i in sorted_idx]
-        if thresholds != None:
-            sorted_thresholds = [thresholds[i] for i in sorted_idx]
-        idx_test = (i1, i2)
-
-        from_idx = 0
-        while from_idx < len(idx_test[0]):
-            need_from = idx_test[0][from_idx]
-            to_idx = np.searchsorted(idx_test[0][from_idx:], need_from, side='right') + from_idx
-            needDetails = self.retrieveNeedDetails(need_from)
-            idx_temp = (idx_test[0][from_idx:to_idx], idx_test[1][from_idx:to_idx])
-            th = None
-            if thresholds != None:
-                th = sorted_thresholds[from_idx:to_idx]
-            needDetails.addClassificationData(matrix_to_array(con_slice_true, idx_temp),
-                                              matrix_to_array(con_slice_pred, idx_temp), idx_temp[1], th)
-            from_idx = to_idx
+        y_true = matrix_to_array(con_slice_true, idx_test)
+        y_pred = matrix_to_array(con_slice_pred, idx_test)
+        self.add_statistic_details_array(y_true, y_pred, idx_test, thresholds)
+
+    # same as add_statistic_details() for the true and predicted values that are already taken from the indices
+    def add_statistic_details_array(self, y_true, y_pred, idx_test, thresholds=None):
+        if isinstance(idx_test, PairIndex):
+            from_needs, to_needs = idx_test.toArrays()
+        else:
+            from_needs, to_needs = np.asarray(idx_test[0]), np.asarray(idx_test[1])
+        if len(from_needs) == 0:
+            return
+
+        # a pair is predicted as connection if the prediction differs from a false or equals a true value
+        truth = np.asarray(y_true).ravel() == 1.0
+        pred = truth == (np.asarray(y_true).ravel() == np.asarray(y_pred).ravel())
+        category = np.where(truth, np.where(pred, self.TP, self.FN), np.where(pred, self.FP, self.TN))
+        self._grow(int(from_needs.max()) + 1)
+        self.counts += np.bincount(from_needs.astype(np.int64) * 4 + category,
+                                   minlength=self.counts.size).reshape(-1, 4)
+        self.evaluated[from_needs] = True
+
+        # only the pairs that are not true negatives are needed for the detail lists
+        detail = category != self.TN
+        scores = np.full(len(truth), np.nan) if thresholds is None else np.asarray(thresholds, dtype=float).ravel()
+        self.columns.append((from_needs[detail].astype(np.int32), to_needs[detail].astype(np.int32), truth[detail],
+                             pred[detail], scores[detail]))
+        self.details = None
+
+
+# helper function
+def create_file_from_sorted_list(dir, filename, list):
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+    file = codecs.open(dir + "/" + filename,'w+',encoding='utf8')
+    list.sort()
+    for entry in list:
+        file.write(entry + "\n")
+    file.close()
+
+
+# in a specified folder create files which represent tested needs. For each of these files print the
+# binary classifiers: TP, FP, FN including the (connected/not connected) need names for manual detailed analysis of
+# the classification algorithm. Optionally only write the files of the needs "needs" and/or only the need files or
+# the summary file.
+def output_statistic_details(outputpath, headers, needEvaluationDetailDict, f_beta, printThresholds=False, needs=None,
+                             writeNeedFiles=True, writeSummary=True):
+
+    if not os.path.exists(outputpath):
+        os.makedirs(outputpath)
+    if writeSummary:
+        summary_file = codecs.open(outputpath + "/_summary.txt",'a+',encoding='utf8')
+
+    needDetailsDict = needEvaluationDetailDict.getNeedDetails()
+    if needs is None:
+        needs = sorted(needDetailsDict.keys())
+    for need in needs:
+        # write need details file
+        needEval = needEvaluationDetailDict.retrieveNeedDetails(need)
+        if writeNeedFiles:
+            if printThresholds:
+                needDetails = [ "TP (%f): " % needEval.TP_thresholds[i] + headers[needEval.TP_toNeeds[i]][6:]
+                                for i in range(len(needEval.TP_toNeeds))]
+                needDetails += [ "FN (%f): " % needEval.FN_thresholds[i] + headers[needEval.FN_toNeeds[i]][6:]
+                                 for i in range(len(needEval.FN_toNeeds))]
+                needDetails += [ "FP (%f): " % needEval.FP_thresholds[i] + headers[needEval.FP_toNeeds[i]][6:]
+                                 for i in range(len(needEval.FP_toNeeds))]
+            else:
+                needDetails = [ "TP: " + headers[toNeed][6:] for toNeed in needEval.TP_toNeeds]
+                needDetails += [ "FN: " + headers[toNeed][6:] for toNeed in needEval.FN_toNeeds]
+                needDetails += [ "FP: " + headers[toNeed][6:] for toNeed in needEval.FP_toNeeds]
+
+            create_file_from_sorted_list(outputpath, headers[need][6:] + ".txt", needDetails)
+
+        # write the summary file
+        if writeSummary:
+            summary_file.write(headers[need][6:])
+            summary_file.write(": TP: " + str(needEval.TP))
+            summary_file.write(": TN: " + str(needEval.TN))
+            summary_file.write(": FP: " + str(needEval.FP))
+            summary_file.write(": FN: " + str(needEval.FN))
+            summary_file.write(": Precision: " + str(needEval.getPrecision()))
+            summary_file.write(": Recall: " + str(needEval.getRecall()))
+            summary_file.write(": f%f-score : " % f_beta + str(needEval.getFScore(f_beta)))
+            summary_file.write(": Accuracy: " + str(needEval.getAccuracy()))
+            for name in needEval.rankingNames:
+                summary_file.write(": " + name + ": " + str(needEval.getRankingMetric(name)))
+            summary_file.write("\n")
+    if writeSummary:
+        summary_file.close()
+
+
+# compute ranking metrics of the pairs of every need they start from (the need's list of candidates ordered by the
+# score): for every k of "ks" the precision@k, recall@k and NDCG@k of the k pairs with the highest scores and the
+# average precision (AP, averaged over all needs this is the MAP) of the whole ranking. Only the top k pairs of each
+# need are selected with np.argpartition, no ranking is sorted completely. Pairs with the score NaN or -inf (e.g. pairs
+# that can never be predicted) are not ranked. Returns an array of the needs with at least one connection among their
+# pairs and an (ordered) dict with an array of the values of each metric for these needs.
+def ranking_metrics(y_true, scores, idx_test, ks, block_size=DEFAULT_BLOCK_SIZE):
+    y_true = np.asarray(y_true).ravel() == 1
+    scores = np.asarray(scores, dtype=float).ravel()
+    if isinstance(idx_test, PairIndex):
+        from_needs = idx_test.toArrays()[0]
+    else:
+        from_needs = np.asarray(idx_test[0])
+    names = ['P@%d' % k for k in ks] + ['R@%d' % k for k in ks] + ['NDCG@%d' % k for k in ks] + ['AP']
+    metrics = OrderedDict((name, []) for name in names)
+    if len(from_needs) == 0:
+        return np.zeros(0, dtype=int), OrderedDict((name, np.zeros(0)) for name in names)
+
+    # group the pairs by the need they start from, only needs with connections are evaluated
+    order = np.argsort(from_needs, kind='mergesort')
+    sorted_needs = from_needs[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_needs)) + 1))
+    sizes = np.diff(np.append(starts, len(order)))
+    groups = np.flatnonzero(np.add.reduceat(y_true[order].astype(int), starts) > 0)
+
+    # process the needs in chunks of rows of a (needs x candidates) matrix with at most "block_size" entries
+    chunk_start = 0
+    while chunk_start < len(groups):
+        chunk_stop = chunk_start + 1
+        width = sizes[groups[chunk_start]]
+        while chunk_stop < len(groups) and \
+                (chunk_stop - chunk_start + 1) * max(width, sizes[groups[chunk_stop]]) <= block_size:
+            width = max(width, sizes[groups[chunk_stop]])
+            chunk_stop += 1
+        chunk = groups[chunk_start:chunk_stop]
+        row = np.repeat(np.arange(len(chunk)), sizes[chunk])
+        position = np.arange(len(row)) - np.repeat(np.cumsum(sizes[chunk]) - sizes[chunk], sizes[chunk])
+        pairs = order[np.repeat(starts[chunk], sizes[chunk]) + position]
+        S = np.full((len(chunk), width), -np.inf)
+        Y = np.zeros((len(chunk), width), dtype=bool)
+        S[row, position] = scores[pairs]
+        Y[row, position] = y_true[pairs]
+        for name, values in _ranking_metrics_rows(Y, S, ks).items():
+            metrics[name].append(values)
+        chunk_start = chunk_stop
+
+    needs = sorted_needs[starts[groups]]
+    return needs, OrderedDict((name, np.concatenate(metrics[name])) for name in names)
+
+# ranking metrics (see ranking_metrics()) for every row of a matrix of true classes Y and scores S, computed for all
+# rows at once. Pairs with the same score are ranked pessimistically (connections after the other pairs).
+def _ranking_metrics_rows(Y, S, ks):
+    S = np.where(np.isnan(S), -np.inf, S)
+    valid = S > -np.inf
+    num_valid = valid.sum(axis=1)
+    num_positives = Y.sum(axis=1).astype(float)
+    rows = np.arange(S.shape[0])[:, np.newaxis]
+
+    # select the top k pairs of every row with one partition and sort only these. All pairs with a higher score than
+    # the k-th one are selected, of the pairs with the same score as the k-th one the other pairs come first.
+    max_k = max(ks)
+    k = min(max_k, S.shape[1])
+    top = np.argpartition(-S, k - 1, axis=1)[:, :k]
+    top_scores = S[rows, top]
+    kth_score = top_scores.min(axis=1)[:, np.newaxis]
+    num_higher = (S > kth_score).sum(axis=1)[:, np.newaxis]
+    num_tied_negatives = ((S == kth_score) & ~Y).sum(axis=1)[:, np.newaxis]
+    order = np.lexsort((Y[rows, top], -top_scores), axis=-1)
+    position = np.arange(k)[np.newaxis, :]
+    top_hits = np.where(position < num_higher, Y[rows, top[rows, order]],
+                        position - num_higher >= num_tied_negatives)
+    hits = np.zeros((S.shape[0], max_k), dtype=bool)
+    hits[:, :k] = top_hits & (position < num_valid[:, np.newaxis])
+
+    # average precision: the j-th connection of a row (by descending score) has the rank j plus the number of other
+    # pairs of the row with a score that is at least as high. Rows have few connections, so the scores of the
+    # connections are compared with all other pairs of their row (as many connections at once as the matrix has rows,
+    # so that the comparison is not larger than the matrix).
+    positive_rows, positive_columns = np.nonzero(Y & valid)
+    positive_scores = S[positive_rows, positive_columns]
+    negative_scores = np.where(Y | ~valid, -np.inf, S)
+    num_higher_negatives = np.empty(len(positive_rows))
+    for start in range(0, len(positive_rows), S.shape[0]):
+        part = slice(start, start + S.shape[0])
+        num_higher_negatives[part] = (negative_scores[positive_rows[part]] >=
+                                      positive_scores[part, np.newaxis]).sum(axis=1)
+    positive_order = np.lexsort((-positive_scores, positive_rows))
+    first = np.searchsorted(positive_rows[positive_order], positive_rows[positive_order], side='left')
+    j = np.empty(len(positive_order))
+    j[positive_order] = np.arange(len(positive_order)) - first + 1
+    precisions = j / (j + num_higher_negatives)
+    AP = np.bincount(positive_rows, weights=precisions, minlength=S.shape[0]) / np.maximum(num_positives, 1)
+
+    metrics = dict()
+    for k in ks:
+        discounts = 1.0 / np.log2(np.arange(2, k + 2))
+        num_hits = hits[:, :k].sum(axis=1)
+        metrics['P@%d' % k] = num_hits / float(k)
+        metrics['R@%d' % k] = num_hits / num_positives
+        ideal = np.cumsum(discounts)[np.minimum(num_positives, k).astype(int) - 1]
+        metrics['NDCG@%d' % k] = (hits[:, :k] * discounts).sum(axis=1) / ideal
+    metrics['AP'] = AP
+    return metrics
+
+
+# histogram of the scores of positive and negative pairs to compute approximate precision-recall and ROC curves (and
+# their AUC) in constant memory. Scores can be added block by block and histograms of different folds or processes
+# can be merged. With "low" and "high" the histogram has "bins" fixed bins over this score range (scores outside are
+# counted in the first/last bin). Otherwise the bins adapt to the scores: they have a width of a power of two and
+# whenever the scores don't fit into "bins" bins anymore, two neighbouring bins are merged. The curves are exact at
+# the bin edges, the error of the AUC is bounded by the area of the bins in the curve (see get*AUCErrorBound()).
+# Pairs with the score NaN are never predicted. Pairs can have weights (e.g. of a sample of the pairs), so the counts
+# are floats.
+class ScoreHistogram:
+
+    def __init__(self, bins=1000, low=None, high=None):
+        self.bins = bins
+        self.fixed = (low is not None and high is not None)
+        self.low = low
+        self.width = (high - low) / float(bins) if self.fixed else None
+        self.start = 0
+        self.positives = np.zeros(bins if self.fixed else 0)
+        self.negatives = np.zeros(bins if self.fixed else 0)
+        self.nanPositives = 0.0
+        self.nanNegatives = 0.0
+
+    # add the scores of a block of pairs and their true classes (1 = connected), optionally with weights of the pairs
+    def add(self, y_true, scores, weights=None):
+        y_true = np.asarray(y_true).ravel() == 1
+        scores = np.asarray(scores, dtype=float).ravel()
+        weights = np.ones(len(scores)) if weights is None else np.asarray(weights, dtype=float).ravel()
+        nan = np.isnan(scores)
+        self.nanPositives += weights[nan & y_true].sum()
+        self.nanNegatives += weights[nan & ~y_true].sum()
+        y_true = y_true[~nan]
+        scores = scores[~nan]
+        weights = weights[~nan]
+        if len(scores) == 0:
+            return
+        if self.fixed:
+            keys = np.floor((scores - self.low) / self.width)
+            keys = np.clip(keys, 0, self.bins - 1).astype(np.int64)
+        else:
+            self._fitScores(scores.min(), scores.max())
+            keys = np.floor(scores / self.width).astype(np.int64) - self.start
+        self.positives += np.bincount(keys[y_true], weights[y_true], minlength=len(self.positives))
+        self.negatives += np.bincount(keys[~y_true], weights[~y_true], minlength=len(self.negatives))
+
+    # add the counts of another histogram (e.g. of another fold)
+    def merge(self, other):
+        self.nanPositives += other.nanPositives
+        self.nanNegatives += other.nanNegatives
+        if self.fixed or other.fixed:
+            if (self.fixed != other.fixed or self.low != other.low or self.width != other.width or
+                    self.bins != other.bins):
+                raise Exception("Only histograms with the same fixed bins can be merged!")
+            self.positives += other.positives
+            self.negatives += other.negatives
+            return
+        if other.width is None:
+            return
+        other = other.copy()
+        if self.width is None:
+            self.width = other.width
+            self.start = other.start
+            self.positives = np.zeros(0)
+            self.negatives = np.zeros(0)
+
+        # bring both histograms to the same bin width and a common range of bins
+        while self.width < other.width:
+            self._coarsen()
+        while other.width < self.width:
+            other._coarsen()
+        while max(self.start + len(self.positives), other.start + len(other.positives)) - \
+                min(self.start, other.start) > self.bins:
+            self._coarsen()
+            other._coarsen()
+        self._extend(other.start, other.start + len(other.positives))
+        offset = other.start - self.start
+        self.positives[offset:offset + len(other.positives)] += other.positives
+        self.negatives[offset:offset + len(other.negatives)] += other.negatives
+
+    def copy(self):
+        histogram = ScoreHistogram(self.bins)
+        histogram.__dict__.update(self.__dict__)
+        histogram.positives = self.positives.copy()
+        histogram.negatives = self.negatives.copy()
+        return histogram
+
+    # adapt the bins so that the scores between "low" and "high" can be added
+    def _fitScores(self, low, high):
+        if self.width is None:
+            span = max(high - low, abs(high) * 1e-9, 1e-12)
+            self.width = 2.0 ** np.ceil(np.log2(span / self.bins))
+            self.start = int(np.floor(low / self.width))
+        while True:
+            low_key = min(self.start, int(np.floor(low / self.width)))
+            high_key = max(self.start + len(self.positives), int(np.floor(high / self.width)) + 1)
+            if high_key - low_key <= self.bins:
+                break
+            self._coarsen()
+        self._extend(low_key, high_key)
+
+    # extend the bins to cover the bin keys [low_key, high_key)
+    def _extend(self, low_key, high_key):
+        low_key = min(low_key, self.start)
+        high_key = max(high_key, self.start + len(self.positives))
+        before = self.start - low_key
+        after = high_key - self.start - len(self.positives)
+        self.positives = np.concatenate((np.zeros(before), self.positives, np.zeros(after)))
+        self.negatives = np.concatenate((np.zeros(before), self.negatives, np.zeros(after)))
+        self.start = low_key
+
+    # double the bin width by merging every two neighbouring bins
+    def _coarsen(self):
+        new_start = self.start // 2
+        before = self.start - 2 * new_start
+        after = (before + len(self.positives)) % 2
+
+        def merge_bins(counts):
+            counts = np.concatenate((np.zeros(before), counts, np.zeros(after)))
+            return counts.reshape(-1, 2).sum(axis=1)
+
+        self.positives = merge_bins(self.positives)
+        self.negatives = merge_bins(self.negatives)
+        self.start = new_start
+        self.width *= 2
+
+    # return the lower edges and the positive/negative counts of the non-empty bins in increasing order of the scores
+    def _getBins(self):
+        if self.width is None:
+            return np.zeros(0), np.zeros(0), np.zeros(0)
+        edges = (self.low if self.fixed else 0.0) + (self.start + np.arange(len(self.positives))) * self.width
+        nonempty = (self.positives + self.negatives) > 0
+        return edges[nonempty], self.positives[nonempty], self.negatives[nonempty]
+
+    # return the number of true positives and false positives that are predicted with the lower edge of every
+    # non-empty bin as threshold (score >= threshold), in increasing order of the thresholds
+    def _getCounts(self):
+        edges, positives, negatives = self._getBins()
+        TP = np.cumsum(positives[::-1])[::-1]
+        FP = np.cumsum(negatives[::-1])[::-1]
+        return edges, TP, FP, positives, negatives
+
+    def getNumPositives(self):
+        return self.positives.sum() + self.nanPositives
+
+    def getNumNegatives(self):
+        return self.negatives.sum() + self.nanNegatives
+
+    # return precision, recall and thresholds like sklearn.metrics.precision_recall_curve (thresholds increasing,
+    # the last precision value 1 and recall value 0 have no threshold)
+    def getPrecisionRecallCurve(self):
+        thresholds, TP, FP, _, _ = self._getCounts()
+        precision = _safe_divide(TP, TP + FP)
+        recall = _safe_divide(TP, self.getNumPositives())
+        return np.append(precision, 1.0), np.append(recall, 0.0), thresholds
+
+    # return false positive rate, true positive rate and thresholds like sklearn.metrics.roc_curve (thresholds
+    # decreasing, the first point (0, 0) has a threshold above all scores)
+    def getROCCurve(self):
+        thresholds, TP, FP, _, _ = self._getCounts()
+        fpr = np.concatenate(([0.0], _safe_divide(FP[::-1], self.getNumNegatives())))
+        tpr = np.concatenate(([0.0], _safe_divide(TP[::-1], self.getNumPositives())))
+        thresholds = np.concatenate(([thresholds[-1] + self.width] if len(thresholds) else [], thresholds[::-1]))
+        if self.nanPositives + self.nanNegatives > 0:
+            fpr, tpr = np.append(fpr, 1.0), np.append(tpr, 1.0)
+            thresholds = np.append(thresholds, np.nan)
+        return fpr, tpr, thresholds
+
+    # area under the precision-recall curve (trapezoidal rule like sklearn.metrics.auc)
+    def getPrecisionRecallAUC(self):
+        precision, recall, _ = self.getPrecisionRecallCurve()
+        return _trapezoid_area(recall[::-1], precision[::-1])
+
+    def getROCAUC(self):
+        fpr, tpr, _ = self.getROCCurve()
+        return _trapezoid_area(fpr, tpr)
+
+    # maximum error of getPrecisionRecallAUC() compared to the exact curve: the sum of the areas of the bins in the
+    # curve (the recall range of a bin times the range the precision can have while the threshold moves in the bin)
+    def getPrecisionRecallAUCErrorBound(self):
+        _, TP, FP, positives, negatives = self._getCounts()
+        TP_above = TP - positives
+        FP_above = FP - negatives
+        precision_max = _safe_divide(TP_above + positives, TP_above + positives + FP_above)
+        precision_min = _safe_divide(TP_above, TP_above + FP_above + negatives)
+        recall_range = _safe_divide(positives, self.getNumPositives())
+        return float(np.sum(recall_range * (precision_max - precision_min)))
+
+    # maximum error of getROCAUC() compared to the exact curve: the sum of the areas of the bins in the curve
+    def getROCAUCErrorBound(self):
+        _, _, _, positives, negatives = self._getCounts()
+        area = np.sum(positives * negatives) + self.nanPositives * self.nanNegatives
+        return float(_safe_divide(area, self.getNumPositives() * self.getNumNegatives()))
+
+
+# element-wise a / b, 0 where b is 0
+def _safe_divide(a, b):
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float) * np.ones(a.shape)
+    result = np.zeros(a.shape)
+    np.divide(a, b, out=result, where=(b > 0))
+    return result
 
+# area under the curve y(x) by the trapezoidal rule, x has to be increasing
+def _trapezoid_area(x, y):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    return float(np.sum(np.diff(x) * (y[1:] + y[:-1]) / 2.0))
@@ -1,14 +1,22 @@
+import os
+import codecs
+import shutil
+import tempfile
+import multiprocessing
+from itertools import islice
+from collections import OrderedDict
+
+import numpy as np
+from scipy.sparse import csr_matrix
 from scipy.sparse.coo import coo_matrix
-from sklearn.feature_extraction.text import TfidfVectorizer
-import nltk
-from nltk import word_tokenize
 
+# nltk and scikit-learn are imported where they are used, importing them takes
+# longer than most of the scripts that import this module need.
 
 _stop_symbols = {'(', ')', '<', '>', '[', ']'}
 
-_default_tagger = nltk.data.load(nltk.tag._POS_TAGGER)
-
-from nltk.corpus.reader.wordnet import NOUN, VERB, ADJ, ADV
+# WordNet POS constants (nltk.corpus.reader.wordnet.NOUN, VERB, ADJ, ADV)
+NOUN, VERB, ADJ, ADV = 'n', 'v', 'a', 'r'
 
 _tag_map = {
     'NN': NOUN,
@@ -29,22 +37,129 @@ _tag_map = {
     'RBS': ADV,
 }
 
-default_pos_tagger = (_default_tagger, _tag_map.keys())
+
+
+def word_tokenize(doc):
+    """
+    Tokenize a document with nltk.word_tokenize (imported on the first call).
+    """
+    from nltk import word_tokenize
+    return word_tokenize(doc)
+
+
+class _LazyPosTagger:
+    """
+    The default nltk POS tagger, loaded on the first call of tag(). Pickled
+    without the loaded tagger, so that the tokenization worker processes load
+    it themselves.
+    """
+
+    def __init__(self):
+        self._tagger = None
+
+    def tag(self, tokens):
+        if self._tagger is None:
+            import nltk
+            self._tagger = nltk.data.load(nltk.tag._POS_TAGGER)
+        return self._tagger.tag(tokens)
+
+    def __getstate__(self):
+        return {'_tagger': None}
+
+
+default_pos_tagger = (_LazyPosTagger(), _tag_map.keys())
+
+
+class LRUCache:
+    """
+    Bounded cache that evicts the least recently used entry when it is full.
+    Counts the hits and misses of the lookups.
+    """
+
+    def __init__(self, maxsize=100000):
+        """
+        :param maxsize: Maximum number of entries, None for no limit.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Return the cached value of the key (and mark it as recently used) or
+        None if the key is not cached.
+        """
+        value = self._entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries[key] = value
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        if self.maxsize is not None and len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups > 0 else 0.0
+
+    def statistics(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hit_rate(), 'size': len(self),
+                'maxsize': self.maxsize}
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+def _describe(obj):
+    # name of a function or of the class of an object with its module
+    if obj is None:
+        return 'None'
+    name = getattr(obj, '__name__', None) or type(obj).__name__
+    return '%s.%s' % (getattr(obj, '__module__', None) or
+                      type(obj).__module__, name)
 
 
 class ScikitNltkTokenizerAdapter:
+
+    # increase when a change of this class changes the tokens of documents
+    VERSION = 1
+
     def __init__(self, preprocessor=None, tokenizer=None, pos_tagger=None,
-                 lemmatizer=None):
+                 lemmatizer=None, lemma_cache_size=100000, tag_cache_size=0):
+        """
+        :param lemma_cache_size: Maximum number of cached lemmas (keyed on
+        token and WordNet POS), 0 disables the cache and None sets no limit.
+        :param tag_cache_size: Maximum number of cached tagged token
+        sequences (e.g. repeated subject lines), 0 disables the cache.
+        """
         self.preprocessor = preprocessor
         if tokenizer is None:
             self.tokenizer = word_tokenize
         else:
             self.tokenizer = tokenizer
         if pos_tagger is not None:
-            self.tagger, self.tags = pos_tagger
+            self.tagger, tags = pos_tagger
+            self.tags = set(tags)
         else:
             self.tagger, self.tags = None, None
         self.lemmatizer = lemmatizer
+        self.lemma_cache = None
+        if lemma_cache_size != 0:
+            self.lemma_cache = LRUCache(lemma_cache_size)
+        self.tag_cache = None
+        if tag_cache_size != 0:
+            self.tag_cache = LRUCache(tag_cache_size)
 
     def __call__(self, doc):
         if self.preprocessor is not None:
@@ -52,25 +167,231 @@ class ScikitNltkTokenizerAdapter:
         tokens = self.tokenizer(doc)
         tagged = None
         if self.tagger is not None:
-            tagged = [(token, tag)
-                      for token, tag in self.tagger.tag(tokens)
-                      if tag in self.tags]
+            tagged = self._tag(tokens)
             tokens = [token for token, tag in tagged]
         if self.lemmatizer is None:
             return tokens
         if tagged is not None:
-            std_tagged = [(token, _tag_map[tag]) for token, tag in tagged]
-            return [self.lemmatizer.lemmatize(token, pos=tag)
-                    for token, tag in std_tagged]
-        return [self.lemmatizer.lemmatize(token) for token in tokens]
+            return [self._lemmatize(token, _tag_map[tag])
+                    for token, tag in tagged]
+        return [self._lemmatize(token) for token in tokens]
+
+    def _tag(self, tokens):
+        key = None
+        if self.tag_cache is not None:
+            key = tuple(tokens)
+            tagged = self.tag_cache.get(key)
+            if tagged is not None:
+                return tagged
+        tagged = [(token, tag)
+                  for token, tag in self.tagger.tag(tokens)
+                  if tag in self.tags]
+        if key is not None:
+            self.tag_cache.put(key, tagged)
+        return tagged
+
+    def _lemmatize(self, token, pos=None):
+        if self.lemma_cache is None:
+            return self._lemmatize_uncached(token, pos)
+        key = (token, pos)
+        lemma = self.lemma_cache.get(key)
+        if lemma is None:
+            lemma = self._lemmatize_uncached(token, pos)
+            self.lemma_cache.put(key, lemma)
+        return lemma
+
+    def _lemmatize_uncached(self, token, pos):
+        if pos is None:
+            return self.lemmatizer.lemmatize(token)
+        return self.lemmatizer.lemmatize(token, pos=pos)
+
+    def config(self):
+        """
+        Return a description of the tokenization: the version of this class
+        and of nltk, the preprocessor, tokenizer, tagger and lemmatizer and
+        the used tags. Use it in the namespace of a TokenCache, so that the
+        cached tokens are not used after the tokenization changed.
+        """
+        try:
+            import nltk
+            nltk_version = nltk.__version__
+        except (ImportError, AttributeError):
+            nltk_version = None
+        tags = ','.join(sorted(self.tags)) if self.tags is not None else None
+        return 'v%d nltk=%s preprocessor=%s tokenizer=%s tagger=%s ' \
+               'tags=%s lemmatizer=%s' % (
+                   self.VERSION, nltk_version, _describe(self.preprocessor),
+                   _describe(self.tokenizer), _describe(self.tagger), tags,
+                   _describe(self.lemmatizer))
+
+    def cache_statistics(self):
+        """
+        Return the statistics (hits, misses, hit rate, size) of the lemma and
+        tag caches, None for a disabled cache.
+        """
+        statistics = {'lemma': None, 'tag': None}
+        if self.lemma_cache is not None:
+            statistics['lemma'] = self.lemma_cache.statistics()
+        if self.tag_cache is not None:
+            statistics['tag'] = self.tag_cache.statistics()
+        return statistics
 
 
 def create_vectorizer(input_type, tokenizer, min_df=1, stop_words='english',
                       ngram_range=(1, 2)):
+    from sklearn.feature_extraction.text import TfidfVectorizer
     return TfidfVectorizer(input=input_type, tokenizer=tokenizer, min_df=min_df,
                            stop_words=stop_words, ngram_range=ngram_range)
 
 
+def pass_through(doc):
+    """
+    Return the document unchanged. Used as preprocessor and tokenizer of
+    vectorizers that get documents which are already tokenized.
+    """
+    return doc
+
+
+def create_pretokenized_vectorizer(min_df=1, stop_words='english',
+                                   ngram_range=(1, 2)):
+    """
+    Create a vectorizer like create_vectorizer() for documents that are
+    already tokenized (lists of tokens, e.g. from tokenize_documents()).
+    Stop word removal and n-gram creation are still done by the vectorizer.
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    return TfidfVectorizer(input='content', preprocessor=pass_through,
+                           tokenizer=pass_through, lowercase=False,
+                           min_df=min_df, stop_words=stop_words,
+                           ngram_range=ngram_range)
+
+
+class DocumentReader:
+    """
+    Read and decode a document like the vectorizers do before they call the
+    tokenizer: read the file for input type 'filename', decode bytes and
+    convert to lower case.
+    """
+
+    def __init__(self, input_type='content', encoding='utf-8',
+                 decode_error='strict', lowercase=True):
+        self.input_type = input_type
+        self.encoding = encoding
+        self.decode_error = decode_error
+        self.lowercase = lowercase
+
+    def __call__(self, doc):
+        if self.input_type == 'filename':
+            with open(doc, 'rb') as f:
+                doc = f.read()
+        elif self.input_type == 'file':
+            doc = doc.read()
+        if isinstance(doc, bytes):
+            doc = doc.decode(self.encoding, self.decode_error)
+        if self.lowercase:
+            doc = doc.lower()
+        return doc
+
+
+# tokenizer and document reader of a tokenization worker process, they are
+# loaded once per worker by _init_tokenize_worker()
+_worker_tokenizer = None
+_worker_reader = None
+
+
+def _init_tokenize_worker(tokenizer, reader):
+    global _worker_tokenizer, _worker_reader
+    _worker_tokenizer = tokenizer
+    _worker_reader = reader
+
+
+def _tokenize_chunk(docs):
+    return [_worker_tokenizer(_worker_reader(doc)) for doc in docs]
+
+
+def _chunks(docs, chunksize):
+    docs = iter(docs)
+    chunk = list(islice(docs, chunksize))
+    while chunk:
+        yield chunk
+        chunk = list(islice(docs, chunksize))
+
+
+def tokenize_documents(docs, tokenizer, input_type='content', n_jobs=1,
+                       chunksize=64, reader=None, cache=None):
+    """
+    Tokenize documents in a pool of worker processes. The documents are
+    distributed in chunks, every worker gets the tokenizer (e.g. a
+    ScikitNltkTokenizerAdapter with tagger and lemmatizer) only once.
+
+    :param docs: Iterable of documents (content or file names).
+    :param tokenizer: Callable that returns the tokens of a document.
+    :param input_type: 'content', 'filename' or 'file' like the input of
+    the vectorizers ('file' is only supported with n_jobs=1).
+    :param n_jobs: Number of worker processes, 1 tokenizes in this process.
+    :param chunksize: Number of documents passed to a worker at once.
+    :param reader: DocumentReader that reads the documents before they are
+    tokenized, the default reads them like create_vectorizer() does.
+    :param cache: Optional TokenCache, only the documents whose content is
+    not cached are tokenized (and then added to the cache).
+    :return: Generator of the token lists of the documents (in order), can
+    be passed to the fit_transform() of create_pretokenized_vectorizer().
+    """
+    if reader is None:
+        reader = DocumentReader(input_type)
+    if cache is not None:
+        return _tokenize_with_cache(docs, tokenizer, reader, n_jobs,
+                                    chunksize, cache)
+    return _tokenize(docs, tokenizer, reader, n_jobs, chunksize)
+
+
+def _tokenize(docs, tokenizer, reader, n_jobs, chunksize):
+    if n_jobs <= 1:
+        for doc in docs:
+            yield tokenizer(reader(doc))
+        return
+    pool = multiprocessing.Pool(n_jobs, _init_tokenize_worker,
+                                (tokenizer, reader))
+    try:
+        for tokens in pool.imap(_tokenize_chunk, _chunks(docs, chunksize)):
+            for doc_tokens in tokens:
+                yield doc_tokens
+    finally:
+        pool.terminate()
+
+
+def _tokenize_with_cache(docs, tokenizer, reader, n_jobs, chunksize, cache):
+    # the documents are read and looked up in the cache in this process in
+    # batches, the workers only tokenize the contents that are not cached
+    pool = None
+    if n_jobs > 1:
+        pool = multiprocessing.Pool(n_jobs, _init_tokenize_worker,
+                                    (tokenizer, pass_through))
+    try:
+        for batch in _chunks(docs, chunksize * max(n_jobs, 1) * 4):
+            contents = [reader(doc) for doc in batch]
+            keys = [cache.key(content) for content in contents]
+            tokens = cache.get_many(keys)
+            missing = [i for i in range(len(tokens)) if tokens[i] is None]
+            missing_contents = [contents[i] for i in missing]
+            if pool is None:
+                new_tokens = [tokenizer(content)
+                              for content in missing_contents]
+            else:
+                new_tokens = [doc_tokens for chunk_tokens in pool.map(
+                    _tokenize_chunk, list(_chunks(missing_contents,
+                                                  chunksize)))
+                              for doc_tokens in chunk_tokens]
+            for i, doc_tokens in zip(missing, new_tokens):
+                tokens[i] = doc_tokens
+            cache.put_many([(keys[i], tokens[i]) for i in missing])
+            for doc_tokens in tokens:
+                yield doc_tokens
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
 def apply_threshold(original, threshold):
     """
     Filter the matrix such that each field has is greater than the threshold.
@@ -132,4 +453,238 @@ def new_tensor_slice(headers, feature_definitions):
                 column_data_index[data_point] = headers_cursor
                 headers_cursor += 1
 
-    return headers, data_offset_indices
\ No newline at end of file
+    return headers, data_offset_indices
+
+
+def merge_tensor_slice_headers(headers, feature_definitions):
+    """
+    Vectorized variant of new_tensor_slice(): the name to index maps of the
+    existing headers are built in one pass and only the used values are
+    looked up (and appended if they are new), so that the COO indices can be
+    mapped to header indices with numpy (e.g. offsets[name][coo.row]).
+
+    :param headers: The original headers. Will not be modified.
+    :param feature_definitions: List of ("dimension name", [feature values],
+    [COO row or col indices]) tuples.
+    :return: (The updated headers, dict of the dimension names to arrays of
+    the (0-based) header index of every value, -1 for unused values)
+    """
+    headers = list(headers)
+    names = [name for name, _, _ in feature_definitions]
+    header_indices = dict((name, {}) for name in names)
+    for i, header in enumerate(headers):
+        for name in names:
+            if header.startswith(name):
+                header_indices[name][header[len(name):]] = i
+                break
+
+    offsets = {}
+    for name, values, used_coo_indices in feature_definitions:
+        used = np.zeros(len(values), dtype=bool)
+        used[np.asarray(used_coo_indices, dtype=np.int64)] = True
+        value_offsets = np.empty(len(values), dtype=np.int64)
+        value_offsets.fill(-1)
+        column_indices = header_indices[name]
+        for i in np.flatnonzero(used):
+            index = column_indices.get(values[i])
+            if index is None:
+                index = len(headers)
+                headers.append(name + values[i])
+                column_indices[values[i]] = index
+            value_offsets[i] = index
+        offsets[name] = value_offsets
+    return headers, offsets
+
+
+def append_headers(filename, headers, new_headers):
+    """
+    Append the headers that were added to the original headers of a headers
+    file (e.g. by merge_tensor_slice_headers()) without rewriting it.
+
+    :param headers: The original headers (as read from the file).
+    :param new_headers: The updated headers.
+    """
+    added = new_headers[len(headers):]
+    if len(added) == 0:
+        return
+    separator = u''
+    if os.path.getsize(filename) > 0:
+        with open(filename, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                separator = u'\n'
+    with codecs.open(filename, 'a', encoding='utf8') as f:
+        f.write(separator + u'\n'.join(added))
+
+
+class StreamingTfidfVectorizer:
+    """
+    Tf-idf vectorizer for out-of-core keyword extraction of tokenized
+    documents. Terms are hashed into a fixed feature space instead of
+    keeping a vocabulary and the document frequencies are updated chunk by
+    chunk, the idf (smoothed like the TfidfVectorizer) is computed from them.
+    Optionally the first term of every used feature is kept as its name.
+    """
+
+    def __init__(self, n_features=2 ** 20, stop_words='english',
+                 ngram_range=(1, 2), reverse_map=True, cache_size=100000):
+        """
+        :param n_features: Size of the hashed feature space.
+        :param reverse_map: Keep the feature names (the first term hashed to
+        each feature), otherwise features are named by their index.
+        :param cache_size: Maximum number of cached term hashes.
+        """
+        self.n_features = n_features
+        self.analyzer = create_pretokenized_vectorizer(
+            stop_words=stop_words, ngram_range=ngram_range).build_analyzer()
+        self.document_frequencies = np.zeros(n_features, dtype=np.int64)
+        self.n_documents = 0
+        self.terms = {} if reverse_map else None
+        self._hashes = LRUCache(cache_size)
+        from sklearn.utils import murmurhash3_32
+        self._murmurhash3_32 = murmurhash3_32
+
+    def _feature(self, term):
+        feature = self._hashes.get(term)
+        if feature is None:
+            feature = self._murmurhash3_32(term, positive=True) % \
+                self.n_features
+            self._hashes.put(term, feature)
+            if self.terms is not None and feature not in self.terms:
+                self.terms[feature] = term
+        return feature
+
+    def partial_fit_transform(self, token_lists):
+        """
+        Count the terms of a chunk of tokenized documents and add them to the
+        document frequencies.
+
+        :return: CSR matrix of the term counts (documents x n_features).
+        """
+        features = []
+        indptr = [0]
+        for tokens in token_lists:
+            features.extend(self._feature(term)
+                            for term in self.analyzer(tokens))
+            indptr.append(len(features))
+        counts = csr_matrix((np.ones(len(features)),
+                             np.array(features, dtype=np.int32), indptr),
+                            shape=(len(indptr) - 1, self.n_features))
+        counts.sum_duplicates()
+        self.document_frequencies += np.bincount(counts.indices,
+                                                 minlength=self.n_features)
+        self.n_documents += counts.shape[0]
+        return counts
+
+    def idf(self):
+        return np.log((1.0 + self.n_documents) /
+                      (1.0 + self.document_frequencies)) + 1.0
+
+    def transform_counts(self, counts, idf=None):
+        """
+        Return the l2 normalized tf-idf matrix of term counts.
+
+        :param idf: The idf array, computed from the document frequencies if
+        it is not given.
+        """
+        if idf is None:
+            idf = self.idf()
+        tfidf = csr_matrix(counts, dtype=float, copy=True)
+        tfidf.data *= idf[tfidf.indices]
+        norms = np.sqrt(np.bincount(
+            np.repeat(np.arange(tfidf.shape[0]), np.diff(tfidf.indptr)),
+            weights=tfidf.data ** 2, minlength=tfidf.shape[0]))
+        norms[norms == 0] = 1.0
+        tfidf.data /= np.repeat(norms, np.diff(tfidf.indptr))
+        return tfidf
+
+    def feature_name(self, feature):
+        if self.terms is not None and feature in self.terms:
+            return self.terms[feature]
+        return u'#%d' % feature
+
+
+def write_streaming_keyword_slice(token_lists, docs, headers, filename,
+                                  vectorizer, threshold=0.1, chunksize=10000,
+                                  document_prefix='Need: ',
+                                  feature_prefix='Attr: ', tmpdir=None):
+    """
+    Extract the keywords of tokenized documents with a
+    StreamingTfidfVectorizer and write them as binary keyword slice (matrix
+    market file), keeping only chunks of documents in memory. The first
+    pass counts the terms and document frequencies, the second one applies
+    the threshold to the tf-idf values and the third one writes the entries
+    with the tensor indices of the documents and keywords.
+
+    :param token_lists: Iterable of the token lists of the documents.
+    :param docs: The document names (in the order of the token lists).
+    :param headers: The original headers. Will not be modified.
+    :param filename: Matrix market file of the keyword slice.
+    :param threshold: Minimum tf-idf value of a keyword.
+    :param chunksize: Number of documents processed at once.
+    :param tmpdir: Folder for the temporary chunk files.
+    :return: The updated headers.
+    """
+    folder = tempfile.mkdtemp(prefix='keywords_', dir=tmpdir)
+    try:
+        # count the terms chunk by chunk and store the counts
+        chunk_files = []
+        for chunk in _chunks(token_lists, chunksize):
+            counts = vectorizer.partial_fit_transform(chunk)
+            chunk_file = folder + '/counts%d.npz' % len(chunk_files)
+            np.savez(chunk_file, data=counts.data, indices=counts.indices,
+                     indptr=counts.indptr)
+            chunk_files.append((chunk_file, counts.shape[0]))
+
+        # store the entries above the threshold with the final idf
+        idf = vectorizer.idf()
+        used_docs = np.zeros(len(docs), dtype=bool)
+        used_features = np.zeros(vectorizer.n_features, dtype=bool)
+        entries_file = folder + '/entries.bin'
+        nnz = 0
+        offset = 0
+        with open(entries_file, 'wb') as entries:
+            for chunk_file, rows in chunk_files:
+                arrays = np.load(chunk_file)
+                counts = csr_matrix((arrays['data'], arrays['indices'],
+                                     arrays['indptr']),
+                                    shape=(rows, vectorizer.n_features))
+                tfidf = coo_matrix(vectorizer.transform_counts(counts, idf))
+                keep = tfidf.data > threshold
+                chunk_entries = np.column_stack(
+                    (tfidf.row[keep] + offset, tfidf.col[keep]))
+                chunk_entries.astype(np.int64).tofile(entries)
+                used_docs[chunk_entries[:, 0]] = True
+                used_features[chunk_entries[:, 1]] = True
+                nnz += len(chunk_entries)
+                offset += rows
+
+        # add the documents and keywords to the headers
+        features = np.flatnonzero(used_features)
+        names = [vectorizer.feature_name(feature) for feature in features]
+        new_headers, offsets = merge_tensor_slice_headers(headers, [
+            (document_prefix, docs, np.flatnonzero(used_docs)),
+            (feature_prefix, names, np.arange(len(names)))])
+        document_offsets = offsets[document_prefix] + 1
+        feature_offsets = np.zeros(vectorizer.n_features, dtype=np.int64)
+        feature_offsets[features] = offsets[feature_prefix] + 1
+
+        # write the entries with the (1-based) header indices
+        with open(filename, 'w') as output, \
+                open(entries_file, 'rb') as entries:
+            output.write('%%MatrixMarket matrix coordinate real general\n%\n')
+            output.write('%d %d %d\n' % (len(new_headers), len(new_headers),
+                                         nnz))
+            while True:
+                block = np.fromfile(entries, dtype=np.int64,
+                                    count=2 * chunksize).reshape(-1, 2)
+                if len(block) == 0:
+                    break
+                rows = document_offsets[block[:, 0]]
+                cols = feature_offsets[block[:, 1]]
+                output.write(''.join('%d %d 1\n' % entry
+                                     for entry in zip(rows, cols)))
+        return new_headers
+    finally:
+        shutil.rmtree(folder)
+
@@ -1,9 +1,11 @@
 __author__ = 'hfriedrich'
 
 import os
-from gexf import Gexf
+import codecs
+import numpy as np
 from time import strftime
-from tensor_utils import SparseTensor
+from xml.sax.saxutils import escape, quoteattr
+from tensor_utils import SparseTensor, TensorStatistics
 from evaluation_utils import NeedEvaluationDetailDict, NeedEvaluationDetails
 
 # create a gexf graph from the tensor for visualization in gephi
@@ -19,6 +21,8 @@ def create_gexf_graph(tensor, needEvaluationDetailDict=None):
     wants = tensor.getWantIndices()
     date_time = strftime("%Y-%m-%d_%H%M%S")
 
+    # the optional pygexf module is only imported when a gexf graph is created
+    from gexf import Gexf
     gexf = Gexf(os.path.basename(__file__), date_time)
     graph = gexf.addGraph('undirected','static','generated need graph')
     need_type_attr = graph.addNodeAttribute("need type", "undefined", "string")
@@ -78,3 +82,125 @@ def create_gexf_graph(tensor, needEvaluationDetailDict=None):
 
     return gexf
 
+
+# write the GEXF need graph of create_gexf_graph() directly to a file without building the graph in memory: every
+# node and edge is written as soon as it is created. The need types are taken from the tensor statistics, the
+# attribute labels of a need are joined from the rows of the csr attribute slices and the evaluation details of a need
+# only use its counts, so the memory does not grow with the number of nodes and edges. If "needs" is set only the
+# subgraph of these needs (e.g. from ego_subgraph_needs() or sampled_subgraph_needs()) is labelled and written.
+def write_gexf_graph(tensor, filename, needEvaluationDetailDict=None, needs=None):
+    if needs is None:
+        needs = tensor.getNeedIndices()
+    else:
+        needs = np.unique(needs).tolist()
+    needType = tensor.getStatistics().needType
+    labels = [header[6:] for header in tensor.getHeaders()]
+    date_time = strftime("%Y-%m-%d_%H%M%S")
+
+    # attribute slices as csr matrices without explicit zeros
+    attribute_slices = []
+    for slice in [SparseTensor.ATTR_SUBJECT_SLICE, SparseTensor.ATTR_CONTENT_SLICE, SparseTensor.CATEGORY_SLICE]:
+        matrix = tensor.getSliceMatrix(slice).tocsr()
+        matrix.eliminate_zeros()
+        attribute_slices.append(matrix)
+
+    attributes = [("need type", "string", "undefined"), ("subject attributes", "string", ""),
+                  ("content attributes", "string", ""), ("category attributes", "string", "")]
+    if needEvaluationDetailDict:
+        attributes += [("TP", "integer", ""), ("TN", "integer", ""), ("FP", "integer", ""), ("FN", "integer", ""),
+                       ("precision", "float", ""), ("recall", "float", ""), ("accuracy", "float", ""),
+                       ("f0.5score", "float", ""), ("f1score", "float", "")]
+
+    file = codecs.open(filename, 'w', encoding='utf8')
+    file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    file.write('<gexf xmlns="http://www.gexf.net/1.2draft" version="1.2">\n')
+    file.write('  <meta lastmodifieddate="%s">\n' % strftime("%Y-%m-%d"))
+    file.write('    <creator>%s</creator>\n' % escape(os.path.basename(__file__)))
+    file.write('    <description>%s</description>\n' % escape(date_time))
+    file.write('  </meta>\n')
+    file.write('  <graph defaultedgetype="undirected" mode="static">\n')
+    file.write('    <attributes class="node" mode="static">\n')
+    for i in range(len(attributes)):
+        title, type, default = attributes[i]
+        file.write('      <attribute id="%d" title=%s type="%s">\n' % (i, quoteattr(title), type))
+        file.write('        <default>%s</default>\n' % escape(default))
+        file.write('      </attribute>\n')
+    file.write('    </attributes>\n')
+
+    # write the nodes
+    file.write('    <nodes>\n')
+    for need in needs:
+        values = ["undefined", "", "", ""]
+        if needType[need] == TensorStatistics.OFFER:
+            values[0] = "OFFER"
+        elif needType[need] == TensorStatistics.WANT:
+            values[0] = "WANT"
+        for i in range(len(attribute_slices)):
+            matrix = attribute_slices[i]
+            attr = [labels[j] for j in matrix.indices[matrix.indptr[need]:matrix.indptr[need + 1]]]
+            if i == 2:
+                attr.sort()
+            values[i + 1] = ', '.join(attr)
+        if needEvaluationDetailDict:
+            needDetail = needEvaluationDetailDict.getCountDetails(need)
+            values += [str(needDetail.TP), str(needDetail.TN), str(needDetail.FP), str(needDetail.FN),
+                       str(needDetail.getPrecision()), str(needDetail.getRecall()), str(needDetail.getAccuracy()),
+                       str(needDetail.getFScore(0.5)), str(needDetail.getFScore(1))]
+        node = ['      <node id="%d" label=%s>\n' % (need, quoteattr(labels[need])), '        <attvalues>\n']
+        node += ['          <attvalue for="%d" value=%s/>\n' % (i, quoteattr(values[i])) for i in range(len(values))]
+        node += ['        </attvalues>\n', '      </node>\n']
+        file.write(''.join(node))
+    file.write('    </nodes>\n')
+
+    # write the connections as edges between nodes (needs), row by row of the csr connection slice
+    file.write('    <edges>\n')
+    connections = tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE).tocsr()
+    selected = np.zeros(connections.shape[0], dtype=bool)
+    selected[needs] = True
+    for i in needs:
+        start, stop = connections.indptr[i], connections.indptr[i + 1]
+        cols = connections.indices[start:stop]
+        cols = cols[(connections.data[start:stop] != 0) & (cols > i) & selected[cols]]
+        file.write(''.join(['      <edge id="%d_%d" source="%d" target="%d"/>\n' % (i, j, i, j) for j in cols]))
+    file.write('    </edges>\n')
+    file.write('  </graph>\n')
+    file.write('</gexf>\n')
+    file.close()
+
+# return the needs of the k-hop ego subgraphs around the needs "centers": all needs that are reachable with at most
+# "hops" connections. The breadth-first search only reads the csr rows of the connection slice of the current frontier.
+def ego_subgraph_needs(tensor, centers, hops):
+    connections = tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE).tocsr()
+    connections.eliminate_zeros()
+    visited = np.zeros(connections.shape[0], dtype=bool)
+    frontier = np.unique(np.asarray(centers, dtype=int))
+    visited[frontier] = True
+    for hop in range(hops):
+        if len(frontier) == 0:
+            break
+        reached = connections[frontier].indices
+        frontier = np.unique(reached[~visited[reached]])
+        visited[frontier] = True
+    return np.flatnonzero(visited)
+
+# return a degree-stratified random sample of "num_needs" needs, optionally extended by their "hops" ego subgraphs.
+# The needs are divided into "strata" groups by their number of connections (quantiles of the degree) and every group
+# gets the same share of the sample, so that hubs as well as needs with few connections are part of the sampled graph.
+def sampled_subgraph_needs(tensor, num_needs, strata=4, hops=0):
+    stats = tensor.getStatistics()
+    needs = np.flatnonzero(stats.isNeed)
+    degree = stats.connectionDegree[needs]
+    boundaries = np.unique(np.percentile(degree, np.linspace(0, 100, strata + 1)[1:-1])) if len(needs) > 0 else []
+    stratum = np.searchsorted(boundaries, degree, side='right')
+    groups = [needs[stratum == i] for i in range(len(boundaries) + 1)]
+
+    # small groups are sampled first, their remaining share is divided among the bigger groups
+    sample = []
+    remaining = min(num_needs, len(needs))
+    groups.sort(key=len)
+    for i in range(len(groups)):
+        size = min(len(groups[i]), remaining // (len(groups) - i))
+        if size > 0:
+            sample.append(np.random.choice(groups[i], size, replace=False))
+            remaining -= size
+    return ego_subgraph_needs(tensor, np.concatenate(sample) if sample else [], hops)
@@ -0,0 +1,169 @@
+import os
+import sys
+import json
+import time
+import codecs
+import logging
+from contextlib import contextmanager
+
+# optional modules: resource is only available on unix systems, tracemalloc only in python 3
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+_log = logging.getLogger()
+
+# This file contains the instrumentation of the evaluation pipeline: the wall and cpu time, the peak resident set size
+# (RSS) and optionally the peak traced python memory and the top allocations (tracemalloc) of every stage (e.g. tensor
+# loading, masking, RESCAL execution, prediction, metrics, statistics output) per fold and algorithm. The records are
+# written as a JSON file.
+
+# the highest peak RSS (VmHWM) of the process in MB before it was reset for a stage (see reset_peak_rss()). On linux
+# the reset also lowers ru_maxrss, so peak_rss_mb() takes it into account.
+_peak_rss_before_reset_mb = 0.0
+
+# the per stage peak RSS of the open stages of all Instrumentation instances of the process (the stages of the folds
+# are nested in a stage of the main instrumentation), innermost last. Every entry is a dict with the peak RSS in MB
+# measured so far ("peak") and whether the peak was reset at the start of the stage ("reset").
+_rss_stages = []
+
+
+# return the peak resident set size of the process in MB (or None if it is not available)
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on mac os and in kilobytes on other systems
+    peak = peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+    return max(peak, _peak_rss_before_reset_mb)
+
+# return the peak resident set size of the process in MB since the last reset_peak_rss() (VmHWM of linux, None if it
+# is not available)
+def stage_peak_rss_mb():
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+# reset the peak resident set size of the process (VmHWM) to the current resident set size, return False if this is
+# not supported (only linux since 4.0)
+def reset_peak_rss():
+    global _peak_rss_before_reset_mb
+    peak = stage_peak_rss_mb()
+    if peak is None:
+        return False
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+    except (IOError, OSError):
+        return False
+    _peak_rss_before_reset_mb = max(_peak_rss_before_reset_mb, peak)
+    return True
+
+# return the current resident set size of the process in MB (or None if it is not available)
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as file:
+            pages = int(file.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024.0)
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+# return True if the python memory allocations can be traced (tracemalloc is available)
+def tracemalloc_available():
+    return tracemalloc is not None
+
+# return the cpu time (user and system) of the process in seconds
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+# collects the records of the stages of an evaluation. Use stage() as context manager around the code of a stage, the
+# records of several instances (e.g. of the folds that are evaluated in worker processes) can be merged. The peak RSS
+# of a stage ("peak_rss_mb") is measured by resetting the peak of the process at the start of the stage, where this
+# is not available it is the peak of the process so far like "process_peak_rss_mb". If
+# "topAllocations" > 0 the python memory allocations are traced with tracemalloc (if available) and the peak traced
+# memory and the top allocations (by size difference between the start and the end) of every stage are recorded.
+class Instrumentation:
+
+    def __init__(self, topAllocations=0):
+        self.records = []
+        self.topAllocations = topAllocations if tracemalloc is not None else 0
+        self.stack = []
+        if topAllocations > 0 and tracemalloc is None:
+            _log.warn('tracemalloc is not available, allocations are not traced')
+        if self.topAllocations > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def isTracing(self):
+        return self.topAllocations > 0
+
+    # measure the code of the with block as stage "name" (of fold "fold" and algorithm "algorithm" if set)
+    @contextmanager
+    def stage(self, name, fold=None, algorithm=None):
+        frame = {'peak': 0, 'snapshot': None}
+        # keep the peak RSS of the enclosing stage before the peak is reset for this stage
+        if len(_rss_stages) > 0 and _rss_stages[-1]['reset']:
+            _rss_stages[-1]['peak'] = max(_rss_stages[-1]['peak'], stage_peak_rss_mb() or 0.0)
+        rss_frame = {'peak': 0.0, 'reset': reset_peak_rss()}
+        _rss_stages.append(rss_frame)
+        if self.isTracing():
+            # keep the peak of the enclosing stage before the peak is reset for this stage
+            if len(self.stack) > 0:
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            frame['snapshot'] = tracemalloc.take_snapshot()
+        self.stack.append(frame)
+        start_wall = time.time()
+        start_cpu = cpu_time()
+        try:
+            yield
+        finally:
+            record = {'stage': name, 'fold': fold, 'algorithm': algorithm,
+                      'wall_time': time.time() - start_wall, 'cpu_time': cpu_time() - start_cpu,
+                      'peak_rss_mb': peak_rss_mb(), 'process_peak_rss_mb': peak_rss_mb(),
+                      'rss_mb': current_rss_mb()}
+            _rss_stages.pop()
+            if rss_frame['reset']:
+                rss_frame['peak'] = max(rss_frame['peak'], stage_peak_rss_mb() or 0.0)
+                if len(_rss_stages) > 0:
+                    _rss_stages[-1]['peak'] = max(_rss_stages[-1]['peak'], rss_frame['peak'])
+                record['peak_rss_mb'] = rss_frame['peak']
+            self.stack.pop()
+            if self.isTracing():
+                frame['peak'] = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                if len(self.stack) > 0:
+                    self.stack[-1]['peak'] = max(self.stack[-1]['peak'], frame['peak'])
+                record['traced_peak_mb'] = frame['peak'] / (1024.0 * 1024.0)
+                statistics = tracemalloc.take_snapshot().compare_to(frame['snapshot'], 'lineno')
+                record['top_allocations'] = [
+                    {'location': '%s:%d' % (stat.traceback[0].filename, stat.traceback[0].lineno),
+                     'size_diff_kb': stat.size_diff / 1024.0, 'count_diff': stat.count_diff}
+                    for stat in statistics[:self.topAllocations]]
+            self.records.append(record)
+            _log.debug('stage %s: wall time %fs, cpu time %fs' % (name, record['wall_time'], record['cpu_time']))
+
+    # add the records of another instrumentation (e.g. of a fold evaluated in a worker process)
+    def merge(self, other):
+        self.records.extend(other.records)
+
+    # return the total wall time of all records of a stage
+    def getWallTime(self, name):
+        return sum(record['wall_time'] for record in self.records if record['stage'] == name)
+
+    # write the records as JSON file, "info" is an optional dict of additional values (e.g. the parameters)
+    def save(self, filename, info=None):
+        file = codecs.open(filename, 'w', encoding='utf8')
+        json.dump({'info': info or {}, 'stages': self.records}, file, indent=2, sort_keys=True)
+        file.close()
@@ -1,43 +1,180 @@
-from gensim import matutils
-from gensim.models import LdaModel
-from gensim.models.hdpmodel import HdpModel
-from sklearn.feature_extraction.text import TfidfVectorizer
+import os
+import json
+import codecs
+import hashlib
+from itertools import islice
 
-from tools.datasets import dataset_mails
+import numpy as np
+from scipy.io import mmwrite
+from scipy.sparse import coo_matrix
 
-# TODO: move to scripts
+from tools.feature_extraction import merge_tensor_slice_headers
 
+# gensim is imported where it is used, importing it takes a few seconds.
 
-def fit_lda(corpus, vocabulary, n_topics=10, passes=1):
-    return LdaModel(corpus, num_topics=n_topics, passes=passes,
-                    id2word={i: s for i, s in enumerate(vocabulary)})
+TOPIC_NAME = 'topic_%d'
 
 
-def fit_hdp_lda(corpus, vocabulary):
-    return HdpModel(corpus, {i: s for i, s in enumerate(vocabulary)})
+def topic_terms(tokens, stop_words):
+    """
+    Return the tokens of a document that are used as LDA terms, without stop
+    words and tokens that contain no letters or digits (punctuation).
+    """
+    return [token for token in tokens if token not in stop_words and
+            any(c.isalnum() for c in token)]
 
 
-if __name__ == '__main__':
-    content, input_type, tokenizer = dataset_mails(
-        '/Users/yanchith/workspace/won-corpora/processed')
+class BowCorpus:
+    """
+    Streamed bag-of-words corpus for gensim. Every iteration gets the token
+    lists of the documents again and converts them with the dictionary, so
+    only one document is in memory at a time. Use tokenize_documents() with
+    a TokenCache as token lists, then only the first pass tokenizes.
+    """
 
-    # content, input_type, tokenizer = dataset_newsgroups()
+    def __init__(self, token_lists, dictionary, stop_words=()):
+        """
+        :param token_lists: Callable that returns a new iterable of the token
+        lists of the documents.
+        :param dictionary: gensim Dictionary of the terms.
+        :param stop_words: Tokens that are not used as terms.
+        """
+        self.token_lists = token_lists
+        self.dictionary = dictionary
+        self.stop_words = frozenset(stop_words)
 
-    vectorizer = TfidfVectorizer(min_df=3, input=input_type, ngram_range=(1, 1),
-                                 stop_words='english', tokenizer=tokenizer)
-    X = vectorizer.fit_transform(content)
-    features = vectorizer.get_feature_names()
+    def __iter__(self):
+        for tokens in self.token_lists():
+            yield self.dictionary.doc2bow(topic_terms(tokens, self.stop_words))
 
-    print('Number of features:', len(features))
-    print('Bag of words shape:', X.shape)
-    print(features)
 
-    # Beware, gensim requires the matrix transposed
-    model = fit_hdp_lda(matutils.Sparse2Corpus(X, documents_columns=False),
-                        features)
+def create_dictionary(token_lists, stop_words=(), no_below=3, no_above=0.5,
+                      keep_n=100000):
+    """
+    Create the gensim Dictionary of the LDA terms in one pass over the token
+    lists and remove the rare and the too frequent terms.
 
-    n_topics_to_show = 200
-    for topic in model.show_topics(topics=n_topics_to_show, topn=10,
-                                   formatted=True):
-        print(topic)
+    :param token_lists: Iterable of the token lists of the documents.
+    :param no_below: Minimum number of documents of a term.
+    :param no_above: Maximum fraction of the documents of a term.
+    :param keep_n: Maximum number of (the most frequent) terms.
+    """
+    from gensim.corpora import Dictionary
+    stop_words = frozenset(stop_words)
+    dictionary = Dictionary(topic_terms(tokens, stop_words)
+                            for tokens in token_lists)
+    dictionary.filter_extremes(no_below=no_below, no_above=no_above,
+                               keep_n=keep_n)
+    return dictionary
 
+
+def _fingerprint(dictionary, parameters):
+    # hash of the parameters and the terms and document frequencies of the
+    # dictionary, which change with the corpus
+    terms = sorted((dictionary[i], dictionary.dfs[i])
+                   for i in dictionary.keys())
+    data = json.dumps({'parameters': parameters, 'terms': terms,
+                       'documents': dictionary.num_docs}, sort_keys=True)
+    return hashlib.sha1(data.encode('utf8')).hexdigest()
+
+
+def load_or_fit_lda(model_file, corpus, dictionary, n_topics=200, passes=1,
+                    chunksize=2000, workers=None, seed=None):
+    """
+    Return the LDA model of the corpus that is cached in model_file, or
+    train it with online LDA in worker processes (gensim LdaMulticore) over
+    the streamed corpus and save it there. The cached model is only used if
+    it was trained with the same dictionary and parameters, which are stored
+    in "<model_file>.json".
+
+    :param corpus: Iterable of the bag-of-words documents (e.g. BowCorpus),
+    iterated once per pass.
+    :param n_topics: Number of topics.
+    :param passes: Number of passes over the corpus.
+    :param chunksize: Number of documents per online update.
+    :param workers: Number of worker processes, None for the number of
+    cpus - 1.
+    :param seed: Seed of the random state of the model.
+    :return: (LDA model, True if it was loaded from model_file)
+    """
+    from gensim.models import LdaMulticore
+    parameters = {'n_topics': n_topics, 'passes': passes,
+                  'chunksize': chunksize, 'seed': seed}
+    fingerprint = _fingerprint(dictionary, parameters)
+    info_file = model_file + '.json'
+    if os.path.exists(model_file) and os.path.exists(info_file):
+        with codecs.open(info_file, 'r', encoding='utf8') as f:
+            if json.load(f).get('fingerprint') == fingerprint:
+                return LdaMulticore.load(model_file), True
+
+    model = LdaMulticore(corpus, num_topics=n_topics, id2word=dictionary,
+                         workers=workers, chunksize=chunksize, passes=passes,
+                         random_state=seed)
+    model.save(model_file)
+    with codecs.open(info_file, 'w', encoding='utf8') as f:
+        json.dump({'fingerprint': fingerprint, 'parameters': parameters,
+                   'documents': dictionary.num_docs,
+                   'terms': len(dictionary)}, f, indent=2, sort_keys=True)
+    return model, False
+
+
+def document_topics(model, corpus, n_top=3, min_probability=0.05,
+                    chunksize=2000):
+    """
+    Infer the topic distributions of the documents in chunks and return the
+    most probable topics of every document. Documents without terms have no
+    topics.
+
+    :param corpus: Iterable of the bag-of-words documents.
+    :param n_top: Maximum number of topics per document.
+    :param min_probability: Minimum probability of a topic of a document.
+    :param chunksize: Number of documents inferred at once.
+    :return: (document indices, topic indices, topic probabilities) arrays
+    """
+    rows, cols, values = [], [], []
+    corpus = iter(corpus)
+    offset = 0
+    chunk = list(islice(corpus, chunksize))
+    while chunk:
+        gamma, _ = model.inference(chunk)
+        theta = gamma / gamma.sum(axis=1)[:, np.newaxis]
+        top = np.argsort(-theta, axis=1)[:, :n_top]
+        probabilities = theta[np.arange(len(chunk))[:, np.newaxis], top]
+        keep = probabilities >= min_probability
+        keep[np.array([len(bow) == 0 for bow in chunk])] = False
+        document_indices = np.nonzero(keep)[0]
+        rows.append(document_indices + offset)
+        cols.append(top[keep])
+        values.append(probabilities[keep])
+        offset += len(chunk)
+        chunk = list(islice(corpus, chunksize))
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), \
+            np.zeros(0)
+    return np.concatenate(rows).astype(np.int64), \
+        np.concatenate(cols).astype(np.int64), np.concatenate(values)
+
+
+def write_topic_slice(headers, docs, rows, cols, n_topics, filename,
+                      document_prefix='Need: ', feature_prefix='Attr: '):
+    """
+    Write the topics of the documents as binary need to topic slice (matrix
+    market file) with topic attributes named "topic_<n>".
+
+    :param headers: The original headers. Will not be modified.
+    :param docs: The document names.
+    :param rows: Document index of every entry.
+    :param cols: Topic index of every entry.
+    :param n_topics: Number of topics of the model.
+    :param filename: Matrix market file of the topic slice.
+    :return: The updated headers.
+    """
+    topics = [TOPIC_NAME % topic for topic in range(n_topics)]
+    new_headers, offsets = merge_tensor_slice_headers(headers, [
+        (document_prefix, docs, rows), (feature_prefix, topics, cols)])
+    matrix = coo_matrix((np.ones(len(rows)),
+                         (np.take(offsets[document_prefix], rows),
+                          np.take(offsets[feature_prefix], cols))),
+                        shape=(len(new_headers), len(new_headers)))
+    mmwrite(filename, matrix)
+    return new_headers
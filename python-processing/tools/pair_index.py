@@ -0,0 +1,254 @@
+import numpy as np
+from scipy.sparse import issparse
+
+# This file contains a compact representation of (from need, to need) index pairs of the connection slice that are
+# used in the evaluation. Instead of python lists of all pairs the index stores int32 arrays or implicit products of
+# need blocks and hands the pairs out block by block, so that truth lookup, prediction and metrics never have to
+# materialize the full pair list.
+
+# maximum number of pairs that are processed together in one block
+DEFAULT_BLOCK_SIZE = 1 << 20
+
+
+# number of rounds of the Feistel network of the pair shuffle and the constants of its round function (the finalizer
+# of splitmix64)
+FEISTEL_ROUNDS = 4
+_MIX_MULTIPLIERS = (np.uint64(0xbf58476d1ce4e5b9), np.uint64(0x94d049bb133111eb))
+_MIX_SHIFTS = (np.uint64(30), np.uint64(27), np.uint64(31))
+
+# the round function of the Feistel network: hash the uint64 array x with the key, keep the lowest bits of "mask". The
+# uint64 multiplications wrap around, nothing can overflow.
+def _mix(x, key, mask):
+    x = x ^ key
+    x = (x ^ (x >> _MIX_SHIFTS[0])) * _MIX_MULTIPLIERS[0]
+    x = (x ^ (x >> _MIX_SHIFTS[1])) * _MIX_MULTIPLIERS[1]
+    return (x ^ (x >> _MIX_SHIFTS[2])) & mask
+
+# apply the balanced Feistel network with the round keys to the uint64 array x of numbers with 2 * "bits" bits
+def _feistel(x, keys, bits):
+    shift = np.uint64(bits)
+    mask = np.uint64((1 << bits) - 1)
+    left = x >> shift
+    right = x & mask
+    for key in keys:
+        left, right = right, left ^ _mix(right, key, mask)
+    return (left << shift) | right
+
+# map the positions k (int64 array of values in [0, n), n <= 2^62) to their positions in a pseudo-random permutation
+# of [0, n) given by the round keys. The Feistel network permutes the smallest domain of 2^(2 * bits) >= n numbers,
+# positions that are mapped outside of [0, n) are mapped again until they are inside (cycle walking, the domain has
+# less than 4 * n numbers, so there are few repetitions).
+def _permute(k, n, keys):
+    bits = max(1, (int(n - 1).bit_length() + 1) // 2)
+    x = _feistel(np.asarray(k, dtype=np.int64).astype(np.uint64), keys, bits)
+    outside = np.nonzero(x >= np.uint64(n))[0]
+    while len(outside) > 0:
+        x[outside] = _feistel(x[outside], keys, bits)
+        outside = outside[x[outside] >= np.uint64(n)]
+    return x.astype(np.int64)
+
+
+# a block of pairs of a PairIndex. If "product" is True the block represents all pairs "rows" x "cols" in row-major
+# order, otherwise it represents the pairs (rows[i], cols[i]). "offset" is the position of the first pair of the block
+# in the whole index.
+class PairBlock:
+
+    def __init__(self, offset, rows, cols, product):
+        self.offset = offset
+        self.rows = rows
+        self.cols = cols
+        self.product = product
+
+    def __len__(self):
+        return len(self.rows) * len(self.cols) if self.product else len(self.rows)
+
+    # return the pairs of this block as two arrays (from needs, to needs)
+    def toArrays(self):
+        if self.product:
+            return np.repeat(self.rows, len(self.cols)), np.tile(self.cols, len(self.rows))
+        return self.rows, self.cols
+
+    # return the values of a (sparse or dense) matrix at the pairs of this block as a flat array
+    def getArrayFromMatrix(self, matrix):
+        if self.product:
+            if issparse(matrix):
+                return matrix.tocsr()[self.rows][:, self.cols].toarray().ravel()
+            return np.asarray(matrix)[np.ix_(self.rows, self.cols)].ravel()
+        if issparse(matrix):
+            return np.asarray(matrix.tocsr()[self.rows, self.cols]).ravel()
+        return np.asarray(matrix)[self.rows, self.cols]
+
+
+# explicit pairs stored as two int32 arrays
+class _PairsPart:
+
+    def __init__(self, from_needs, to_needs):
+        self.from_needs = np.asarray(from_needs, dtype=np.int32)
+        self.to_needs = np.asarray(to_needs, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.from_needs)
+
+    def getBlocks(self, offset, block_size):
+        for start in range(0, len(self), block_size):
+            stop = min(start + block_size, len(self))
+            yield PairBlock(offset + start, self.from_needs[start:stop], self.to_needs[start:stop], False)
+
+    def getSlice(self, start, stop):
+        return _PairsPart(self.from_needs[start:stop], self.to_needs[start:stop])
+
+
+# all pairs of a block of (test) needs with a block of (candidate) needs in row-major order
+class _ProductPart:
+
+    def __init__(self, rows, cols):
+        self.rows = np.asarray(rows, dtype=np.int32)
+        self.cols = np.asarray(cols, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.rows) * len(self.cols)
+
+    def getBlocks(self, offset, block_size):
+        if len(self) == 0:
+            return
+        rows_per_block = max(1, block_size // len(self.cols))
+        for start in range(0, len(self.rows), rows_per_block):
+            rows = self.rows[start:start + rows_per_block]
+            yield PairBlock(offset + start * len(self.cols), rows, self.cols, True)
+
+    def getSlice(self, start, stop):
+        # the identity permutation, the slice is not materialized
+        return _PermutedProductPart(self.rows, self.cols, None, start, stop)
+
+
+# the positions [start, stop) of a pseudo-random permutation (see _permute(), given by the round keys "keys") of all
+# pairs of a product. This shuffles the pairs of a product without materializing them, slices of it can be used as
+# folds. Without keys (None) the pairs are in row-major order.
+class _PermutedProductPart:
+
+    def __init__(self, rows, cols, keys, start=0, stop=None):
+        self.rows = np.asarray(rows, dtype=np.int32)
+        self.cols = np.asarray(cols, dtype=np.int32)
+        self.keys = keys
+        self.start = start
+        self.stop = len(self.rows) * len(self.cols) if stop is None else stop
+
+    def __len__(self):
+        return max(0, self.stop - self.start)
+
+    def getBlocks(self, offset, block_size):
+        n = len(self.rows) * len(self.cols)
+        for start in range(self.start, self.stop, block_size):
+            stop = min(start + block_size, self.stop)
+            k = np.arange(start, stop, dtype=np.int64)
+            if self.keys is not None:
+                k = _permute(k, n, self.keys)
+            rows = self.rows[k // len(self.cols)]
+            cols = self.cols[k % len(self.cols)]
+            yield PairBlock(offset + start - self.start, rows, cols, False)
+
+    def getSlice(self, start, stop):
+        start = min(self.start + start, self.stop)
+        stop = min(self.start + stop, self.stop)
+        return _PermutedProductPart(self.rows, self.cols, self.keys, start, stop)
+
+
+# index of (from need, to need) pairs made of one or more parts (explicit pairs, products or permuted products). Use
+# getBlocks() or mapBlocks() to process the pairs block by block.
+class PairIndex:
+
+    def __init__(self, parts=None):
+        self.parts = list(parts) if parts else []
+        self.truth = None
+        self.positives = None
+
+    # create an index of the explicit pairs (from_needs[i], to_needs[i])
+    @staticmethod
+    def fromPairs(from_needs, to_needs):
+        return PairIndex([_PairsPart(from_needs, to_needs)])
+
+    # create an index of all pairs of the needs "rows" with the needs "cols" (e.g. test needs x all needs)
+    @staticmethod
+    def fromProduct(rows, cols):
+        return PairIndex([_ProductPart(rows, cols)])
+
+    # create an index of all pairs of the needs "rows" with the needs "cols" in shuffled order (a pseudo-random
+    # permutation drawn with numpy's random state)
+    @staticmethod
+    def fromShuffledProduct(rows, cols):
+        n = len(rows) * len(cols)
+        if n < 2:
+            return PairIndex.fromProduct(rows, cols)
+        keys = [np.uint64(np.random.randint(0, 1 << 62, dtype=np.int64)) for _ in range(FEISTEL_ROUNDS)]
+        return PairIndex([_PermutedProductPart(rows, cols, keys)])
+
+    # create an index of the pairs of several indices one after another
+    @staticmethod
+    def concat(indices):
+        return PairIndex([part for index in indices for part in index.parts])
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+    # iterate over the pairs as PairBlock objects of at most "block_size" pairs
+    def getBlocks(self, block_size=DEFAULT_BLOCK_SIZE):
+        offset = 0
+        for part in self.parts:
+            for block in part.getBlocks(offset, block_size):
+                yield block
+            offset += len(part)
+
+    # call fn(block) for every block and return the (flattened) results as one array in the order of the pairs
+    def mapBlocks(self, fn, dtype=float, block_size=DEFAULT_BLOCK_SIZE):
+        result = np.zeros(len(self), dtype=dtype)
+        for block in self.getBlocks(block_size):
+            result[block.offset:block.offset + len(block)] = np.ravel(fn(block))
+        return result
+
+    # return the values of a (sparse or dense) matrix at the pairs of the index as a flat array
+    def getArrayFromMatrix(self, matrix):
+        return self.mapBlocks(lambda block: block.getArrayFromMatrix(matrix))
+
+    # look up the values of a ground truth matrix (e.g. the connection slice) at the pairs once and keep them with the
+    # index, so that all algorithms and statistics that evaluate the pairs share the same (read-only) truth vector.
+    # Returns the truth vector.
+    def setTruthMatrix(self, matrix):
+        self.truth = self.getArrayFromMatrix(matrix)
+        self.truth.setflags(write=False)
+        self.positives = np.flatnonzero(self.truth)
+        self.positives.setflags(write=False)
+        return self.truth
+
+    # return the truth vector of the pairs set by setTruthMatrix()
+    def getTruth(self):
+        if self.truth is None:
+            raise ValueError("no truth matrix set for the pair index")
+        return self.truth
+
+    # return the positions of the pairs with a true value (connections) set by setTruthMatrix()
+    def getPositivePositions(self):
+        if self.positives is None:
+            raise ValueError("no truth matrix set for the pair index")
+        return self.positives
+
+    # return the pairs [start, stop) of the index as a new index
+    def getSlice(self, start, stop):
+        parts = []
+        offset = 0
+        for part in self.parts:
+            part_start = max(start - offset, 0)
+            part_stop = min(stop - offset, len(part))
+            if part_start < part_stop:
+                parts.append(part.getSlice(part_start, part_stop))
+            offset += len(part)
+        return PairIndex(parts)
+
+    # materialize the pairs as two int32 arrays (from needs, to needs)
+    def toArrays(self):
+        from_needs = np.zeros(len(self), dtype=np.int32)
+        to_needs = np.zeros(len(self), dtype=np.int32)
+        for block in self.getBlocks():
+            from_block, to_block = block.toArrays()
+            from_needs[block.offset:block.offset + len(block)] = from_block
+            to_needs[block.offset:block.offset + len(block)] = to_block
+        return from_needs, to_needs
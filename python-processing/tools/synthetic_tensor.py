@@ -0,0 +1,109 @@
+import os
+import codecs
+import numpy as np
+from scipy.io import mmwrite
+from scipy.sparse import csr_matrix, coo_matrix
+from tools.tensor_utils import SparseTensor
+
+# This file contains a generator for synthetic WON tensors that resemble the tensors built from the mail corpus:
+# - needs of type OFFER or WANT (with a configurable ratio of offers)
+# - connections only between OFFERS and WANTS with a hub-heavy (power law) degree distribution, so that most needs have
+#   none or few connections and some needs have many
+# - subject, content and category attributes with Zipfian frequencies (few very frequent attribute terms, a long tail
+#   of rare ones)
+# The tensors can be written as tensor folders (headers.txt and the .mtx slice files) that can be used as input of the
+# evaluation and the benchmarks without the private mail corpus.
+
+SLICE_FILES = [(SparseTensor.CONNECTION_SLICE, "connection.mtx"), (SparseTensor.NEED_TYPE_SLICE, "needtype.mtx"),
+               (SparseTensor.ATTR_SUBJECT_SLICE, "subject.mtx"), (SparseTensor.ATTR_CONTENT_SLICE, "content.mtx"),
+               (SparseTensor.CATEGORY_SLICE, "category.mtx")]
+
+
+# return the probabilities of "n" items with Zipfian frequencies (the k-th most frequent item has a probability
+# proportional to 1 / k^exponent)
+def zipf_probabilities(n, exponent):
+    p = 1.0 / np.power(np.arange(1, n + 1, dtype=float), exponent)
+    return p / p.sum()
+
+# return a binary csr matrix of shape "shape" where every row of "rows" holds about "mean_count" (poisson distributed,
+# at least one) entries in the columns "columns", chosen with the probabilities "p"
+def _random_attribute_matrix(shape, rows, columns, mean_count, p, random_state):
+    counts = np.maximum(random_state.poisson(mean_count, len(rows)), 1)
+    row_entries = np.repeat(rows, counts)
+    col_entries = np.asarray(columns)[random_state.choice(len(columns), size=len(row_entries), p=p)]
+    matrix = csr_matrix(coo_matrix((np.ones(len(row_entries)), (row_entries, col_entries)), shape=shape))
+    matrix.data[:] = 1.0
+    return matrix
+
+# return a symmetric binary csr matrix of "num_connections" (before the removal of duplicates) connections between
+# the "offers" and "wants". The end points of the connections are chosen with probabilities proportional to power law
+# distributed need weights (Chung-Lu model), a smaller "degree_exponent" means more and bigger hubs.
+def _random_connection_matrix(shape, offers, wants, num_connections, degree_exponent, random_state):
+    if len(offers) == 0 or len(wants) == 0 or num_connections == 0:
+        return csr_matrix(shape)
+    end_points = []
+    for needs in [offers, wants]:
+        weights = random_state.pareto(degree_exponent - 1.0, len(needs)) + 1.0
+        end_points.append(np.asarray(needs)[random_state.choice(len(needs), size=num_connections,
+                                                                 p=weights / weights.sum())])
+    rows = np.concatenate((end_points[0], end_points[1]))
+    cols = np.concatenate((end_points[1], end_points[0]))
+    matrix = csr_matrix(coo_matrix((np.ones(len(rows)), (rows, cols)), shape=shape))
+    matrix.data[:] = 1.0
+    return matrix
+
+# create a synthetic tensor with "num_needs" needs (a fraction of "offer_ratio" OFFERS, the others WANTS),
+# "num_attributes" subject/content attribute terms and "num_categories" categories. Every need has about
+# "subject_attributes" subject attributes, "content_attributes" content attributes and one category (if
+# "num_categories" > 0), the attribute frequencies follow a Zipf distribution with the exponent "zipf_exponent". The
+# needs have "mean_connections" connections on average, distributed with a power law of the exponent
+# "degree_exponent" (> 1). The headers are ordered as needs, need types, attributes and categories.
+def create_synthetic_tensor(num_needs, num_attributes, num_categories=20, offer_ratio=0.5, mean_connections=2.0,
+                            degree_exponent=2.5, subject_attributes=3.0, content_attributes=15.0, zipf_exponent=1.1,
+                            seed=None):
+    if degree_exponent <= 1.0:
+        raise Exception("degree_exponent must be greater than 1 but is %f" % degree_exponent)
+    random_state = np.random.RandomState(seed)
+    headers = ["Need: n%d" % i for i in range(num_needs)] + ["Attr: OFFER", "Attr: WANT"]
+    attributes = np.arange(len(headers), len(headers) + num_attributes)
+    headers += ["Attr: a%d" % i for i in range(num_attributes)]
+    categories = np.arange(len(headers), len(headers) + num_categories)
+    headers += ["Attr: c%d" % i for i in range(num_categories)]
+    tensor = SparseTensor(headers)
+    shape = tensor.shape
+
+    needs = np.arange(num_needs)
+    isOffer = random_state.random_sample(num_needs) < offer_ratio
+    offers = needs[isOffer]
+    wants = needs[~isOffer]
+    typeColumns = np.where(isOffer, headers.index("Attr: OFFER"), headers.index("Attr: WANT"))
+    tensor.addSliceMatrix(csr_matrix((np.ones(num_needs), (needs, typeColumns)), shape=shape),
+                          SparseTensor.NEED_TYPE_SLICE)
+
+    num_connections = int(round(mean_connections * num_needs / 2.0))
+    tensor.addSliceMatrix(_random_connection_matrix(shape, offers, wants, num_connections, degree_exponent,
+                                                    random_state), SparseTensor.CONNECTION_SLICE)
+
+    if num_attributes > 0:
+        p = zipf_probabilities(num_attributes, zipf_exponent)
+        tensor.addSliceMatrix(_random_attribute_matrix(shape, needs, attributes, subject_attributes, p, random_state),
+                              SparseTensor.ATTR_SUBJECT_SLICE)
+        tensor.addSliceMatrix(_random_attribute_matrix(shape, needs, attributes, content_attributes, p, random_state),
+                              SparseTensor.ATTR_CONTENT_SLICE)
+    if num_categories > 0:
+        p = zipf_probabilities(num_categories, zipf_exponent)
+        chosen = random_state.choice(num_categories, size=num_needs, p=p)
+        tensor.addSliceMatrix(csr_matrix((np.ones(num_needs), (needs, categories[chosen])), shape=shape),
+                              SparseTensor.CATEGORY_SLICE)
+    return tensor
+
+# write a tensor as tensor folder: the headers file "headers.txt" and the slice files "connection.mtx",
+# "needtype.mtx", "subject.mtx", "content.mtx" and "category.mtx" (in the format read by read_input_tensor())
+def write_tensor_folder(tensor, folder):
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    file = codecs.open(folder + "/headers.txt", 'w', encoding='utf8')
+    file.write('\n'.join(tensor.getHeaders()))
+    file.close()
+    for slice, filename in SLICE_FILES:
+        mmwrite(folder + "/" + filename, tensor.data[slice])
@@ -2,14 +2,13 @@ from scipy.io.mmio import mmwrite
 
 __author__ = 'hfriedrich'
 
+import os
 import logging
 import codecs
 import numpy as np
 from scipy.io import mmread
 from scipy.sparse import csr_matrix, lil_matrix
-from scipy.spatial.distance import pdist
-from scipy.spatial.distance import squareform
-from rescal import rescal_als
+from tools.pair_index import PairIndex
 
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s %(levelname)-8s %(message)s',
@@ -23,11 +22,13 @@ class SparseTensor:
 
         CONNECTION_SLICE, NEED_TYPE_SLICE, ATTR_SUBJECT_SLICE, ATTR_CONTENT_SLICE, CATEGORY_SLICE = range(5)
         defaultSlices = [CONNECTION_SLICE, NEED_TYPE_SLICE, ATTR_SUBJECT_SLICE]
+        attributeSlices = [ATTR_SUBJECT_SLICE, ATTR_CONTENT_SLICE, CATEGORY_SLICE]
 
         def __init__(self, headers):
             self.shape = (len(headers), len(headers))
-            self.data = [csr_matrix(np.zeros(shape=self.shape))] * 5
+            self.data = [csr_matrix(self.shape)] * 5
             self.headers = list(headers)
+            self.statistics = None
 
         def copy(self):
             copyTensor = SparseTensor(self.headers)
@@ -47,6 +48,7 @@ class SparseTensor:
                 raise Exception("Bad shape of added slices of tensor, is (%d,%d) but should be (%d,%d)!" %
                                 (matrix.shape[0], matrix.shape[1], self.shape[0], self.shape[1]))
             self.data[slice] = csr_matrix(matrix)
+            self.statistics = None
 
         def getHeaders(self):
             return list(self.headers)
@@ -54,31 +56,27 @@ class SparseTensor:
         def getArrayFromSliceMatrix(self, slice, indices):
             return matrix_to_array(self.data[slice], indices)
 
+        # return the statistics index of the tensor, it is computed on first access and recomputed after slices change
+        def getStatistics(self):
+            if self.statistics is None:
+                self.statistics = TensorStatistics(self)
+            return self.statistics
+
         # return a list of indices which refer to rows/columns of needs in the tensor
         def getNeedIndices(self):
-            needs = [i for i in range(0, len(self.getHeaders())) if (self.getHeaders()[i].startswith('Need:'))]
-            return needs
+            return np.flatnonzero(self.getStatistics().isNeed).tolist()
 
         # return a list of indices which refer to rows/columns of attributes in the tensor
         def getAttributeIndices(self):
-            attrs = [i for i in range(0, len(self.getHeaders())) if (self.getHeaders()[i].startswith('Attr:'))]
-            return attrs
+            return np.flatnonzero(self.getStatistics().isAttribute).tolist()
 
         # return a list of indices which refer to rows/columns of needs of type OFFER in the tensor
         def getOfferIndices(self):
-            needs = self.getNeedIndices()
-            offer_attr_idx = self.getHeaders().index("Attr: OFFER")
-            offers = [need for need in needs if
-                      (self.getSliceMatrix(SparseTensor.NEED_TYPE_SLICE)[need, offer_attr_idx] == 1)]
-            return offers
+            return np.flatnonzero(self.getStatistics().needType == TensorStatistics.OFFER).tolist()
 
         # return a list of indices which refer to rows/columns of needs of type WANT in the tensor
         def getWantIndices(self):
-            needs = self.getNeedIndices()
-            want_attr_idx = self.getHeaders().index("Attr: WANT")
-            wants = [need for need in needs if
-                     (self.getSliceMatrix(SparseTensor.NEED_TYPE_SLICE)[need, want_attr_idx] == 1)]
-            return wants
+            return np.flatnonzero(self.getStatistics().needType == TensorStatistics.WANT).tolist()
 
         def getNeedLabel(self, need):
             return self.getHeaders()[need][6:]
@@ -89,6 +87,47 @@ class SparseTensor:
             return attr
 
 
+# index with statistics about every entity (row/column) of a tensor: if it is a need or an attribute, the number of
+# connections (degree) and attributes of each need and the need type. All values are computed once with sparse
+# reductions over the slices, use them for vectorized selection of needs instead of iterating over the tensor rows.
+class TensorStatistics:
+
+        NO_TYPE, OFFER, WANT = range(3)
+
+        def __init__(self, tensor):
+            headers = tensor.headers
+            self.isNeed = np.array([h.startswith('Need:') for h in headers], dtype=bool)
+            self.isAttribute = np.array([h.startswith('Attr:') for h in headers], dtype=bool)
+
+            # number of connections of every need (sum of the connection slice rows)
+            con = tensor.data[SparseTensor.CONNECTION_SLICE]
+            self.connectionDegree = np.asarray(con.sum(axis=1)).ravel()
+
+            # number of attributes of every need over all attribute slices
+            self.attributeCount = np.zeros(len(headers), dtype=int)
+            for slice in SparseTensor.attributeSlices:
+                self.attributeCount += tensor.data[slice].getnnz(axis=1)
+
+            # need type of every need, computed from the columns of the type attributes in the need type slice
+            self.needType = np.zeros(len(headers), dtype=np.int8)
+            needtype = tensor.data[SparseTensor.NEED_TYPE_SLICE].tocsc()
+            for needTypeValue, attr in [(TensorStatistics.OFFER, "Attr: OFFER"), (TensorStatistics.WANT, "Attr: WANT")]:
+                if attr in headers:
+                    column = np.asarray(needtype[:, headers.index(attr)].todense()).ravel()
+                    self.needType[(column == 1) & self.isNeed] = needTypeValue
+
+        # return an array of the needs that have more than x connections
+        def getNeedsWithMoreThanXConnections(self, x_connections):
+            return np.flatnonzero(self.isNeed & (self.connectionDegree > x_connections))
+
+        # return a boolean array that is True for the pairs (from_needs[i], to_needs[i]) of an OFFER and a WANT
+        def isOppositeTypePair(self, from_needs, to_needs):
+            from_types = self.needType[from_needs]
+            to_types = self.needType[to_needs]
+            return ((from_types == TensorStatistics.OFFER) & (to_types == TensorStatistics.WANT)) | \
+                   ((from_types == TensorStatistics.WANT) & (to_types == TensorStatistics.OFFER))
+
+
 # read the input tensor data (e.g. data-0.mtx ... data-3.mtx) and
 # the headers file (e.g. headers.txt)
 # if adjustDim is True then the dimensions of the slice matrix
@@ -125,6 +164,37 @@ def read_input_tensor(headers_filename, data_file_names, tensor_slices, adjustDi
         slice = slice + 1
     return tensor
 
+# save the headers and the (csr) slices of a tensor as numpy array files (data, indices and indptr of each slice) to a
+# folder. Load them with load_tensor_arrays(), e.g. memory-mapped to share them read-only between processes.
+def save_tensor_arrays(tensor, folder, slices=None):
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    file = codecs.open(folder + "/headers.txt", 'w', encoding='utf8')
+    file.write('\n'.join(tensor.getHeaders()))
+    file.close()
+    if slices is None:
+        slices = range(len(tensor.data))
+    for slice in slices:
+        matrix = tensor.data[slice]
+        np.save(folder + "/slice%d_data.npy" % slice, matrix.data)
+        np.save(folder + "/slice%d_indices.npy" % slice, matrix.indices)
+        np.save(folder + "/slice%d_indptr.npy" % slice, matrix.indptr)
+
+# load a tensor that was saved with save_tensor_arrays(), by default the slice arrays are memory-mapped read-only
+def load_tensor_arrays(folder, mmap_mode='r'):
+    file = codecs.open(folder + "/headers.txt", 'r', encoding='utf8')
+    headers = file.read().splitlines()
+    file.close()
+    tensor = SparseTensor(headers)
+    for slice in range(len(tensor.data)):
+        prefix = folder + "/slice%d_" % slice
+        if os.path.exists(prefix + "data.npy"):
+            matrix = csr_matrix((np.load(prefix + "data.npy", mmap_mode=mmap_mode),
+                                 np.load(prefix + "indices.npy", mmap_mode=mmap_mode),
+                                 np.load(prefix + "indptr.npy", mmap_mode=mmap_mode)), shape=tensor.shape)
+            tensor.addSliceMatrix(matrix, slice)
+    return tensor
+
 # adjust (increase) the dimension of an mm matrix file
 def adjust_mm_dimension(data_file, dim):
     file = codecs.open(data_file,'r',encoding='utf8')
@@ -149,18 +219,64 @@ def adjust_mm_dimension(data_file, dim):
     file.close()
     return True
 
-# return a tuple with two lists holding need indices that represent connections
+# return a (shuffled) pair index of need indices that represent connections
 # between these needs, symmetric connection are only represented once
 def connection_indices(tensor):
-    nz = tensor.getSliceMatrix(SparseTensor.CONNECTION_SLICE).nonzero()
-    nz0 = [nz[0][i] for i in range(len(nz[0])) if nz[0][i] <= nz[1][i]]
-    nz1 = [nz[1][i] for i in range(len(nz[0])) if nz[0][i] <= nz[1][i]]
-    indices = [i for i in range(len(nz0))]
-    np.random.shuffle(indices)
-    ret0 = [nz0[i] for i in indices]
-    ret1 = [nz1[i] for i in indices]
-    nzsym = (ret0, ret1)
-    return nzsym
+    nz = tensor.data[SparseTensor.CONNECTION_SLICE].nonzero()
+    upper = nz[0] <= nz[1]
+    order = np.random.permutation(np.count_nonzero(upper))
+    return PairIndex.fromPairs(nz[0][upper][order], nz[1][upper][order])
+
+# return a boolean array which is True for every entry of the array "keys" that is contained in "values"
+def _contains_keys(keys, values):
+    values = np.unique(values)
+    if len(values) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    pos = np.minimum(np.searchsorted(values, keys), len(values) - 1)
+    return values[pos] == keys
+
+# return a new csr matrix that only holds the entries of the matrix that are marked in the boolean array "keep"
+# (one entry of "keep" for each stored entry of the matrix in coo order)
+def _filter_entries(matrix, keep):
+    coo = matrix.tocoo()
+    return csr_matrix((coo.data[keep], (coo.row[keep], coo.col[keep])), shape=matrix.shape)
+
+# set all rows and columns of a matrix to 0 that are not marked in the boolean array "keep" (of size
+# matrix.shape[0]) in one pass over the matrix entries
+def mask_rows_and_columns(matrix, keep):
+    keep = np.asarray(keep, dtype=bool)
+    coo = matrix.tocoo()
+    return _filter_entries(coo, keep[coo.row] & keep[coo.col])
+
+# set the entries (rows[i], cols[i]) and also (cols[i], rows[i]) of a square matrix to 0 in one pass
+def mask_symmetric_entries(matrix, rows, cols):
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    n = matrix.shape[1]
+    coo = matrix.tocoo()
+    keys = coo.row.astype(np.int64) * n + coo.col
+    masked_keys = np.concatenate((rows * n + cols, cols * n + rows))
+    return _filter_entries(coo, ~_contains_keys(keys, masked_keys))
+
+# randomly choose a maximum of "keep_x" entries per row of a symmetric matrix and set all other entries to 0. To keep
+# the matrix symmetric an entry (i,j) is only kept if it was chosen for row i as well as for row j, so afterwards every
+# row holds at most "keep_x" entries
+def subsample_symmetric_row_entries(matrix, keep_x):
+    m = csr_matrix(matrix)
+    m.sort_indices()
+    row_nnz = np.diff(m.indptr)
+    if len(row_nnz) == 0 or row_nnz.max() <= keep_x:
+        return m.copy()
+    rows = np.repeat(np.arange(m.shape[0]), row_nnz)
+
+    # rank the entries of each row by random priority and choose the first keep_x of them
+    order = np.lexsort((np.random.random_sample(m.nnz), rows))
+    rank = np.empty(m.nnz, dtype=np.int64)
+    rank[order] = np.arange(m.nnz) - m.indptr[rows[order]]
+    chosen = csr_matrix(((rank < keep_x).astype(float), m.indices, m.indptr), shape=m.shape)
+    chosen.eliminate_zeros()
+    symmetric_chosen = chosen.multiply(chosen.T)
+    return csr_matrix(m.multiply(symmetric_chosen))
 
 # execute the recal algorithm
 def execute_rescal(input_tensor, rank, useNeedTypeSlice=True, useConnectionSlice=True, init='nvecs', conv=1e-4,
@@ -180,6 +296,8 @@ def execute_rescal(input_tensor, rank, useNeedTypeSlice=True, useConnectionSlice
     _log.info('Datasize: %d x %d x %d | Rank: %d' % (
         temp_tensor[0].shape + (len(temp_tensor),) + (rank,))
     )
+    # imported here to keep the import of this module fast (RESCAL is only needed by the RESCAL algorithms)
+    from rescal import rescal_als
     A, R, _, _, _ = rescal_als(
         temp_tensor, rank, init=init, conv=conv,
         lambda_A=lambda_A, lambda_R=lambda_R, lambda_V=lambda_V, compute_fit='true'
@@ -200,35 +318,30 @@ def predict_rescal_als(input_tensor, rank, useNeedTypeSlice=True, useConnectionS
 
 # create a similarity matrix of needs (and attributes)
 def similarity_ranking(A):
+    from scipy.spatial.distance import pdist, squareform
     dist = squareform(pdist(A, metric='cosine'))
     return dist
 
-# return the specified indices from a sparse matrix as an numpy array
+# return the specified indices (tuple of index lists or PairIndex) from a matrix as an numpy array
 def matrix_to_array(m, indices):
+    if isinstance(indices, PairIndex):
+        return indices.getArrayFromMatrix(m)
     return np.array(m[indices])[0]
 
-# return the rescal predictions of the connection slice at the specified indices as an numpy array
+# return the rescal predictions of the connection slice at the specified indices as an numpy array. The score of the
+# pair (x, y) is A[y] * R * A[x], the indices are processed block by block
 def predict_rescal_connections_array(A, R, indices):
-    result = [np.dot(A[indices[0][i],:], np.dot(R[SparseTensor.CONNECTION_SLICE], A[indices[1][i],:])) for i in range(len(indices[0]))]
-    return result
+    if not isinstance(indices, PairIndex):
+        indices = PairIndex.fromPairs(indices[0], indices[1])
+    R_T = R[SparseTensor.CONNECTION_SLICE].T
 
-# return the rescal predictions of the connection slice at the specified indices as an numpy array
-def predict_rescal_connections_array(A, R, indices):
-    # result = [np.dot(A[indices[0][i],:], np.dot(R[SparseTensor.CONNECTION_SLICE], A[indices[1][i],:]))
-    #           for i in range(len(indices[0]))]
-    # due to performance reasons choose this implementation, not the above one
-    sorted_idx = np.argsort(indices[0])
-    from_needs = [indices[0][i] for i in sorted_idx]
-    to_needs = [indices[1][i] for i in sorted_idx]
-    result = np.zeros(len(sorted_idx))
-    need = None
-    need_vector = None
-    for i in range(len(from_needs)):
-        if (need != from_needs[i]):
-            need = from_needs[i]
-            need_vector = np.dot(R[SparseTensor.CONNECTION_SLICE], A[need,:])
-        result[sorted_idx[i]] = np.dot(A[to_needs[i],:], need_vector)
-    return result
+    def predict_block(block):
+        inner_product = np.dot(A[block.rows, :], R_T)
+        if block.product:
+            return np.dot(inner_product, A[block.cols, :].T)
+        return np.sum(inner_product * A[block.cols, :], axis=1)
+
+    return indices.mapBlocks(predict_block)
 
 # for rescal algorithm output predict connections by fixed threshold (higher threshold means higher precision)
 def predict_rescal_connections_by_threshold(A, R, threshold, all_offers, all_wants, test_needs):
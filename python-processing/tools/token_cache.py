@@ -0,0 +1,110 @@
+import json
+import sqlite3
+import hashlib
+
+
+class TokenCache:
+    """
+    Persistent cache of the token lists of documents in a SQLite database,
+    keyed by a hash of the document content. Every open of the cache starts
+    a new run, entries of the namespace that were not used during a run
+    (e.g. of documents that were removed from the corpus) can be evicted at
+    its end. Several namespaces (e.g. corpora or tokenizer configurations)
+    can share a database file.
+    """
+
+    # maximum number of keys per query (SQLite limits the query variables)
+    _QUERY_KEYS = 500
+
+    def __init__(self, filename, namespace=''):
+        """
+        :param filename: SQLite database file, created if it does not exist.
+        :param namespace: Part of every key, use different namespaces for
+        different corpora and tokenizer configurations (see
+        ScikitNltkTokenizerAdapter.config()).
+        """
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self._connection = sqlite3.connect(filename)
+        columns = [row[1] for row in
+                   self._connection.execute('PRAGMA table_info(tokens)')]
+        if columns and 'namespace' not in columns:
+            # cache of an older version without namespaces
+            self._connection.execute('DROP TABLE tokens')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, '
+            'namespace TEXT, tokens TEXT, run INTEGER)')
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS tokens_namespace_run '
+            'ON tokens (namespace, run)')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY)')
+        cursor = self._connection.execute('INSERT INTO runs VALUES (NULL)')
+        self.run = cursor.lastrowid
+        self._connection.commit()
+
+    def key(self, content):
+        """
+        Return the key of a document content (SHA-1 of namespace and content).
+        """
+        data = self.namespace + u'\0' + content
+        return hashlib.sha1(data.encode('utf8')).hexdigest()
+
+    def get_many(self, keys):
+        """
+        Return the cached token lists of the keys (None for missing keys) and
+        mark the found entries as used in this run.
+        """
+        found = {}
+        for i in range(0, len(keys), self._QUERY_KEYS):
+            part = keys[i:i + self._QUERY_KEYS]
+            rows = self._connection.execute(
+                'SELECT key, tokens FROM tokens WHERE key IN (%s)' %
+                ','.join('?' * len(part)), part)
+            for key, tokens in rows:
+                found[key] = json.loads(tokens)
+        self._connection.executemany(
+            'UPDATE tokens SET run = ? WHERE key = ?',
+            [(self.run, key) for key in found])
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        return [found.get(key) for key in keys]
+
+    def put_many(self, entries):
+        """
+        Store (key, token list) entries.
+        """
+        self._connection.executemany(
+            'INSERT OR REPLACE INTO tokens VALUES (?, ?, ?, ?)',
+            [(key, self.namespace, json.dumps(tokens), self.run)
+             for key, tokens in entries])
+        self._connection.commit()
+
+    def evict_unused(self):
+        """
+        Delete the entries of the namespace that were not used in this run.
+        Only call it after all documents of the corpus have been looked up.
+
+        :return: Number of deleted entries.
+        """
+        cursor = self._connection.execute(
+            'DELETE FROM tokens WHERE namespace = ? AND run < ?',
+            (self.namespace, self.run))
+        self._connection.commit()
+        return cursor.rowcount
+
+    def __len__(self):
+        return self._connection.execute(
+            'SELECT COUNT(*) FROM tokens WHERE namespace = ?',
+            (self.namespace,)).fetchone()[0]
+
+    def statistics(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                'size': len(self)}
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()